@@ -0,0 +1,265 @@
+"""Playing many headless games at once, for balancing.
+
+Each game gets a seed and a scripted player (a policy), and is run until it is
+won, lost or times out, with no window and no rendering. Games are spread
+across a process pool. Results stream into a columnar file as they come in:
+one fixed-width column per stat, written in row groups. A summary (win rate,
+time to clear, how often home falls, ammo use) is printed at the end.
+
+    python batch.py --games 10000 --policy aggressive --workers 8 --out results.bcb
+    python batch.py --read results.bcb
+
+Other options: --stages FILE, --seed FIRST, --max-ticks N, --ai random|flow,
+--enemy-spawn-rate S, --powerup-spawn-rate S and --tank TYPE:STAT=N (e.g.
+--tank Speed:speed=3, repeatable).
+
+File layout (little-endian)::
+
+    header      b'BCBR', u16 version, u16 column count,
+                per column: u8 name length, name, array typecode (1 byte)
+    row group   u32 rows, then each column's values (rows * item size bytes)
+"""
+import multiprocessing
+import os
+import random
+import struct
+import sys
+import time
+from array import array
+from collections.abc import Sequence
+from typing import BinaryIO
+
+from engine import Simulation, SCENE_STAGE_CLEAR, SCENE_GAMEOVER
+from policies import POLICIES
+from stages import Stage, StageError, load_stages
+
+MAGIC = b'BCBR'
+VERSION = 1
+HEADER = struct.Struct('<4sHH')
+ROWS = struct.Struct('<I')
+
+OUTCOME_WIN = 0
+OUTCOME_PLAYER_DESTROYED = 1
+OUTCOME_HOME_DESTROYED = 2
+OUTCOME_TIMEOUT = 3
+OUTCOME_STAGE_ERROR = 4
+OUTCOMES = ['win', 'player destroyed', 'home destroyed', 'timeout', 'stage error']
+
+# name -> array typecode, in file order
+COLUMNS: dict[str, str] = {
+    'seed': 'q',
+    'outcome': 'B',
+    'ticks': 'l',
+    'stages_cleared': 'H',
+    'first_clear': 'l',  # ticks until the first stage was cleared, -1 if never
+    'shots': 'l',
+    'kills': 'l',
+    'ammo_left': 'l',
+    'score': 'l',
+}
+
+def play(stages: Sequence[Stage], seed: int, policy: str = 'aggressive', max_ticks: int = 36000, ai: str = 'random',
+         enemy_spawn_rate: int = 10, powerup_spawn_rate: int = 6, tank_types: dict[str, dict[str, int]] | None = None) -> tuple:
+    """Plays one game to the end; returns a row in COLUMNS order."""
+    act = POLICIES[policy](random.Random(seed))
+    outcome = OUTCOME_TIMEOUT
+    cleared = 0
+    first_clear = -1
+    sim = None
+    try:
+        # inside the try: a first stage that won't load fails this game, not the worker
+        sim = Simulation(stages, seed=seed, ai=ai)
+        sim.input_source = lambda: act(sim)
+        sim.enemy_spawn_rate = enemy_spawn_rate
+        sim.powerup_spawn_rate = powerup_spawn_rate
+        for kind, stats in (tank_types or {}).items():
+            sim.tank_types[kind].update(stats)
+        sim.reschedule()
+
+        while sim.frame_count < max_ticks:
+            sim.step()
+            if not sim.is_home_active:
+                outcome = OUTCOME_HOME_DESTROYED
+                break
+            if sim.player.health == 0 or sim.scene == SCENE_GAMEOVER:
+                outcome = OUTCOME_PLAYER_DESTROYED
+                break
+            if sim.scene == SCENE_STAGE_CLEAR and cleared < sim.current_stage:
+                cleared = sim.current_stage
+                if first_clear < 0:
+                    first_clear = sim.frame_count
+                if cleared == len(stages):
+                    outcome = OUTCOME_WIN
+                    break
+    except StageError:
+        outcome = OUTCOME_STAGE_ERROR
+
+    if sim is None:
+        return (seed, outcome, 0, 0, first_clear, 0, 0, 0, 0)
+    return (seed, outcome, sim.frame_count, cleared, first_clear, sim.shots_fired, sim.kills, sim.player.ammo, sim.score)
+
+
+# per worker process: the stages, loaded once, and the settings every game shares
+_stages: Sequence[Stage] = ()
+_settings: dict = {}
+
+
+def _init_worker(stage_file: str, settings: dict) -> None:
+    global _stages, _settings
+    _stages = load_stages(stage_file)
+    _settings = settings
+
+
+def _play_seed(seed: int) -> tuple:
+    return play(_stages, seed, **_settings)
+
+
+class ResultWriter:
+    """Buffers rows and writes them out a row group at a time."""
+
+    def __init__(self, file: BinaryIO, group: int = 1024):
+        self.file = file
+        self.group = group
+        self.columns = {name: array(code) for name, code in COLUMNS.items()}
+        self.rows: int = 0
+
+        file.write(HEADER.pack(MAGIC, VERSION, len(COLUMNS)))
+        for name, code in COLUMNS.items():
+            file.write(bytes((len(name),)) + name.encode() + code.encode())
+
+    def add(self, row: tuple) -> None:
+        for column, value in zip(self.columns.values(), row):
+            column.append(value)
+        self.rows += 1
+        if self.rows == self.group:
+            self.flush()
+
+    def flush(self) -> None:
+        if not self.rows:
+            return
+        self.file.write(ROWS.pack(self.rows))
+        for column in self.columns.values():
+            if sys.byteorder != 'little':
+                column.byteswap()
+            self.file.write(column.tobytes())
+            del column[:]
+        self.file.flush()
+        self.rows = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
+
+
+def read_results(path: str) -> dict[str, array]:
+    """All row groups of a results file, one array per column."""
+    with open(path, 'rb') as file:
+        data = file.read()
+    magic, version, count = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f'{path} is not a version {VERSION} batch results file')
+    offset = HEADER.size
+    columns: dict[str, array] = {}
+    for _ in range(count):
+        length = data[offset]
+        name = data[offset + 1:offset + 1 + length].decode()
+        columns[name] = array(chr(data[offset + 1 + length]))
+        offset += length + 2
+
+    while offset + ROWS.size <= len(data):
+        (rows,) = ROWS.unpack_from(data, offset)
+        offset += ROWS.size
+        for column in columns.values():
+            size = rows * column.itemsize
+            if offset + size > len(data):
+                # a truncated last group; keep what is complete
+                return columns
+            chunk = array(column.typecode)
+            chunk.frombytes(data[offset:offset + size])
+            if sys.byteorder != 'little':
+                chunk.byteswap()
+            column.extend(chunk)
+            offset += size
+    return columns
+
+
+def summarize(columns: dict[str, array]) -> str:
+    games = len(columns['seed'])
+    if not games:
+        return 'no games'
+    outcomes = columns['outcome']
+    clears = [t for t in columns['first_clear'] if t >= 0]
+    lines = [f'{games} games']
+    for code, name in enumerate(OUTCOMES):
+        if n := outcomes.count(code):
+            lines.append(f'  {name:18} {n:8}  {n / games:7.1%}')
+    if clears:
+        lines.append(f'  first stage cleared in {sum(clears) / len(clears):.0f} ticks on average ({len(clears)} games)')
+    lines.append(f'  shots per game {sum(columns["shots"]) / games:.1f}, kills per game {sum(columns["kills"]) / games:.2f}, '
+                 f'ammo left {sum(columns["ammo_left"]) / games:.1f}')
+    lines.append(f'  ticks per game {sum(columns["ticks"]) / games:.0f}')
+    return '\n'.join(lines)
+
+
+def run_batch(stage_file: str, seeds: Sequence[int], out: str, workers: int | None = None, **settings) -> dict[str, array]:
+    """Plays a game per seed across a process pool, streaming rows to ``out``; returns the columns."""
+    writer = ResultWriter(open(out, 'wb'))
+    with multiprocessing.Pool(workers, _init_worker, (stage_file, settings)) as pool:
+        for row in pool.imap_unordered(_play_seed, seeds, chunksize=max(1, min(64, len(seeds) // (4 * (workers or os.cpu_count() or 1))))):
+            writer.add(row)
+    writer.close()
+    return read_results(out)
+
+
+def parse_tank(option: str) -> tuple[str, str, int]:
+    kind, _, stat = option.partition(':')
+    name, _, value = stat.partition('=')
+    return kind, name, int(value)
+
+
+def main(argv: list[str]) -> int:
+    options: dict[str, str] = {}
+    tanks: dict[str, dict[str, int]] = {}
+    rest = iter(argv)
+    for arg in rest:
+        if not arg.startswith('--'):
+            print(f'unexpected argument {arg}')
+            return 2
+        value = next(rest, '')
+        if arg == '--tank':
+            kind, name, n = parse_tank(value)
+            tanks.setdefault(kind, {})[name] = n
+        else:
+            options[arg] = value
+
+    if '--read' in options:
+        print(summarize(read_results(options['--read'])))
+        return 0
+
+    policy = options.get('--policy', 'aggressive')
+    if policy not in POLICIES:
+        print(f'unknown policy {policy}; pick from {list(POLICIES)}')
+        return 2
+    first = int(options.get('--seed', 0))
+    seeds = range(first, first + int(options.get('--games', 1000)))
+    settings = {
+        'policy': policy,
+        'max_ticks': int(options.get('--max-ticks', 36000)),
+        'ai': options.get('--ai', 'random'),
+        'enemy_spawn_rate': int(options.get('--enemy-spawn-rate', 10)),
+        'powerup_spawn_rate': int(options.get('--powerup-spawn-rate', 6)),
+        'tank_types': tanks,
+    }
+    workers = int(options['--workers']) if '--workers' in options else None
+    out = options.get('--out', 'batch_results.bcb')
+
+    start = time.perf_counter()
+    columns = run_batch(options.get('--stages', 'stage_data.json'), seeds, out, workers, **settings)
+    elapsed = time.perf_counter() - start
+    print(summarize(columns))
+    print(f'{len(seeds)} games in {elapsed:.1f}s, {sum(columns["ticks"]) / elapsed:.0f} ticks/s, written to {out}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
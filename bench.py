@@ -0,0 +1,402 @@
+"""Benchmarks for the headless simulation.
+
+``python bench.py alloc [TICKS]`` runs a seeded game with random input and
+counts the objects the game's own classes construct per tick (points, tanks,
+bullet handles, powerups, timers), how many of those came back out of a pool,
+plus the memory tracemalloc sees at the end.
+
+``python bench.py vecenv [ENVS]`` steps a VecEnv with random actions and
+reports environment steps per second.
+
+``python bench.py startup [RUNS]`` times cold starts, each in a fresh
+interpreter (median of RUNS): bare Python, importing the engine, and getting
+to the first tick from the JSON stages and from their compiled pack. It also
+times importing ``main`` if pyxel is installed; that must not open a window.
+
+``python bench.py suite`` runs the scaling scenarios below, from the real
+11x11 stage 1 up to generated 256x256 maps with hundreds of enemy spawners and
+thousands of bullets kept in flight. For each one it reports ticks per second
+(an uninstrumented run) and per-call latency percentiles of the hot paths (a
+second, instrumented run with the same seed). Results are written as JSON
+and compared against ``bench_baseline.json``; anything slower than the
+tolerance exits with status 1. With no baseline yet, the results become it,
+so the first run on a machine sets the bar for later ones. Options:
+
+    --quick             a fifth of the ticks
+    --only NAME,...     just these scenarios
+    --render            also time StageRenderer (needs pyxel and a display)
+    --out FILE          results file (default bench_results.json)
+    --baseline FILE     baseline to compare against (default bench_baseline.json)
+    --save-baseline     write the results as the new baseline instead
+    --tolerance X       allowed slowdown, 0.25 = 25% (default)
+
+Baselines are only comparable on the machine that made them, so they are
+kept out of git.
+"""
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from time import perf_counter_ns
+from typing import Callable
+
+from engine import Simulation, SCENE_PLAY, BTN_CONFIRM, BTN_RESTART
+from stagegen import make_stage
+
+STAGE_FILE = 'stage_data.json'
+RESULTS_FILE = 'bench_results.json'
+BASELINE_FILE = 'bench_baseline.json'
+GAME_MODULES = {'point', 'entities', 'projectiles', 'grid', 'scheduler'}
+
+# name -> map size (0: stage 1 of stage_data.json), enemy spawners, bullets kept in flight, ticks, enemy AI
+SCENARIOS: dict[str, dict] = {
+    'stage1': dict(size=0, spawners=0, bullets=0, ticks=6000, ai='random'),
+    'open-64': dict(size=64, spawners=64, bullets=500, ticks=3000, ai='random'),
+    'city-128': dict(size=128, spawners=200, bullets=1000, ticks=2000, ai='random'),
+    'flow-128': dict(size=128, spawners=200, bullets=0, ticks=2000, ai='flow'),
+    'city-256': dict(size=256, spawners=500, bullets=4000, ticks=1200, ai='random'),
+}
+SECTIONS = ('update_projectiles', 'update_enemies', 'enemy_move', 'attempt_move', 'is_walkable')
+RENDER_SECTIONS = ('draw', 'draw_cell')
+
+def load_rows(path: str = STAGE_FILE) -> list[list[list[int]]]:
+    with open(path, 'r') as file:
+        return [stage['stage'] for stage in json.load(file)['STAGE']]
+
+
+def random_input(seed: int):
+    rng = random.Random(seed)
+    tick = 0
+
+    def buttons() -> int:
+        nonlocal tick
+        tick += 1
+        # sparse presses: AND-ing three draws leaves each bit set 1/8 of the time
+        pressed = rng.getrandbits(7) & rng.getrandbits(7) & rng.getrandbits(7)
+        return pressed | (BTN_CONFIRM | BTN_RESTART if tick % 500 == 0 else 0)
+    return buttons
+
+
+def count_constructions(sim: Simulation, ticks: int) -> tuple[Counter, Counter]:
+    """Objects built during ``ticks``, and pooled ones initialised again, by class."""
+    made: Counter = Counter()
+    recycled: Counter = Counter()
+    # holding on to everything keeps ids unique, so a re-init is told apart from a new object
+    seen: dict[int, object] = {}
+
+    def profile(frame, event, arg):
+        if event == 'call' and frame.f_code.co_name == '__init__' and frame.f_globals.get('__name__') in GAME_MODULES:
+            obj = frame.f_locals.get('self')
+            caller = frame.f_back
+            # super().__init__ is the same construction
+            if caller and caller.f_code.co_name == '__init__' and caller.f_locals.get('self') is obj:
+                return
+            if id(obj) in seen:
+                recycled[type(obj).__name__] += 1
+            else:
+                seen[id(obj)] = obj
+                made[type(obj).__name__] += 1
+
+    sys.setprofile(profile)
+    try:
+        sim.run(ticks)
+    finally:
+        sys.setprofile(None)
+    return made, recycled
+
+
+def bench_alloc(ticks: int = 20000, seed: int = 1) -> None:
+    sim = Simulation(load_rows(), input_source=random_input(seed), ai='random', seed=seed)
+    sim.scene = SCENE_PLAY
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    made, recycled = count_constructions(sim, ticks)
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f'{ticks} ticks in {elapsed:.2f}s (profiled)')
+    for name, n in made.most_common():
+        print(f'  {name:12} {n:8} constructed  {n / ticks:8.4f} per tick  ({recycled[name]} recycled)')
+    print(f'  total        {sum(made.values()):8}              {sum(made.values()) / ticks:8.4f} per tick')
+    print(f'  traced memory {current / 1024:.0f} KiB now, {peak / 1024:.0f} KiB peak')
+
+
+def bench_vecenv(envs: int = 64, steps: int = 40000, seed: int = 1) -> None:
+    from vecenv import VecEnv
+
+    env = VecEnv(envs, seed=seed)
+    env.reset()
+    rng = random.Random(seed)
+    actions = [[rng.randrange(env.num_actions) for _ in range(envs)] for _ in range(64)]
+    episodes = 0
+    start = time.perf_counter()
+    for n in range(max(1, steps // envs)):
+        _, _, dones, _ = env.step(actions[n % 64])
+        episodes += sum(dones)
+    elapsed = time.perf_counter() - start
+    total = max(1, steps // envs) * envs
+    print(f'{envs} envs: {total} steps in {elapsed:.2f}s, {total / elapsed:.0f} steps/s, {episodes} episodes finished')
+
+
+# name -> what a fresh interpreter runs, in a directory holding a copy of the stage file
+STARTUP: dict[str, str] = {
+    'python': 'pass',
+    'import engine': 'import engine',
+    'first tick, json': 'from engine import Simulation; from stages import load_stages; '
+                        'Simulation(load_stages("stages.json")).step()',
+    'first tick, compiled': 'from engine import Simulation; from stages import load_stages; '
+                            'Simulation(load_stages("stages.json", cache=True)).step()',
+    'import main': 'import main',
+}
+
+
+def bench_startup(runs: int = 10) -> None:
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as work:
+        shutil.copy(os.path.join(here, STAGE_FILE), os.path.join(work, 'stages.json'))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (here, os.environ.get('PYTHONPATH')))))
+        for name, code in STARTUP.items():
+            times = []
+            for _ in range(runs):
+                start = time.perf_counter()
+                done = subprocess.run([sys.executable, '-c', code], cwd=work, env=env, capture_output=True)
+                times.append(time.perf_counter() - start)
+                if done.returncode:
+                    break
+            if done.returncode:
+                print(f'{name:22} failed: {done.stderr.decode().strip().splitlines()[-1]}')
+                continue
+            times.sort()
+            print(f'{name:22} {times[len(times) // 2] * 1000:7.1f} ms median, {times[0] * 1000:7.1f} ms best')
+
+
+def scenario_stages(scenario: dict, seed: int) -> list:
+    if not scenario['size']:
+        return load_rows()[:1]
+    return [make_stage(scenario['size'], scenario['spawners'], seed)]
+
+
+def top_up(sim: Simulation, count: int, cells: list[int], rng: random.Random) -> None:
+    """Fires bullets from random open cells until ``count`` are in flight."""
+    projectiles = sim.projectiles
+    c = sim.grid.c
+    for _ in range(2 * count):
+        if len(projectiles) >= count:
+            break
+        i, j = divmod(rng.choice(cells), c)
+        projectiles.fire(i, j, rng.randrange(4))
+
+
+def timed(owner: object, name: str, samples: list[int]) -> Callable[[], None]:
+    """Replaces ``owner.name`` with a wrapper that records each call's duration in ns; returns an undo."""
+    original: Callable = getattr(owner, name)
+    had_own = name in vars(owner)
+
+    def wrapper(*args, **kwargs):
+        start = perf_counter_ns()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            samples.append(perf_counter_ns() - start)
+    setattr(owner, name, wrapper)
+
+    def undo() -> None:
+        if had_own:
+            setattr(owner, name, original)
+        else:
+            delattr(owner, name)
+    return undo
+
+
+def percentiles(samples: list[int]) -> dict[str, float]:
+    if not samples:
+        return {'calls': 0}
+    ordered = sorted(samples)
+    n = len(ordered)
+    pick = lambda q: ordered[min(n - 1, int(q * n))] / 1000
+    return {
+        'calls': n,
+        'p50_us': round(pick(0.50), 2),
+        'p95_us': round(pick(0.95), 2),
+        'p99_us': round(pick(0.99), 2),
+        'max_us': round(ordered[-1] / 1000, 2),
+        'total_ms': round(sum(ordered) / 1e6, 2),
+    }
+
+
+def run_scenario(scenario: dict, ticks: int, seed: int, instrument: bool, renderer=None) -> tuple[float, dict[str, list[int]]]:
+    """Plays one scenario; returns seconds spent stepping and, if instrumented, per-section samples."""
+    sim = Simulation(scenario_stages(scenario, seed), input_source=random_input(seed), ai=scenario['ai'], seed=seed)
+    sim.scene = SCENE_PLAY
+    rng = random.Random(seed)
+    grid = sim.grid
+    open_cells = [k for k in range(grid.r * grid.c) if grid.is_walkable(*divmod(k, grid.c))]
+
+    samples: dict[str, list[int]] = {}
+    undo: list[Callable[[], None]] = []
+    if instrument:
+        for name in SECTIONS:
+            samples[name] = []
+            # a restart builds a new grid, so is_walkable is wrapped on the class
+            undo.append(timed(type(grid) if name == 'is_walkable' else sim, name, samples[name]))
+        # timers hold the bound methods they were given, so hand them the wrapped ones
+        sim.reschedule()
+    if renderer is not None:
+        for name in RENDER_SECTIONS:
+            samples[name] = []
+            undo.append(timed(renderer, name, samples[name]))
+
+    elapsed = 0
+    try:
+        for _ in range(ticks):
+            if scenario['bullets']:
+                top_up(sim, scenario['bullets'], open_cells, rng)
+            start = perf_counter_ns()
+            sim.step()
+            elapsed += perf_counter_ns() - start
+            if renderer is not None:
+                renderer.draw(sim)
+    finally:
+        for step in undo:
+            step()
+    return elapsed / 1e9, samples
+
+
+def bench_scenario(name: str, scenario: dict, ticks: int, seed: int, render: bool) -> dict:
+    elapsed, _ = run_scenario(scenario, ticks, seed, instrument=False)
+    _, samples = run_scenario(scenario, ticks, seed, instrument=True)
+    result = {
+        'ticks': ticks,
+        'ticks_per_s': round(ticks / elapsed, 1),
+        'sections': {section: percentiles(values) for section, values in samples.items()},
+    }
+    if render:
+        import pyxel as px
+        from render import StageRenderer
+        px.init(256, 256, title=f'bench {name}')
+        _, samples = run_scenario(scenario, ticks, seed, instrument=False, renderer=StageRenderer())
+        result['sections'].update({section: percentiles(values) for section, values in samples.items()})
+    return result
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Human-readable regressions of ``results`` against ``baseline``."""
+    regressions = []
+    for name, result in results['scenarios'].items():
+        if not (base := baseline.get('scenarios', {}).get(name)):
+            continue
+        if result['ticks_per_s'] < base['ticks_per_s'] * (1 - tolerance):
+            regressions.append(f'{name}: {result["ticks_per_s"]} ticks/s, baseline {base["ticks_per_s"]}')
+        for section, stats in result['sections'].items():
+            base_stats = base['sections'].get(section)
+            if not base_stats or not stats['calls'] or not base_stats['calls']:
+                continue
+            for key in ('p50_us', 'p95_us'):
+                # ignore sub-microsecond jitter
+                if stats[key] > base_stats[key] * (1 + tolerance) and stats[key] - base_stats[key] > 1:
+                    regressions.append(f'{name} {section} {key}: {stats[key]}, baseline {base_stats[key]}')
+    return regressions
+
+
+def print_results(results: dict) -> None:
+    for name, result in results['scenarios'].items():
+        print(f'{name}: {result["ticks"]} ticks, {result["ticks_per_s"]} ticks/s')
+        for section, stats in result['sections'].items():
+            if stats['calls']:
+                print(f'  {section:20} {stats["calls"]:9} calls  p50 {stats["p50_us"]:9.2f}us  p95 {stats["p95_us"]:9.2f}us  '
+                      f'p99 {stats["p99_us"]:9.2f}us  max {stats["max_us"]:10.2f}us')
+
+
+def bench_suite(options: dict[str, str]) -> int:
+    names = options['--only'].split(',') if '--only' in options else list(SCENARIOS)
+    if unknown := [name for name in names if name not in SCENARIOS]:
+        print(f'unknown scenarios {unknown}; pick from {list(SCENARIOS)}')
+        return 2
+    scale = 5 if '--quick' in options else 1
+    seed = int(options.get('--seed', 1))
+    results = {
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'scale': scale,
+        'scenarios': {},
+    }
+    for name in names:
+        scenario = SCENARIOS[name]
+        results['scenarios'][name] = bench_scenario(name, scenario, scenario['ticks'] // scale, seed, '--render' in options)
+    print_results(results)
+
+    if '--save-baseline' in options:
+        path = options.get('--baseline', BASELINE_FILE)
+        with open(path, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'baseline written to {path}')
+        return 0
+
+    path = options.get('--out', RESULTS_FILE)
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'results written to {path}')
+
+    baseline_path = options.get('--baseline', BASELINE_FILE)
+    try:
+        with open(baseline_path, 'r') as file:
+            baseline = json.load(file)
+    except FileNotFoundError:
+        with open(baseline_path, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'no baseline to compare against; these results are now the baseline in {baseline_path}')
+        return 0
+    if baseline.get('scale') != scale:
+        print('baseline was made with a different --quick setting; not comparing')
+        return 0
+    if regressions := compare(results, baseline, float(options.get('--tolerance', 0.25))):
+        print('regressions:')
+        for line in regressions:
+            print(f'  {line}')
+        return 1
+    print('no regressions against the baseline')
+    return 0
+
+
+def parse_args(argv: list[str]) -> tuple[list[str], dict[str, str]]:
+    args: list[str] = []
+    options: dict[str, str] = {}
+    rest = iter(argv)
+    for arg in rest:
+        if arg in ('--quick', '--render', '--save-baseline'):
+            options[arg] = ''
+        elif arg.startswith('--'):
+            options[arg] = next(rest, '')
+        else:
+            args.append(arg)
+    return args, options
+
+
+def main(argv: list[str]) -> int:
+    args, options = parse_args(argv)
+    if args[:1] == ['alloc']:
+        bench_alloc(*(int(arg) for arg in args[1:2]))
+        return 0
+    if args[:1] == ['vecenv']:
+        bench_vecenv(*(int(arg) for arg in args[1:2]))
+        return 0
+    if args[:1] == ['startup']:
+        bench_startup(*(int(arg) for arg in args[1:2]))
+        return 0
+    if args[:1] == ['suite']:
+        return bench_suite(options)
+    print('usage: python bench.py alloc [TICKS] | vecenv [ENVS] | startup [RUNS] | suite [--quick] [--only NAMES] [--render] [--save-baseline] ...')
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
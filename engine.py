@@ -0,0 +1,563 @@
+"""Headless Boom City simulation.
+
+Everything that decides what happens in a game lives here, free of pyxel, so the
+rules can be stepped as fast as the CPU allows (balancing runs, CI). Time comes
+from an injectable clock and input from an injectable source; main.py only
+feeds it keys and draws the result.
+"""
+from collections.abc import Sequence
+from functools import partial, reduce
+from operator import or_
+from hashlib import blake2b
+from typing import Callable, Literal, Protocol
+from random import Random, randrange
+
+from point import Point
+from entities import Tank, TankPool, Powerup
+from projectiles import Projectiles, Bullet
+from trajectory import EXIT, DELTAS
+from grid import Grid, CellState, TILE_HOME, TILE_BRICK
+from pathfinding import FlowField
+from registry import Registry
+from snapshot import Snapshot, KIND_CODES, take_snapshot, restore_snapshot
+from scheduler import TimerWheel, Timer, BudgetQueue, PHASE_SPAWN, PHASE_WORLD, PHASE_TANKS
+from stages import Stage, StageError, compile_stage, load_grid
+from telemetry import (
+    EV_SHOT, EV_POWERUP, EV_SPAWN, EV_HIT, EV_DEATH, EV_CLEAR, EV_GAMEOVER, ENEMY, POWERUP_CODES,
+)
+
+SCENE_TITLE = 0
+SCENE_PLAY = 1
+SCENE_GAMEOVER = 2
+SCENE_STAGE_CLEAR = 3
+
+CURR_SCORE = 0
+CURR_LIVES = 3
+CURR_STAGE = 1
+
+FPS = 60
+
+# stats each enemy type spawns with, on top of Tank's defaults
+TANK_TYPES: dict[str, dict[str, int]] = {
+    'Attack': {'attack_dmg': 2},
+    'Health': {'health': 6},
+    'Speed': {'speed': 4},
+    'Normie': {},
+}
+
+# tanks further than far_radius from the player act on one in this many of their move ticks
+FAR_SKIP = 4
+
+# with an AI budget, each enemy's moves are shifted by (its cell * STAGGER) % interval ticks
+STAGGER = 0x9E3779B1
+
+# one bit per button, a tick's input is the OR of everything held/pressed
+BTN_UP = 1 << 0
+BTN_DOWN = 1 << 1
+BTN_LEFT = 1 << 2
+BTN_RIGHT = 1 << 3
+BTN_SHOOT = 1 << 4
+BTN_CONFIRM = 1 << 5
+BTN_RESTART = 1 << 6
+BTN_ENEMY_FIRE = 1 << 7  # debug: every enemy shoots
+BTN_CLEAR_ENEMIES = 1 << 8  # debug: wipe the enemy list
+
+# one bitmask, or one per player in a multiplayer game
+InputSource = Callable[[], int | Sequence[int]]
+
+# attempt_move(y, x) arguments per facing code N E S W
+MOVES: list[tuple[int, int]] = [(0, 1), (1, 0), (0, -1), (-1, 0)]
+
+
+class Clock(Protocol):
+    frame_count: int
+
+    def advance(self) -> None: ...
+
+
+class TickClock:
+    """Counts simulation ticks; the default clock when nothing is injected."""
+
+    def __init__(self, frame_count: int = 0):
+        self.frame_count: int = frame_count
+
+    def advance(self) -> None:
+        self.frame_count += 1
+
+
+def no_input() -> int:
+    return 0
+
+
+def startable(stage: Stage | list[list[int]], level: int = 0) -> bool:
+    """Whether ``new_game`` can start ``stage``."""
+    try:
+        if not isinstance(stage, Stage):
+            stage = compile_stage(stage, level)
+    except StageError:
+        return False
+    return stage.player is not None
+
+
+def start_cells(grid: Grid, start: int, count: int) -> list[tuple[int, int]]:
+    """The player start and, for more players, the free cells nearest to it, nearest first."""
+    cells = [divmod(start, grid.c)]
+    seen = {cells[0]}
+    for i, j in cells:
+        if len(cells) >= count:
+            break
+        for di, dj in DELTAS:
+            if (i + di, j + dj) not in seen and grid.is_walkable(i + di, j + dj):
+                seen.add((i + di, j + dj))
+                cells.append((i + di, j + dj))
+    if len(cells) < count:
+        raise StageError(f'no room for {count} players around the player start')
+    return cells[:count]
+
+
+class Simulation:
+
+    def __init__(self, stages: Sequence[Stage] | list[list[list[int]]], clock: Clock | None = None, input_source: InputSource = no_input, fps: int = FPS, ai: Literal['random', 'flow'] = 'random', seed: int | None = None, far_radius: int | None = None, players: int = 1, ai_budget: BudgetQueue[Tank] | None = None):
+        self.stages = stages
+        self.ai = ai
+        self.far_radius = far_radius
+        # None: every enemy acts the tick its timer fires; else moves are staggered and queued, see schedule_enemy
+        self.ai_budget = ai_budget
+        # every roll comes from here, so the seed plus the input replays a game exactly
+        self.seed: int = randrange(1 << 32) if seed is None else seed
+        self.rng = Random(self.seed)
+        self.recorder = None  # replay.Recorder while a session is being recorded
+        self.telemetry = None  # telemetry.Telemetry while events are being logged
+        self.clock: Clock = clock if clock is not None else TickClock()
+        self.input_source: InputSource = input_source
+        self.fps = fps
+        self.buttons: int = 0  # everyone's buttons OR-ed together
+        self.player_buttons: Sequence[int] = (0,)
+        # players[0] is also ``player``; the others start on the free cells nearest to it
+        self.player_count = players
+
+        self.current_stage = CURR_STAGE
+        self.score = CURR_SCORE
+        self.stage: Stage | list[list[int]] = self.stages[self.current_stage - 1]
+        self.scene = SCENE_TITLE
+        self.enemy_spawn_rate = 10
+        self.powerup_spawn_rate = 6
+        self.tank_types: dict[str, dict[str, int]] = {kind: dict(stats) for kind, stats in TANK_TYPES.items()}
+        self.shots_fired: int = 0
+        self.kills: int = 0
+        self.timers = TimerWheel()
+        self.tanks = TankPool()
+        self.enemies: Registry[Tank] = Registry()
+        self.powerups: Registry[Powerup] = Registry()
+
+        self.new_game(self.stage)
+
+    @property
+    def frame_count(self) -> int:
+        return self.clock.frame_count
+
+    @property
+    def bullet(self) -> Bullet | None:
+        """The (first) player's bullet in flight, if any; a player has at most one."""
+        return self.projectiles.player_bullet()
+
+    def __getitem__(self, idx: tuple[int, int]) -> CellState:
+        return self.grid[idx]
+
+    @property
+    def r(self) -> int:
+        return self.grid.r
+
+    @property
+    def c(self) -> int:
+        return self.grid.c
+
+    def in_bounds(self, i: int, j: int) -> bool:
+        return 0 <= i < self.grid.r and 0 <= j < self.grid.c
+
+    def pressed(self, button: int) -> bool:
+        return bool(self.buttons & button)
+
+    def step(self, buttons: int | Sequence[int] | None = None) -> None:
+        """Advance one tick, pulling input from the input source unless given; one bitmask per player in multiplayer."""
+        if buttons is None:
+            buttons = self.input_source()
+        if type(buttons) is int:
+            self.buttons = buttons
+            self.player_buttons = (buttons,)
+        else:
+            self.player_buttons = buttons
+            self.buttons = reduce(or_, buttons, 0)
+        if self.recorder is not None:
+            self.recorder.record(self)
+        self.update()
+        self.clock.advance()
+
+    def run(self, ticks: int) -> None:
+        for _ in range(ticks):
+            self.step()
+
+    def ticks(self, per_second: int) -> int:
+        """Interval in ticks for something that happens ``per_second`` times a second."""
+        return max(1, self.fps // per_second)
+
+    def reschedule(self) -> None:
+        """Registers every periodic job again, e.g. after a new stage or an fps change."""
+        timers = self.timers
+        now = self.frame_count
+        timers.clear()
+        timers.every(self.fps * self.enemy_spawn_rate, self.spawn_enemies, now, PHASE_SPAWN)
+        timers.every(self.fps * self.powerup_spawn_rate, self.spawn_powerups, now, PHASE_SPAWN)
+        timers.every(self.ticks(10), self.update_projectiles, now)
+        timers.every(self.ticks(1), self.update_shield, now, PHASE_TANKS)
+        self.enemy_timers: dict[int, Timer] = {}
+        for enemy in self.enemies:
+            self.schedule_enemy(enemy)
+
+    def schedule_enemy(self, enemy: Tank) -> None:
+        interval = self.ticks(enemy.speed)
+        # tanks spawned together would otherwise all act on the same ticks
+        offset = 0 if self.ai_budget is None else (enemy.pos.x * self.grid.c + enemy.pos.y) * STAGGER % interval
+        self.enemy_timers[enemy.uid] = self.timers.every(interval, partial(self.enemy_move, enemy), self.frame_count, PHASE_TANKS, offset)
+
+    def remove_enemy(self, enemy: Tank) -> None:
+        if timer := self.enemy_timers.pop(enemy.uid, None):
+            timer.cancel()
+        self.enemies.remove(enemy)
+        self.grid.set_entity(enemy.pos.x, enemy.pos.y, None)
+        self.tanks.release(enemy)
+
+    def snapshot(self, base: Snapshot | None = None) -> Snapshot:
+        """Captures the game for ``restore``; see snapshot.py."""
+        return take_snapshot(self, base)
+
+    def restore(self, snap: Snapshot) -> None:
+        restore_snapshot(self, snap)
+
+    def state_hash(self) -> int:
+        """64-bit digest of everything that decides what happens next; uids are left out, they differ per process."""
+        grid = self.grid
+        projectiles = self.projectiles
+        h = blake2b(digest_size=8)
+        h.update(repr((self.frame_count, self.scene, self.current_stage, self.score, self.is_home_active)).encode())
+        for layer in (grid.type, grid.health, grid.rotation, grid.dir_broke, projectiles.cell, projectiles.facing, projectiles.intensity):
+            h.update(layer)
+        h.update(repr(projectiles.slot_of.get(projectiles.player_uid)).encode())
+        if len(self.players) > 1:
+            h.update(repr([projectiles.slot_of.get(uid) for uid in projectiles.player_uids[1:]]).encode())
+        tanks = [*self.players, *self.enemies]
+        h.update(repr([
+            (t.pos.x, t.pos.y, t.facing_code, t.health, t.alive, t.ammo, t.is_invulnerable_counter, t.speed, t.attack_dmg) for t in tanks
+        ]).encode())
+        h.update(repr(sorted(spot for spot in self.powerup_spawn_spots if grid.powerup_at(*spot))).encode())
+        if self.ai_budget:
+            h.update(repr([(t.pos.x, t.pos.y) for uid, t in self.ai_budget.queue if t.uid == uid]).encode())
+        h.update(repr(self.rng.getstate()).encode())
+        return int.from_bytes(h.digest(), 'little')
+
+    def update(self) -> None:
+        now = self.frame_count
+
+        self.timers.run(now, PHASE_SPAWN)
+
+        if self.scene == SCENE_TITLE:
+            self.update_title_scene()
+
+        if self.player.health == 0 and all(player.health == 0 for player in self.players) or not self.is_home_active:
+            if self.scene != SCENE_GAMEOVER and (log := self.telemetry) is not None:
+                log.emit(now, EV_GAMEOVER, self.current_stage, self.score, self.kills)
+            self.scene = SCENE_GAMEOVER
+            self.update_gameover_scene()
+
+        if len(self.enemies) == 0:
+            if self.scene != SCENE_STAGE_CLEAR and (log := self.telemetry) is not None:
+                log.emit(now, EV_CLEAR, self.current_stage, self.score, self.kills)
+            self.scene = SCENE_STAGE_CLEAR
+            self.update_next_stage()
+
+        if buttons := self.buttons:
+            players = self.players
+            if len(players) == 1:
+                acting = ((0, buttons),)
+            else:
+                # in multiplayer a destroyed player sits the rest of the stage out
+                acting = [(n, pressed) for n, pressed in enumerate(self.player_buttons) if pressed and players[n].alive]
+            for n, pressed in acting:
+                player = players[n]
+                if pressed & BTN_UP:
+                    self.attempt_move(0, 1, player)
+                if pressed & BTN_DOWN:
+                    self.attempt_move(0, -1, player)
+                if pressed & BTN_RIGHT:
+                    self.attempt_move(1, 0, player)
+                if pressed & BTN_LEFT:
+                    self.attempt_move(-1, 0, player)
+
+            if buttons & BTN_ENEMY_FIRE:
+                for enemy in self.enemies:
+                    self.enemy_shoot(enemy)
+            if buttons & BTN_CLEAR_ENEMIES:
+                for timer in self.enemy_timers.values():
+                    timer.cancel()
+                self.enemy_timers.clear()
+                self.enemies.clear()
+
+            if buttons & BTN_SHOOT:
+                for n, pressed in acting:
+                    if pressed & BTN_SHOOT:
+                        self.shoot(n)
+
+        self.timers.run(now, PHASE_WORLD)
+        self.update_player()
+        self.update_enemies()
+        self.timers.run(now, PHASE_TANKS)
+        if self.ai_budget is not None:
+            self.ai_budget.run(self.queued_move)
+        if (log := self.telemetry) is not None:
+            log.tick(self)
+
+    def is_walkable(self, point: Point) -> bool:
+        return self.grid.is_walkable(point.x, point.y)
+
+    def shoot(self, n: int = 0) -> None:
+        player = self.players[n]
+        if not self.projectiles.player_uids[n] and player.ammo > 0:
+            if self.in_bounds(player.front_x, player.front_y):
+                self.projectiles.fire(player.front_x, player.front_y, player.facing_code, player=n)
+                if (log := self.telemetry) is not None:
+                    log.emit(self.frame_count, EV_SHOT, n, player.front_x * self.grid.c + player.front_y, player.facing_code)
+
+            player.ammo -= 1
+            self.shots_fired += 1
+
+    def enemy_shoot(self, enemy: Tank) -> None:
+        if enemy.ammo > 0:
+            if self.in_bounds(enemy.front_x, enemy.front_y):
+                self.projectiles.fire(enemy.front_x, enemy.front_y, enemy.facing_code)
+                if (log := self.telemetry) is not None:
+                    log.emit(self.frame_count, EV_SHOT, ENEMY, enemy.front_x * self.grid.c + enemy.front_y, enemy.facing_code)
+
+            enemy.ammo -= 1
+
+    def shot_target(self, tank: Tank) -> Literal['player', 'home', None]:
+        """What a shot fired by ``tank`` right now would hit first, judging by terrain and the players."""
+        i, j = tank.front_x, tank.front_y
+        if not self.in_bounds(i, j):
+            return None
+        c = self.grid.c
+        cells, end = self.projectiles.trajectories.path(i * c + j, tank.facing_code)
+        if tank not in self.players and any(player.pos.x * c + player.pos.y in cells for player in self.players):
+            return 'player'
+        if end < EXIT and self.grid.type[cells[-1]] == TILE_HOME:
+            return 'home'
+        return None
+
+    def update_projectiles(self) -> None:
+        if self.projectiles.step():
+            self.is_home_active = False
+
+    def update_enemies(self) -> None:
+        grid = self.grid
+        projectiles = self.projectiles
+
+        # only players' bullets hurt enemies
+        for uid in projectiles.player_uids:
+            if not uid:
+                continue
+            k = projectiles.cell[projectiles.slot_of[uid]]
+            if (enemy := grid.entity_at(k // grid.c, k % grid.c)) and enemy not in self.players and enemy.alive:
+                enemy.damage(projectiles.intensity[projectiles.slot_of[uid]])
+                projectiles.remove(uid)
+                if (log := self.telemetry) is not None:
+                    log.emit(self.frame_count, EV_HIT, ENEMY, k, enemy.health)
+                if not enemy.alive and enemy in self.enemies:
+                    self.kills += 1
+                    if log is not None:
+                        log.emit(self.frame_count, EV_DEATH, KIND_CODES[enemy.type], k, self.kills)
+                    self.remove_enemy(enemy)
+
+        if self.ai == 'flow':
+            goals = tuple(player.pos.x * grid.c + player.pos.y for player in self.players)
+            self.flow.set_goals(goals if self.home is None else (self.home, *goals))
+
+    def update_player(self) -> None:
+        grid = self.grid
+        projectiles = self.projectiles
+
+        for player in self.players:
+            if uid := grid.projectile[k := player.pos.x * grid.c + player.pos.y]:
+                player.damage(projectiles.intensity[projectiles.slot_of[uid]])
+                projectiles.remove(uid)
+                if (log := self.telemetry) is not None:
+                    log.emit(self.frame_count, EV_HIT, self.players.index(player), k, player.health)
+
+    def update_shield(self) -> None:
+        for player in self.players:
+            if player.is_invulnerable_counter:
+                player.is_invulnerable_counter -= 1
+
+    def enemy_move(self, enemy: Tank) -> None:
+        if self.ai_budget is not None:
+            self.ai_budget.push(enemy.uid, enemy)
+        else:
+            self.enemy_act(enemy)
+
+    def queued_move(self, uid: int, enemy: Tank) -> None:
+        # skip tanks destroyed while they waited, whether or not the pool has handed them out again
+        if enemy.uid == uid and enemy in self.enemies:
+            self.enemy_act(enemy)
+
+    def enemy_act(self, enemy: Tank) -> None:
+        if self.far_radius is not None and self.is_far(enemy) and self.frame_count // self.ticks(enemy.speed) % FAR_SKIP:
+            return
+        if self.ai == 'flow':
+            self.seek(enemy)
+        else:
+            self.wander(enemy)
+
+    def is_far(self, tank: Tank) -> bool:
+        """Whether ``tank`` is off in parts of the map no player can see, where it may act less often."""
+        x, y = tank.pos.x, tank.pos.y
+        player = self.player
+        if max(abs(x - player.pos.x), abs(y - player.pos.y)) <= self.far_radius:
+            return False
+        return all(max(abs(x - player.pos.x), abs(y - player.pos.y)) > self.far_radius for player in self.players[1:])
+
+    def wander(self, enemy: Tank) -> None:
+        roll: int = self.rng.randint(0, 6)
+        if roll == 0:
+            self.attempt_move(1, 0, enemy)
+        if roll == 1:
+            self.attempt_move(-1, 0, enemy)
+        if roll == 2:
+            self.attempt_move(0, 1, enemy)
+        if roll == 3:
+            self.attempt_move(0, -1, enemy)
+        if roll == 4:
+            self.enemy_shoot(enemy)
+
+    def seek(self, enemy: Tank) -> None:
+        """Goal-directed move: shoot if the shot lands, else step down the flow field."""
+        if self.shot_target(enemy):
+            self.enemy_shoot(enemy)
+            return
+
+        grid = self.grid
+        i, j = enemy.pos.x, enemy.pos.y
+        for f in self.flow.directions(i * grid.c + j):
+            di, dj = DELTAS[f]
+            nk = (i + di) * grid.c + j + dj
+            # a brick in the way, or home or a player right there: turn and fire
+            if grid.type[nk] == TILE_BRICK or nk in self.flow.goals:
+                enemy.facing_code = f
+                self.enemy_shoot(enemy)
+                return
+            if grid.is_walkable(i + di, j + dj):
+                self.attempt_move(*MOVES[f], enemy)
+                return
+
+        # boxed in by other tanks
+        self.wander(enemy)
+
+    def spawn_enemies(self):
+        grid = self.grid
+        for spot in self.enemy_spawn_spots:
+            if not grid.entity_at(*spot):
+                kind = self.enemy_spawn_spots[spot]
+                self.enemies.add(entity := self.tanks.acquire(*spot, type=kind, **self.tank_types[kind]))
+                grid.set_entity(*spot, entity)
+                self.schedule_enemy(entity)
+                if (log := self.telemetry) is not None:
+                    log.emit(self.frame_count, EV_SPAWN, KIND_CODES[kind], spot[0] * grid.c + spot[1])
+
+    def spawn_powerups(self):
+        grid = self.grid
+        for spot in self.powerup_spawn_spots:
+            if not grid.powerup_at(*spot):
+                self.powerups.add(powerup := self.powerup_spawn_spots[spot])
+                grid.set_powerup(*spot, powerup)
+
+    def attempt_move(self, y: int, x: int, entity: Tank) -> None:
+        grid = self.grid
+
+        new_pos_x, new_pos_y = entity.pos.x - x, entity.pos.y + y
+
+        if grid.is_walkable(new_pos_x, new_pos_y):
+            if entity in self.players:
+                if powerup := grid.powerup_at(new_pos_x, new_pos_y):
+                    if powerup.type == 'bullet':
+                        entity.ammo += powerup.intensity
+                    if powerup.type == 'health':
+                        entity.health += powerup.intensity
+                    if powerup.type == 'shield':
+                        entity.is_invulnerable_counter += powerup.intensity
+                    grid.set_powerup(new_pos_x, new_pos_y, None)
+                    self.powerups.discard(powerup)
+                    if (log := self.telemetry) is not None:
+                        log.emit(self.frame_count, EV_POWERUP, self.players.index(entity), POWERUP_CODES[powerup.type], powerup.intensity)
+            grid.set_entity(entity.pos.x, entity.pos.y, None)
+            entity.move(x, y)
+            grid.set_entity(entity.pos.x, entity.pos.y, entity)
+
+    def new_game(self, stage: Stage | list[list[int]], players: Sequence[Tank] = ()) -> None:
+        """Starts ``stage``; ``players`` from the stage before carry their facing, health and ammo over."""
+
+        if not isinstance(stage, Stage):
+            stage = compile_stage(stage)
+        if stage.player is None:
+            raise StageError(f'stage {stage.level} has no player start')
+
+        for enemy in self.enemies:
+            self.tanks.release(enemy)
+        self.enemies.clear()
+        self.powerups.clear()
+        if self.ai_budget is not None:
+            self.ai_budget.clear()
+        self.is_home_active: bool = True
+
+        self.grid = grid = load_grid(stage)
+        self.projectiles = Projectiles(grid, self.player_count)
+        self.flow = FlowField(grid)
+        self.home: int | None = stage.home
+        self.enemy_spawn_spots = grid.enemy_spawn_spots
+        self.powerup_spawn_spots = grid.powerup_spawn_spots
+
+        self.players: list[Tank] = []
+        for n, (i, j) in enumerate(start_cells(grid, stage.player, self.player_count)):
+            if n < len(players):
+                before = players[n]
+                tank = Tank(Point(i, j), before.facing, before.health, before.ammo)
+            else:
+                tank = Tank(Point(i, j), 'N')
+            self.players.append(tank)
+            grid.set_entity(i, j, tank)
+        self.player = self.players[0]
+        self.reschedule()
+
+        if self.frame_count > 0:
+            self.spawn_powerups()
+            self.spawn_enemies()
+
+    def update_gameover_scene(self) -> None:
+        # a broken first stage (e.g. a bad hot reload) leaves the game over screen up rather than raising out of step()
+        if self.pressed(BTN_RESTART) and startable(self.stage):
+            self.scene = SCENE_TITLE
+            self.current_stage = CURR_STAGE
+            self.new_game(self.stage)
+
+    def update_title_scene(self):
+        if self.pressed(BTN_CONFIRM):
+            self.scene = SCENE_PLAY
+
+    def update_next_stage(self) -> None:
+        if self.pressed(BTN_CONFIRM) and (n := self.next_stage()) is not None:
+            self.current_stage = n
+            self.new_game(self.stages[n - 1], self.players)
+            self.scene = SCENE_PLAY
+
+    def next_stage(self) -> int | None:
+        """Number of the next stage that can be started, skipping broken ones; None after the last."""
+        for n in range(self.current_stage, len(self.stages)):
+            if startable(self.stages[n], n + 1):
+                return n + 1
+        return None
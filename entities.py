@@ -0,0 +1,117 @@
+from dataclasses import dataclass, field
+from itertools import count
+from typing import Literal
+from point import Point
+from projectiles import FACING_NAMES, FACING_INDEX
+from trajectory import DELTAS
+
+# grid occupancy arrays store these instead of object references; 0 means empty
+_uids = count(1)
+
+
+class Entity:
+
+    __slots__ = ('pos', 'facing_code', 'health', 'alive', 'is_invulnerable_counter', 'uid')
+
+    def __init__(self, pos: Point, facing: Literal['N', 'E', 'S', 'W'] = 'N', health: int = 1):
+        self.pos: Point = pos
+        self.facing_code: int = FACING_INDEX[facing]
+        self.health: int = health
+        self.alive: bool = True
+        self.is_invulnerable_counter: int = 0
+        self.uid: int = next(_uids)
+
+    @property
+    def facing(self) -> Literal['N', 'E', 'S', 'W']:
+        return FACING_NAMES[self.facing_code]
+
+    @facing.setter
+    def facing(self, facing: Literal['N', 'E', 'S', 'W']) -> None:
+        self.facing_code = FACING_INDEX[facing]
+
+    @property
+    def _pos(self) -> tuple[int, int]:
+        return (self.pos.x, self.pos.y)
+
+    def rotate(self, direction: Literal['N', 'E', 'S', 'W', 'CW', 'CCW']) -> None:
+        if direction == 'CW':
+            self.facing_code = (self.facing_code + 1) & 3
+        elif direction == 'CCW':
+            self.facing_code = (self.facing_code - 1) & 3
+        elif direction in FACING_INDEX:
+            self.facing_code = FACING_INDEX[direction]
+
+    def move(self, x: int | float, y: int | float) -> None:
+        x, y = int(x), int(y)
+        pos = self.pos
+        pos.x, pos.y = pos.x - x, pos.y + y
+        if x > 0:
+            self.facing_code = 0
+        elif x < 0:
+            self.facing_code = 2
+        elif y > 0:
+            self.facing_code = 1
+        elif y < 0:
+            self.facing_code = 3
+
+    @property
+    def front_x(self) -> int:
+        return self.pos.x + DELTAS[self.facing_code][0]
+
+    @property
+    def front_y(self) -> int:
+        return self.pos.y + DELTAS[self.facing_code][1]
+
+    def front(self) -> Point:
+        return Point(self.front_x, self.front_y)
+
+    def damage(self, damage: int = 1):
+        if self.alive:
+            if not self.is_invulnerable_counter:
+
+                self.health -= damage
+                if self.health < 1:
+                    self.alive = False
+
+class Tank(Entity):
+
+    __slots__ = ('ammo', 'attack_dmg', 'speed', 'type')
+
+    def __init__(self, pos: Point, facing: Literal['N', 'E', 'S', 'W'] = 'N', health: int = 3, ammo: int = 10, attack_dmg: int = 1, speed: int = 2, type: Literal['Health', 'Attack', 'Speed', 'Normie'] = 'Normie'):
+        self.ammo: int = ammo
+        self.attack_dmg: int = attack_dmg
+        self.speed: int = speed
+        self.type: Literal['Health', 'Attack', 'Speed', 'Normie'] = type
+        super().__init__(pos, facing, health)
+
+    def __repr__(self) -> str:
+        return f'Tank with {self.health} health, {self.ammo} ammo, {self.alive} alive, {self.speed} speed, {self.attack_dmg} attack, {self.__hash__}'
+
+class TankPool:
+    """Destroyed tanks waiting to be spawned again, so waves of enemies don't allocate."""
+
+    def __init__(self):
+        self.free: list[Tank] = []
+
+    def __len__(self) -> int:
+        return len(self.free)
+
+    def acquire(self, i: int, j: int, **stats) -> Tank:
+        if not self.free:
+            return Tank(Point(i, j), **stats)
+        tank = self.free.pop()
+        pos = tank.pos
+        pos.x, pos.y = i, j
+        # a fresh uid too: nothing may confuse the recycled tank with its past life
+        tank.__init__(pos, **stats)
+        return tank
+
+    def release(self, tank: Tank) -> None:
+        self.free.append(tank)
+
+
+@dataclass(slots=True)
+class Powerup:
+    type: Literal['health', 'bullet', 'shield', 'win']
+    intensity: int = 1
+    uid: int = field(default_factory=lambda: next(_uids), init=False, compare=False, repr=False)
@@ -0,0 +1,246 @@
+"""Struct-of-arrays storage for the stage grid.
+
+Every per-cell field lives in its own flat typed array indexed by
+``i * c + j``: tile type codes, tile health, mirror rotation and the
+direction a brick was broken from are bytearrays, while entity, projectile
+and powerup occupancy are arrays of uids (0 means empty); projectile uids
+belong to the ``Projectiles`` manager registered as ``bullets``. Rules read
+and write these arrays directly; whole-map passes such as ``walkable_mask``
+run over them in C via ``bytes.translate``. ``CellState`` and ``Tile`` are
+thin views over one cell for code that still wants the old object API.
+"""
+from array import array
+from typing import Literal
+
+from entities import Entity, Powerup
+
+TILE_NONE = 0
+TILE_FOREST = 1
+TILE_HOME = 2
+TILE_WATER = 3
+TILE_STONE = 4
+TILE_BRICK = 5
+TILE_MIRROR = 6
+TILE_ENEMY_SPAWNER = 7
+TILE_POWERUP_SPAWNER = 8
+
+TILE_TYPES: list[Literal['Forest', 'Home', 'Water', 'Stone', 'Brick', 'Mirror', 'EnemySpawner', 'PowerupSpawner', None]] = [
+    None, 'Forest', 'Home', 'Water', 'Stone', 'Brick', 'Mirror', 'EnemySpawner', 'PowerupSpawner',
+]
+TILE_CODES = {name: code for code, name in enumerate(TILE_TYPES)}
+
+ROT_NONE = 0
+ROT_BACKSLASH = 1
+ROT_SLASH = 2
+
+ROTATIONS: list[Literal['\\', '/', None]] = [None, '\\', '/']
+ROTATION_CODES = {rotation: code for code, rotation in enumerate(ROTATIONS)}
+
+FACINGS: list[Literal['N', 'E', 'S', 'W', None]] = [None, 'N', 'E', 'S', 'W']
+FACING_CODES = {facing: code for code, facing in enumerate(FACINGS)}
+
+MOVABLE: list[Literal['Forest', 'EnemySpawner', 'PowerupSpawner', None]] = [None, 'Forest', 'EnemySpawner', 'PowerupSpawner']
+
+# translate() table: tile code -> 1 if tanks may stand on it
+WALKABLE = bytes(1 if code < len(TILE_TYPES) and TILE_TYPES[code] in MOVABLE else 0 for code in range(256))
+
+
+class Grid:
+
+    def __init__(self, r: int, c: int):
+        self.r: int = r
+        self.c: int = c
+        n = r * c
+
+        self.type = bytearray(n)
+        self.health = bytearray(n)
+        self.rotation = bytearray(n)
+        self.dir_broke = bytearray(n)
+
+        self.entity = array('q', bytes(8 * n))
+        self.projectile = array('q', bytes(8 * n))
+        self.powerup = array('q', bytes(8 * n))
+        self.objects: dict[int, Entity | Powerup] = {}
+        self.bullets = None  # the Projectiles that owns the projectile layer
+        # journal of cells whose tile changed; readers keep their own position in it
+        self.changed_tiles: list[int] = []
+
+        self.enemy_spawn_spots: dict[tuple[int, int], Literal['Health', 'Attack', 'Speed', 'Normie']] = {}
+        self.powerup_spawn_spots: dict[tuple[int, int], Powerup] = {}
+
+    def __getitem__(self, idx: tuple[int, int]) -> 'CellState':
+        i, j = idx
+        return CellState(self, i, j)
+
+    def in_bounds(self, i: int, j: int) -> bool:
+        return 0 <= i < self.r and 0 <= j < self.c
+
+    def set_tile(self, i: int, j: int, type: int, health: int = 0, rotation: int = ROT_NONE) -> None:
+        k = i * self.c + j
+        self.type[k] = type
+        self.health[k] = health
+        self.rotation[k] = rotation
+        self.dir_broke[k] = 0
+        self.changed_tiles.append(k)
+
+    def is_walkable(self, i: int, j: int) -> bool:
+        if not (0 <= i < self.r and 0 <= j < self.c):
+            return False
+        k = i * self.c + j
+        return WALKABLE[self.type[k]] == 1 and not self.entity[k]
+
+    def damage_tile(self, i: int, j: int, damage: int = 1, dir_broke: int = 0) -> bool:
+        """Damages the tile at (i, j); returns True if it was the home tile."""
+        k = i * self.c + j
+        type = self.type[k]
+        if type == TILE_BRICK:
+            health = self.health[k] - damage
+            if health < 1:
+                self.type[k] = TILE_NONE
+                self.health[k] = 0
+                self.dir_broke[k] = 0
+            else:
+                self.health[k] = health
+                self.dir_broke[k] = dir_broke
+            self.changed_tiles.append(k)
+        elif type == TILE_HOME:
+            return True
+        return False
+
+    def _get(self, layer: array, i: int, j: int):
+        uid = layer[i * self.c + j]
+        return self.objects.get(uid) if uid else None
+
+    def _put(self, layer: array, i: int, j: int, obj: Entity | Powerup | None) -> None:
+        # an object sits in at most one cell, so whatever gets overwritten is gone
+        k = i * self.c + j
+        if old := layer[k]:
+            self.objects.pop(old, None)
+        if obj is None:
+            layer[k] = 0
+        else:
+            layer[k] = obj.uid
+            self.objects[obj.uid] = obj
+
+    def entity_at(self, i: int, j: int) -> Entity | None:
+        return self._get(self.entity, i, j)
+
+    def set_entity(self, i: int, j: int, entity: Entity | None) -> None:
+        self._put(self.entity, i, j, entity)
+
+    def projectile_at(self, i: int, j: int):
+        uid = self.projectile[i * self.c + j]
+        return self.bullets.get(uid) if uid else None
+
+    def set_projectile(self, i: int, j: int, projectile) -> None:
+        self.projectile[i * self.c + j] = projectile.uid if projectile else 0
+
+    def powerup_at(self, i: int, j: int) -> Powerup | None:
+        return self._get(self.powerup, i, j)
+
+    def set_powerup(self, i: int, j: int, powerup: Powerup | None) -> None:
+        self._put(self.powerup, i, j, powerup)
+
+
+class Tile:
+    """View of one cell's tile fields in a Grid."""
+
+    __slots__ = ('_grid', '_i', '_j', '_k')
+
+    def __init__(self, grid: Grid, i: int, j: int):
+        self._grid = grid
+        self._i, self._j = i, j
+        self._k = i * grid.c + j
+
+    @property
+    def type(self) -> Literal['Forest', 'Home', 'Water', 'Stone', 'Brick', 'Mirror', 'EnemySpawner', 'PowerupSpawner', None]:
+        return TILE_TYPES[self._grid.type[self._k]]
+
+    @type.setter
+    def type(self, value) -> None:
+        self._grid.type[self._k] = TILE_CODES[value]
+        self._grid.changed_tiles.append(self._k)
+
+    @property
+    def health(self) -> int:
+        return self._grid.health[self._k]
+
+    @health.setter
+    def health(self, value: int) -> None:
+        self._grid.health[self._k] = value
+        self._grid.changed_tiles.append(self._k)
+
+    @property
+    def rotation(self) -> Literal['\\', '/', None]:
+        return ROTATIONS[self._grid.rotation[self._k]]
+
+    @rotation.setter
+    def rotation(self, value) -> None:
+        self._grid.rotation[self._k] = ROTATION_CODES[value]
+        self._grid.changed_tiles.append(self._k)
+
+    @property
+    def dir_broke(self) -> Literal['N', 'E', 'S', 'W', None]:
+        return FACINGS[self._grid.dir_broke[self._k]]
+
+    @dir_broke.setter
+    def dir_broke(self, value) -> None:
+        self._grid.dir_broke[self._k] = FACING_CODES[value]
+        self._grid.changed_tiles.append(self._k)
+
+    @property
+    def enemy_type(self) -> Literal['Health', 'Attack', 'Speed', 'Normie', None]:
+        return self._grid.enemy_spawn_spots.get((self._i, self._j))
+
+    @property
+    def powerup_type(self) -> Powerup | None:
+        return self._grid.powerup_spawn_spots.get((self._i, self._j))
+
+    def damage(self, damage: int = 1, dir_broke: Literal['N', 'E', 'W', 'S', None] = None) -> None | bool:
+        if self._grid.damage_tile(self._i, self._j, damage, FACING_CODES[dir_broke]):
+            return True
+
+    def __repr__(self) -> str:
+        return (f'Tile(type={self.type!r}, enemy_type={self.enemy_type!r}, powerup_type={self.powerup_type!r}, '
+                f'rotation={self.rotation!r}, dir_broke={self.dir_broke!r}, health={self.health!r})')
+
+
+class CellState:
+    """View of one cell in a Grid, with the fields the old per-cell dataclass had."""
+
+    __slots__ = ('_grid', '_i', '_j')
+
+    def __init__(self, grid: Grid, i: int, j: int):
+        self._grid = grid
+        self._i, self._j = i, j
+
+    @property
+    def tile(self) -> Tile:
+        return Tile(self._grid, self._i, self._j)
+
+    @property
+    def entity(self) -> Entity | None:
+        return self._grid.entity_at(self._i, self._j)
+
+    @entity.setter
+    def entity(self, value: Entity | None) -> None:
+        self._grid.set_entity(self._i, self._j, value)
+
+    @property
+    def projectile(self):
+        return self._grid.projectile_at(self._i, self._j)
+
+    @projectile.setter
+    def projectile(self, value) -> None:
+        self._grid.set_projectile(self._i, self._j, value)
+
+    @property
+    def powerup(self) -> Powerup | None:
+        return self._grid.powerup_at(self._i, self._j)
+
+    @powerup.setter
+    def powerup(self, value: Powerup | None) -> None:
+        self._grid.set_powerup(self._i, self._j, value)
+
+    def __repr__(self) -> str:
+        return f'CellState(tile={self.tile!r}, entity={self.entity!r}, projectile={self.projectile!r}, powerup={self.powerup!r})'
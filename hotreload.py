@@ -0,0 +1,126 @@
+"""Reloading stages into a running game.
+
+``StageWatcher`` notices when the stage file is saved again and reads it.
+``reload_stages`` then swaps the new stages in. The stage being played is
+patched in place instead of restarted: its old and new tile codes are
+compared (XOR-ing them as two big ints finds the differing bytes in C) and
+only the cells that differ are touched. Those get the new tile, spawner or
+powerup spawner. An enemy standing where there is now a wall is removed, a
+player is moved to the nearest free cell, and a bullet inside a new solid
+tile is dropped. Everything else, including bricks already shot away in
+cells the edit didn't touch, stays as it was. The tile changes go through
+``set_tile``, so the flow field, bullet paths and the renderer catch up from
+the grid's journal as usual. A stage whose size changed is started again.
+
+    python main.py --watch
+"""
+import os
+import re
+import time
+from collections.abc import Sequence
+
+from engine import Simulation, CURR_STAGE, start_cells
+from entities import Powerup
+from grid import WALKABLE
+from stages import Stage, StageError, ENEMY_SPAWNS, POWERUP_SPAWNS, TYPE_OF, HEALTH_OF, ROTATION_OF, load_stages
+
+DIFFERENT = re.compile(rb'[^\x00]')
+
+
+class StageWatcher:
+    """Polls a stage file; ``poll`` returns its stages each time it was saved again, else None."""
+
+    def __init__(self, path: str, interval: float = 0.25):
+        self.path = path
+        self.interval = interval
+        self.checked: float = time.monotonic()
+        self.version = self.stat()
+
+    def stat(self) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def poll(self) -> list[Stage] | None:
+        now = time.monotonic()
+        if now - self.checked < self.interval:
+            return None
+        self.checked = now
+        if (version := self.stat()) == self.version or version is None:
+            return None
+        self.version = version
+        try:
+            return list(load_stages(self.path))
+        except (ValueError, OSError, KeyError, TypeError) as error:
+            # e.g. an editor that saved half a file, or moved it aside to save; the next save is read again
+            print(f'{self.path} not reloaded: {type(error).__name__}: {error}')
+            return None
+
+
+def diff_cells(old: bytes, new: bytes) -> list[int]:
+    """Indices where two equally long byte strings differ."""
+    delta = (int.from_bytes(old, 'little') ^ int.from_bytes(new, 'little')).to_bytes(len(old), 'little')
+    return [match.start() for match in DIFFERENT.finditer(delta)]
+
+
+def patch_stage(sim: Simulation, old: Stage, new: Stage) -> int:
+    """Applies the cells where ``new`` differs from ``old`` to the running grid; returns how many."""
+    grid = sim.grid
+    c = grid.c
+    changed = diff_cells(old.tiles, new.tiles)
+    for k in changed:
+        code = new.tiles[k]
+        spot = i, j = divmod(k, c)
+        grid.set_tile(i, j, TYPE_OF[code], HEALTH_OF[code], ROTATION_OF[code])
+
+        sim.enemy_spawn_spots.pop(spot, None)
+        if sim.powerup_spawn_spots.pop(spot, None) and (powerup := grid.powerup_at(i, j)):
+            grid.set_powerup(i, j, None)
+            sim.powerups.discard(powerup)
+        if code in ENEMY_SPAWNS:
+            sim.enemy_spawn_spots[spot] = ENEMY_SPAWNS[code]
+        elif code in POWERUP_SPAWNS:
+            sim.powerup_spawn_spots[spot] = Powerup(*POWERUP_SPAWNS[code])
+
+        if (uid := grid.projectile[k]) and HEALTH_OF[code]:
+            sim.projectiles.remove(uid)
+        if (tank := grid.entity_at(i, j)) and not WALKABLE[TYPE_OF[code]]:
+            if tank in sim.enemies:
+                sim.remove_enemy(tank)
+            else:
+                try:
+                    _, (ni, nj) = start_cells(grid, k, 2)
+                except StageError:
+                    # walled in; it stays where it is
+                    continue
+                grid.set_entity(i, j, None)
+                tank.pos.x, tank.pos.y = ni, nj
+                grid.set_entity(ni, nj, tank)
+    sim.home = new.home
+    return len(changed)
+
+
+def reload_stages(sim: Simulation, stages: Sequence[Stage]) -> int | None:
+    """Swaps in new stages, patching the one being played; returns the cells patched, None if it was restarted.
+
+    Raises StageError, leaving the game as it was, if the new stages have problems the old ones didn't.
+    """
+    # problems the running stages already had (the shipped file has some) don't stop a reload; new ones do
+    known = {(n, problem) for n, stage in enumerate(sim.stages) if isinstance(stage, Stage) for problem in stage.problems}
+    if problems := [f'stage {stage.level}: {problem}' for n, stage in enumerate(stages) for problem in stage.problems
+                    if (n, problem) not in known]:
+        raise StageError('; '.join(problems))
+    n = sim.current_stage - 1
+    if n >= len(stages):
+        raise StageError(f'stage {sim.current_stage} is being played but only {len(stages)} are left')
+    old, new = sim.stages[n], stages[n]
+    patched = None
+    if (new.r, new.c) != (old.r, old.c):
+        sim.new_game(new, sim.players)
+    else:
+        patched = patch_stage(sim, old, new)
+    sim.stages = stages
+    sim.stage = stages[CURR_STAGE - 1]
+    return patched
@@ -0,0 +1,461 @@
+"""Multiplayer over TCP: an authoritative host, and clients that only send input.
+
+``Host`` runs the one Simulation that counts, with a tank per player, and
+ticks it at its own fps once everyone has joined. Clients send their buttons
+tagged with the frame they are meant for; the host ORs together whatever a
+player sent for a frame (input that arrives late lands on the next one) and
+steps. It never waits for a slow client, so one bad link can't stall the
+others. What goes back depends on the mode:
+
+* ``lockstep``: each frame's buttons for every player (``F``). Clients run the
+  same deterministic simulation (the welcome carries the seed, fps, AI
+  settings and a digest of the stages) and step it with them. A state hash
+  every ``interval`` frames (``K``) catches a desync.
+* ``state``: every ``interval`` frames, an update (``U``): the tiles the
+  changed_tiles journal lists since the last one, and tanks, bullets and
+  powerups packed as in snapshot.py, deflated with the previous update's
+  state as the preset dictionary. Whatever didn't change since then, moved
+  along in the buffer or not, compresses to back-references, so an update
+  costs about what changed. Clients mirror it without simulating. A new stage
+  starts with a full keyframe (``Y``).
+
+Messages are a 1-byte tag and a u32 payload length, then the payload
+(little-endian)::
+
+    J  u16 version                                      client joins
+    W  u16 version, u8 player, u8 players, u8 mode,     welcome
+       u64 seed, u16 fps, u8 ai, u16 far radius,
+       u16 interval, 8-byte stage digest
+    I  u32 frame, u16 buttons                           client input
+    F  u32 frame, u16 buttons per player                lockstep frame
+    K  u32 frame, u64 state hash                        lockstep check
+    Y  deflated snapshot (snapshot.py's to_bytes)       state keyframe
+    U  u32 frame, deflated (last state as dictionary):  state update
+       u32 tile count, per tile u32 cell and
+       4 tile bytes, then the state
+
+``python netplay.py bench`` plays bots against a host over loopback and checks
+bandwidth and input latency against the BUDGET below. ``python netplay.py
+host`` and ``python netplay.py join HOST:PORT`` run the two ends apart. There
+is no windowed client yet: a client plays whatever ``Policy`` it is given, and
+``join`` gives it a random bot.
+"""
+import asyncio
+import random
+import struct
+import sys
+import time
+import zlib
+from collections.abc import Sequence
+from typing import Literal
+
+from engine import Simulation, FPS, BTN_ENEMY_FIRE
+from policies import Policy, random_policy
+from replay import AI_CODES, NO_RADIUS, DesyncError, stage_digest
+from snapshot import Snapshot, take_snapshot, pack_state, restore_snapshot
+from stagegen import make_stage
+from stages import Stage, load_stages
+
+PROTOCOL = 1
+MODES = {'lockstep': 0, 'state': 1}
+FRAMING = struct.Struct('<cI')
+JOIN = struct.Struct('<H')
+WELCOME = struct.Struct('<HBBBQHBHH8s')
+INPUT = struct.Struct('<IH')
+CHECK = struct.Struct('<IQ')
+FRAME = struct.Struct('<I')
+TILE = struct.Struct('<I4s')
+DEFLATE_LEVEL = 6
+
+# what a client may cost with 4 players and hundreds of bullets in flight
+BUDGET = {
+    'down': 24_000,  # bytes/s host -> client
+    'up': 2_000,  # bytes/s client -> host
+    'latency': 0.100,  # s, 99th percentile from sending input to seeing it confirmed
+}
+
+# bench: ticks between volleys of enemy fire
+FIRE_EVERY = 20
+
+
+class NetError(Exception):
+    pass
+
+
+def message(tag: bytes, payload: bytes) -> bytes:
+    return FRAMING.pack(tag, len(payload)) + payload
+
+
+async def read_message(reader: asyncio.StreamReader) -> tuple[bytes, bytes]:
+    tag, length = FRAMING.unpack(await reader.readexactly(FRAMING.size))
+    return tag, await reader.readexactly(length)
+
+
+class Host:
+
+    def __init__(self, stages: Sequence[Stage] | list[list[list[int]]], players: int = 2, mode: Literal['lockstep', 'state'] = 'lockstep',
+                 seed: int | None = None, fps: int = FPS, ai: Literal['random', 'flow'] = 'random', far_radius: int | None = None, interval: int | None = None):
+        if mode not in MODES:
+            raise ValueError(f'unknown mode {mode}; pick from {list(MODES)}')
+        self.sim = Simulation(stages, fps=fps, ai=ai, seed=seed, far_radius=far_radius, players=players)
+        self.players = players
+        self.mode = mode
+        # lockstep: frames between state checks; state: frames between updates
+        self.interval = interval or (60 if mode == 'lockstep' else 2)
+        self.writers: list[asyncio.StreamWriter | None] = [None] * players
+        self.pending: list[list[tuple[int, int]]] = [[] for _ in range(players)]
+        self.joined = asyncio.Event()
+        self.server: asyncio.Server | None = None
+
+        self.bytes_sent = [0] * players
+        self.bytes_received = [0] * players
+        self.late_inputs: int = 0
+
+        # state mode: the grid and state the last update was taken against
+        self.grid = None
+        self.tiles_seen: int = 0
+        self.last_state: bytes = b''
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> int:
+        """Starts accepting players; returns the port (pass 0 for any free one)."""
+        self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def close(self) -> None:
+        for writer in self.writers:
+            if writer is not None:
+                writer.close()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            tag, payload = await read_message(reader)
+            if tag != b'J' or JOIN.unpack(payload)[0] != PROTOCOL or None not in self.writers:
+                writer.close()
+                return
+            n = self.writers.index(None)
+            self.writers[n] = writer
+            sim = self.sim
+            far_radius = NO_RADIUS if sim.far_radius is None else sim.far_radius
+            self.send(n, message(b'W', WELCOME.pack(PROTOCOL, n, self.players, MODES[self.mode], sim.seed, sim.fps, AI_CODES[sim.ai], far_radius,
+                                                   self.interval, stage_digest(sim.stages))))
+            if None not in self.writers:
+                self.joined.set()
+            while True:
+                tag, payload = await read_message(reader)
+                self.bytes_received[n] += FRAMING.size + len(payload)
+                if tag == b'I':
+                    self.pending[n].append(INPUT.unpack(payload))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # a player who leaves just stops pressing anything
+            pass
+
+    def send(self, n: int, data: bytes) -> None:
+        if (writer := self.writers[n]) is not None and not writer.is_closing():
+            writer.write(data)
+            self.bytes_sent[n] += len(data)
+
+    def broadcast(self, data: bytes) -> None:
+        for n in range(self.players):
+            self.send(n, data)
+
+    def take_input(self, n: int, frame: int) -> int:
+        pending = self.pending[n]
+        if not pending:
+            return 0
+        buttons = 0
+        keep = []
+        for at, pressed in pending:
+            if at <= frame:
+                buttons |= pressed
+                self.late_inputs += at < frame
+            else:
+                keep.append((at, pressed))
+        self.pending[n] = keep
+        return buttons
+
+    async def run(self, ticks: int | None = None, realtime: bool = True) -> None:
+        """Waits for every player, then ticks ``ticks`` times (forever if None) at the simulation's fps."""
+        await self.joined.wait()
+        sim = self.sim
+        period = 1 / sim.fps
+        start = time.perf_counter()
+        n = 0
+        while ticks is None or n < ticks:
+            frame = sim.frame_count
+            buttons = [self.take_input(p, frame) for p in range(self.players)]
+            sim.step(buttons)
+            if self.mode == 'lockstep':
+                self.broadcast(message(b'F', struct.pack(f'<I{self.players}H', frame, *buttons)))
+                if sim.frame_count % self.interval == 0:
+                    self.broadcast(message(b'K', CHECK.pack(sim.frame_count, sim.state_hash())))
+            elif frame % self.interval == 0:
+                self.broadcast(self.state_update())
+            await asyncio.gather(*(writer.drain() for writer in self.writers if writer is not None and not writer.is_closing()))
+
+            n += 1
+            await asyncio.sleep(max(0.0, start + n * period - time.perf_counter()) if realtime else 0)
+
+    def state_update(self) -> bytes:
+        sim = self.sim
+        grid = sim.grid
+        if grid is not self.grid:
+            self.grid = grid
+            self.tiles_seen = len(grid.changed_tiles)
+            snap = take_snapshot(sim, timers=False)
+            self.last_state = snap.state
+            return message(b'Y', zlib.compress(snap.to_bytes(), DEFLATE_LEVEL))
+
+        changed = grid.changed_tiles
+        cells = set(changed[self.tiles_seen:])
+        self.tiles_seen = len(changed)
+        body = bytearray(FRAME.pack(len(cells)))
+        for k in cells:
+            body += TILE.pack(k, bytes((grid.type[k], grid.health[k], grid.rotation[k], grid.dir_broke[k])))
+        state, _ = pack_state(sim, timers=False)
+        # the last state as the dictionary: what didn't change (or only shifted) becomes back-references
+        deflate = zlib.compressobj(DEFLATE_LEVEL, zdict=self.last_state)
+        self.last_state = state
+        return message(b'U', FRAME.pack(sim.frame_count) + deflate.compress(body + state) + deflate.flush())
+
+
+class Client:
+    """One player: sends what ``policy`` presses each frame, and follows the host's game in ``sim``."""
+
+    def __init__(self, stages: Sequence[Stage] | list[list[list[int]]], policy: Policy | None = None, delay: int = 2):
+        self.stages = stages
+        self.policy: Policy = policy or (lambda sim: 0)
+        self.delay = delay  # frames ahead of the last confirmed one that input is sent for
+        self.sim: Simulation | None = None
+        self.player: int = 0
+        self.players: int = 0
+        self.mode: str = ''
+
+        self.sent_at: dict[int, float] = {}
+        self.latencies: list[float] = []
+        self.bytes_sent: int = 0
+        self.bytes_received: int = 0
+        self.frames: int = 0
+        self.last_state: bytes = b''
+
+    async def connect(self, host: str, port: int) -> None:
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        self.send(b'J', JOIN.pack(PROTOCOL))
+        tag, payload = await read_message(self.reader)
+        if tag != b'W':
+            raise NetError('the host turned us away')
+        version, self.player, self.players, mode, seed, fps, ai, far_radius, interval, digest = WELCOME.unpack(payload)
+        if version != PROTOCOL:
+            raise NetError(f'the host speaks protocol {version}, not {PROTOCOL}')
+        if digest != stage_digest(self.stages):
+            raise NetError('the host plays different stages')
+        self.mode = {code: name for name, code in MODES.items()}[mode]
+        ais = {code: name for name, code in AI_CODES.items()}
+        self.sim = Simulation(self.stages, fps=fps, ai=ais[ai], seed=seed, far_radius=None if far_radius == NO_RADIUS else far_radius, players=self.players)
+
+    def send(self, tag: bytes, payload: bytes) -> None:
+        data = message(tag, payload)
+        self.writer.write(data)
+        self.bytes_sent += len(data)
+
+    async def run(self) -> None:
+        """Follows the game until the host hangs up; a failed lockstep check raises DesyncError."""
+        handlers = {b'F': self.on_frame, b'K': self.on_check, b'Y': self.on_keyframe, b'U': self.on_update}
+        try:
+            while True:
+                tag, payload = await read_message(self.reader)
+                self.bytes_received += FRAMING.size + len(payload)
+                handlers[tag](payload)
+                await self.writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.writer.close()
+
+    def on_frame(self, payload: bytes) -> None:
+        frame, *buttons = struct.unpack(f'<I{self.players}H', payload)
+        self.sim.step(buttons)
+        self.confirmed(frame)
+
+    def on_check(self, payload: bytes) -> None:
+        frame, expected = CHECK.unpack(payload)
+        if self.sim.frame_count == frame and (actual := self.sim.state_hash()) != expected:
+            raise DesyncError(frame, expected, actual)
+
+    def on_keyframe(self, payload: bytes) -> None:
+        snap = Snapshot.from_bytes(zlib.decompress(payload))
+        restore_snapshot(self.sim, snap)
+        self.last_state = snap.state
+        self.confirmed(snap.frame - 1)
+
+    def on_update(self, payload: bytes) -> None:
+        (frame,) = FRAME.unpack_from(payload)
+        body = zlib.decompressobj(zdict=self.last_state).decompress(payload[FRAME.size:])
+        sim = self.sim
+        grid = sim.grid
+        (count,) = FRAME.unpack_from(body)
+        offset = FRAME.size
+        layers = (grid.type, grid.health, grid.rotation, grid.dir_broke)
+        for _ in range(count):
+            k, values = TILE.unpack_from(body, offset)
+            offset += TILE.size
+            for layer, value in zip(layers, values):
+                layer[k] = value
+            grid.changed_tiles.append(k)
+        self.last_state = state = body[offset:]
+        restore_snapshot(sim, Snapshot(frame, grid, sim.projectiles, sim.flow, sim.home, len(grid.changed_tiles), None, b'', {}, state, None, []))
+        self.confirmed(frame - 1)
+
+    def confirmed(self, frame: int) -> None:
+        self.frames += 1
+        now = time.perf_counter()
+        for at in [at for at in self.sent_at if at <= frame]:
+            self.latencies.append(now - self.sent_at.pop(at))
+        # this player's move for a few frames on
+        if buttons := self.policy(self.sim):
+            at = self.sim.frame_count + self.delay
+            self.send(b'I', INPUT.pack(at, buttons))
+            self.sent_at.setdefault(at, now)
+
+
+async def loopback(stages: Sequence[Stage] | list[list[list[int]]], policies: Sequence[Policy | None], **settings) -> tuple[Host, list[Client]]:
+    """A host on 127.0.0.1 with a client per policy already joined; the stand-in server for tests."""
+    host = Host(stages, players=len(policies), **settings)
+    port = await host.start()
+    clients = [Client(stages, policy) for policy in policies]
+    for client in clients:
+        await client.connect('127.0.0.1', port)
+    return host, clients
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def bench(mode: str, players: int = 4, seconds: float = 10.0, seed: int = 1) -> dict:
+    stages = [make_stage(64, 150, seed)]
+
+    def bot(n: int) -> Policy:
+        act = random_policy(random.Random(seed + n))
+        if n:
+            return act
+
+        # player 1 also sets every enemy firing now and then, to keep hundreds of bullets about
+        last = -FIRE_EVERY
+
+        def policy(sim: Simulation) -> int:
+            nonlocal last
+            if sim.frame_count - last < FIRE_EVERY:
+                return act(sim)
+            last = sim.frame_count
+            return act(sim) | BTN_ENEMY_FIRE
+        return policy
+
+    host, clients = await loopback(stages, [bot(n) for n in range(players)], mode=mode, seed=seed)
+    bullets: list[int] = []
+    tasks = [asyncio.create_task(client.run()) for client in clients]
+    ticks = int(seconds * host.sim.fps)
+
+    async def watch() -> None:
+        while host.sim.frame_count < ticks:
+            bullets.append(len(host.sim.projectiles))
+            await asyncio.sleep(0.1)
+    watcher = asyncio.create_task(watch())
+    start = time.perf_counter()
+    await host.run(ticks)
+    elapsed = time.perf_counter() - start
+    await host.close()
+    await asyncio.gather(*tasks)
+    watcher.cancel()
+
+    latencies = [t for client in clients for t in client.latencies]
+    result = {
+        'mode': mode,
+        'players': players,
+        'ticks': ticks,
+        'fps': ticks / elapsed,
+        'bullets': max(bullets, default=0),
+        'down': max(host.bytes_sent) / elapsed,
+        'up': max(host.bytes_received) / elapsed,
+        'latency': percentile(latencies, 0.99),
+        'latency_p50': percentile(latencies, 0.5),
+        'late_inputs': host.late_inputs,
+    }
+    if mode == 'lockstep':
+        result['in_sync'] = all(client.sim.state_hash() == host.sim.state_hash() for client in clients)
+    else:
+        # every mirror holds what the last update said
+        result['in_sync'] = all(pack_state(client.sim, timers=False)[0] == host.last_state for client in clients)
+    return result
+
+
+def parse_args(argv: list[str]) -> tuple[list[str], dict[str, str]]:
+    args: list[str] = []
+    options: dict[str, str] = {}
+    rest = iter(argv)
+    for arg in rest:
+        if arg.startswith('--'):
+            options[arg] = next(rest, '')
+        else:
+            args.append(arg)
+    return args, options
+
+
+def main(argv: list[str]) -> int:
+    args, options = parse_args(argv)
+    if not args or args[0] not in ('bench', 'host', 'join'):
+        print('usage: python netplay.py bench [--players N] [--seconds S] [--mode lockstep|state]\n'
+              '       python netplay.py host [--players N] [--mode lockstep|state] [--port P] [--seed S] [--stages FILE]\n'
+              '       python netplay.py join HOST:PORT [--stages FILE]')
+        return 2
+    command = args[0]
+    players = int(options.get('--players', 4 if command == 'bench' else 2))
+
+    if command == 'bench':
+        failed = False
+        for mode in [options['--mode']] if '--mode' in options else list(MODES):
+            result = asyncio.run(bench(mode, players, float(options.get('--seconds', 10))))
+            print(f'{mode:8} {result["players"]} players, {result["ticks"]} ticks at {result["fps"]:.1f} fps, up to {result["bullets"]} bullets: '
+                  f'{result["down"] / 1000:.1f} kB/s down, {result["up"] / 1000:.2f} kB/s up per client, '
+                  f'latency p50 {result["latency_p50"] * 1000:.0f}ms p99 {result["latency"] * 1000:.0f}ms, '
+                  f'{result["late_inputs"]} late inputs, {"in sync" if result["in_sync"] else "OUT OF SYNC"}')
+            for key, limit in BUDGET.items():
+                if result[key] > limit:
+                    print(f'  over budget: {key} {result[key]:.3f} > {limit}')
+                    failed = True
+            failed |= not result['in_sync']
+        return 1 if failed else 0
+
+    stages = load_stages(options.get('--stages', 'stage_data.json'))
+    if command == 'host':
+        host = Host(stages, players, options.get('--mode', 'lockstep'), seed=int(options['--seed']) if '--seed' in options else None)
+
+        async def serve() -> None:
+            port = await host.start('0.0.0.0', int(options.get('--port', 7777)))
+            print(f'waiting for {players} players on port {port}')
+            await host.run()
+        asyncio.run(serve())
+        return 0
+
+    if len(args) != 2:
+        print('join needs HOST:PORT')
+        return 2
+    address, _, port = args[1].rpartition(':')
+    client = Client(stages, random_policy(random.Random()))
+
+    async def play() -> None:
+        await client.connect(address, int(port))
+        print(f'joined as player {client.player + 1} of {client.players} ({client.mode})')
+        await client.run()
+    asyncio.run(play())
+    print(f'{client.frames} frames, {client.bytes_received} bytes in, {client.bytes_sent} out')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
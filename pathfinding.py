@@ -0,0 +1,197 @@
+"""Shared flow field for goal-directed enemy tanks.
+
+One distance field covers the whole map: for every cell, how many moves it
+takes to reach the nearest goal (home and the player's tank). A brick counts
+as ``brick_cost`` moves since it has to be shot down first; water, stone and
+mirrors can't be crossed. Every enemy reads the same field and steps to its
+lowest neighbour, so hundreds of tanks cost one field update per change
+instead of one search each.
+
+The field is built once per stage and then patched in place, on the first
+query after a change, so goals that move several times between enemy moves
+are caught up with once. Breaking a brick makes a cell cheaper: distances
+are relaxed outward from it. A new goal (the player driving somewhere) is
+spread from the same way. A goal that went away or a tile that got harder to
+cross can only make distances grow, and only for cells whose shortest path
+led through it: ``repair`` walks those in order of distance, drops each one
+no unaffected neighbour still supports, and fills the dropped cells in again
+from their neighbours. When that would redo a good part of the map it
+rebuilds the field instead.
+"""
+from array import array
+from heapq import heapify, heappush, heappop
+
+from grid import Grid, TILE_TYPES, TILE_BRICK, MOVABLE
+from trajectory import DELTAS
+
+INF = 1 << 30
+
+
+def cost_table(brick_cost: int) -> bytes:
+    """bytes.translate table, tile code -> cost of entering it (0: impassable)."""
+    table = bytearray(256)
+    for code, name in enumerate(TILE_TYPES):
+        if name in MOVABLE:
+            table[code] = 1
+    table[TILE_BRICK] = brick_cost
+    return bytes(table)
+
+
+class FlowField:
+
+    def __init__(self, grid: Grid, brick_cost: int = 3):
+        self.grid = grid
+        self.table = cost_table(brick_cost)
+        self.cost = bytearray(grid.type.translate(self.table))
+        self.dist = array('l', [INF]) * (grid.r * grid.c)
+        self.goals: tuple[int, ...] = ()
+        self.built_for: tuple[int, ...] = ()  # the goals ``dist`` is measured to; moved to ``goals`` on the next query
+        self.stale: bool = True
+        self.seen: int = len(grid.changed_tiles)
+        # past this many cells to redo, a repair gives up and rebuilds, which is cheaper by then
+        self.repair_limit: int = len(self.dist) // 32
+        self.rebuilds: int = 0
+        self.repairs: int = 0
+
+    def set_goals(self, goals: tuple[int, ...]) -> None:
+        self.goals = goals
+
+    def sync(self) -> None:
+        changed = self.grid.changed_tiles
+        if self.seen == len(changed):
+            return
+        grid, table, cost = self.grid, self.table, self.cost
+        new = {k: table[grid.type[k]] for k in changed[self.seen:]}
+        self.seen = len(changed)
+        if self.stale:
+            for k, step in new.items():
+                cost[k] = step
+            return
+        # harder cells first, with the cheaper ones still at their old cost, so each pass starts from exact distances
+        harder = [k for k, step in new.items() if step != cost[k] and (not step or cost[k] and step > cost[k])]
+        cheaper = [k for k, step in new.items() if step != cost[k] and k not in harder]
+        for k in harder:
+            cost[k] = new[k]
+        self.repair(harder, self.built_for)
+        for k in cheaper:
+            cost[k] = new[k]
+        if not self.stale:
+            self.relax(cheaper)
+
+    def move_goals(self) -> None:
+        goals, old = self.goals, self.built_for
+        # add the new goals first: cells as near to them as to a goal now gone keep their distance
+        dist = self.dist
+        heap = []
+        for goal in goals:
+            if goal not in old:
+                dist[goal] = 0
+                heap.append((0, goal))
+        self._spread(heap)
+        self.built_for = goals
+        self.repair([goal for goal in old if goal not in goals], goals)
+
+    def rebuild(self) -> None:
+        self.dist = dist = array('l', [INF]) * len(self.dist)
+        heap = []
+        for goal in self.goals:
+            dist[goal] = 0
+            heap.append((0, goal))
+        self._spread(heap)
+        self.built_for = self.goals
+        self.stale = False
+        self.rebuilds += 1
+
+    def repair(self, cells: list[int], goals: tuple[int, ...]) -> None:
+        """Fixes distances after ``cells`` stopped being goals or got harder to enter; they can only have grown."""
+        if not cells:
+            return
+        dist, cost = self.dist, self.cost
+        r, c = self.grid.r, self.grid.c
+        heap = [(dist[k], k) for k in cells if dist[k] < INF]
+        heapify(heap)
+        lost = set()
+        # in order of distance, so whether a cell's neighbours nearer the goals are lost is settled before it
+        while heap:
+            d, k = heappop(heap)
+            if k in lost or k in goals or d != dist[k]:
+                continue
+            step = cost[k]
+            i, j = divmod(k, c)
+            near = [(i + di) * c + j + dj for di, dj in DELTAS if 0 <= i + di < r and 0 <= j + dj < c]
+            if step and any(dist[nk] + step == d and nk not in lost for nk in near):
+                continue
+            lost.add(k)
+            if len(lost) > self.repair_limit:
+                self.rebuild()
+                return
+            for nk in near:
+                if (s := cost[nk]) and dist[nk] == d + s:
+                    heappush(heap, (d + s, nk))
+        if not lost:
+            return
+
+        for k in lost:
+            dist[k] = INF
+        for k in lost:
+            if step := cost[k]:
+                best = min(dist[nk] for nk in self.neighbours(k))
+                if best < INF:
+                    dist[k] = best + step
+                    heap.append((dist[k], k))
+        heapify(heap)
+        self._spread(heap)
+        self.repairs += 1
+
+    def relax(self, cells: list[int]) -> None:
+        # a cell got cheaper to cross, so distances through it can only drop
+        dist, cost = self.dist, self.cost
+        heap = []
+        for k in cells:
+            best = min((dist[nk] for nk in self.neighbours(k)), default=INF)
+            if best < INF and best + cost[k] < dist[k]:
+                dist[k] = best + cost[k]
+                heappush(heap, (dist[k], k))
+        self._spread(heap)
+
+    def _spread(self, heap: list[tuple[int, int]]) -> None:
+        dist, cost = self.dist, self.cost
+        r, c = self.grid.r, self.grid.c
+        while heap:
+            d, k = heappop(heap)
+            if d > dist[k]:
+                continue
+            i, j = divmod(k, c)
+            for di, dj in DELTAS:
+                ni, nj = i + di, j + dj
+                if 0 <= ni < r and 0 <= nj < c:
+                    nk = ni * c + nj
+                    if (step := cost[nk]) and d + step < dist[nk]:
+                        dist[nk] = d + step
+                        heappush(heap, (d + step, nk))
+
+    def neighbours(self, k: int) -> list[int]:
+        r, c = self.grid.r, self.grid.c
+        i, j = divmod(k, c)
+        return [(i + di) * c + j + dj for di, dj in DELTAS if 0 <= i + di < r and 0 <= j + dj < c]
+
+    def distance(self, k: int) -> int:
+        self.sync()
+        if self.stale:
+            self.rebuild()
+        elif self.goals != self.built_for:
+            self.move_goals()
+        return self.dist[k]
+
+    def directions(self, k: int) -> list[int]:
+        """Facing codes from cell k toward the goals, best first; only ones that get closer."""
+        here = self.distance(k)
+        r, c = self.grid.r, self.grid.c
+        i, j = divmod(k, c)
+        options = []
+        for f, (di, dj) in enumerate(DELTAS):
+            ni, nj = i + di, j + dj
+            if 0 <= ni < r and 0 <= nj < c and (d := self.dist[ni * c + nj]) < here:
+                options.append((d, f))
+        options.sort()
+        return [f for _, f in options]
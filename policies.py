@@ -0,0 +1,61 @@
+"""Scripted players: a policy looks at the simulation and returns the buttons to press.
+
+``batch.py`` plays balancing games with them and ``netplay.py`` uses them as
+bots. Each factory takes the random generator the policy draws from, so a
+seeded game plays the same way every time.
+"""
+import random
+from typing import Callable
+
+from engine import Simulation, SCENE_PLAY, BTN_UP, BTN_DOWN, BTN_LEFT, BTN_RIGHT, BTN_SHOOT, BTN_CONFIRM
+
+MOVES = [BTN_UP, BTN_DOWN, BTN_LEFT, BTN_RIGHT]
+
+Policy = Callable[[Simulation], int]
+
+
+def idle_policy(rng: random.Random) -> Policy:
+    """Only presses confirm: starts the game, moves on to the next stage."""
+    def policy(sim: Simulation) -> int:
+        return BTN_CONFIRM if sim.scene != SCENE_PLAY else 0
+    return policy
+
+
+def random_policy(rng: random.Random) -> Policy:
+    def policy(sim: Simulation) -> int:
+        if sim.scene != SCENE_PLAY:
+            return BTN_CONFIRM
+        buttons = BTN_SHOOT if rng.random() < 0.05 else 0
+        if rng.random() < 0.2:
+            buttons |= rng.choice(MOVES)
+        return buttons
+    return policy
+
+
+def aggressive_policy(rng: random.Random) -> Policy:
+    """Wanders, and fires whenever a shot from where it stands would reach an enemy."""
+    def policy(sim: Simulation) -> int:
+        if sim.scene != SCENE_PLAY:
+            return BTN_CONFIRM
+        if not sim.projectiles.player_uid and enemy_in_sight(sim):
+            return BTN_SHOOT
+        return rng.choice(MOVES) if rng.random() < 0.2 else 0
+    return policy
+
+
+def enemy_in_sight(sim: Simulation) -> bool:
+    player = sim.player
+    i, j = player.front_x, player.front_y
+    if not sim.in_bounds(i, j):
+        return False
+    grid = sim.grid
+    cells, _ = sim.projectiles.trajectories.path(i * grid.c + j, player.facing_code)
+    entity = grid.entity
+    return any(entity[k] and entity[k] != player.uid for k in cells)
+
+
+POLICIES: dict[str, Callable[[random.Random], Policy]] = {
+    'idle': idle_policy,
+    'random': random_policy,
+    'aggressive': aggressive_policy,
+}
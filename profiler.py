@@ -0,0 +1,140 @@
+"""Frame profiler: per-subsystem timings, a rolling window for the HUD and Chrome trace export.
+
+Nothing is instrumented while the profiler is off. ``watch`` only records
+which methods to time; ``enable`` swaps timing wrappers onto those objects and
+``disable`` takes them off again, so a disabled profiler costs nothing beyond
+the ``enabled`` checks around a frame. Things that hold on to bound methods
+(the simulation's timers) must be re-registered after either call, which is
+what ``Simulation.reschedule`` does.
+
+Each timed call becomes a Chrome trace "complete" event; ``export`` writes
+them as JSON for chrome://tracing or https://ui.perfetto.dev.
+"""
+import json
+import os
+from collections import deque
+from time import perf_counter_ns
+from typing import Callable
+
+
+class Profiler:
+
+    def __init__(self, window: int = 240, max_events: int = 200_000):
+        self.enabled: bool = False
+        self.watched: list[tuple[object, str, str]] = []
+        self._undo: list[Callable[[], None]] = []
+
+        # per finished frame: (total ns, ns per section, counters)
+        self.frames: deque[tuple[int, dict[str, int], dict[str, int]]] = deque(maxlen=window)
+        # (name, start ns, duration ns); counters as (name, time ns, value)
+        self.events: deque[tuple[str, int, int]] = deque(maxlen=max_events)
+        self.counter_events: deque[tuple[str, int, int]] = deque(maxlen=max_events)
+        self.current: dict[str, int] = {}
+        self.counts: dict[str, int] = {}
+        self.frame_start: int = 0
+        self.origin: int = perf_counter_ns()
+
+    def watch(self, owner: object, names: tuple[str, ...] | list[str], category: str) -> None:
+        """Times ``owner.<name>`` for each name as "category.name" whenever the profiler is on."""
+        if missing := [name for name in names if not callable(getattr(owner, name, None))]:
+            raise AttributeError(f'{type(owner).__name__} has no method {", ".join(missing)} to profile')
+        self.watched.extend((owner, name, f'{category}.{name}') for name in names)
+        if self.enabled:
+            for owner, name, label in self.watched[-len(names):]:
+                self._wrap(owner, name, label)
+
+    def enable(self) -> None:
+        if self.enabled:
+            return
+        try:
+            for owner, name, label in self.watched:
+                self._wrap(owner, name, label)
+        except AttributeError:
+            # e.g. a method deleted since watch(); take off what was already wrapped
+            self._unwrap()
+            raise
+        self.enabled = True
+        self.frames.clear()
+
+    def disable(self) -> None:
+        if not self.enabled:
+            return
+        self.enabled = False
+        self._unwrap()
+
+    def _unwrap(self) -> None:
+        for undo in reversed(self._undo):
+            undo()
+        self._undo.clear()
+
+    def toggle(self) -> bool:
+        self.disable() if self.enabled else self.enable()
+        return self.enabled
+
+    def _wrap(self, owner: object, name: str, label: str) -> None:
+        original = getattr(owner, name)
+        had_own = name in vars(owner)
+        events = self.events
+
+        def timed(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                duration = perf_counter_ns() - start
+                events.append((label, start, duration))
+                current = self.current
+                current[label] = current.get(label, 0) + duration
+        setattr(owner, name, timed)
+
+        def undo() -> None:
+            if had_own:
+                setattr(owner, name, original)
+            else:
+                delattr(owner, name)
+        self._undo.append(undo)
+
+    def begin_frame(self) -> None:
+        self.frame_start = perf_counter_ns()
+        self.current = {}
+        self.counts = {}
+
+    def count(self, name: str, value: int) -> None:
+        self.counts[name] = value
+        self.counter_events.append((name, perf_counter_ns(), value))
+
+    def end_frame(self) -> None:
+        end = perf_counter_ns()
+        self.events.append(('frame', self.frame_start, end - self.frame_start))
+        self.frames.append((end - self.frame_start, self.current, self.counts))
+
+    def frame_times(self) -> list[float]:
+        """Milliseconds per frame in the window, oldest first."""
+        return [total / 1e6 for total, _, _ in self.frames]
+
+    def averages(self) -> dict[str, float]:
+        """Milliseconds per frame spent in each section, averaged over the window, slowest first."""
+        if not self.frames:
+            return {}
+        totals: dict[str, int] = {}
+        for _, sections, _ in self.frames:
+            for label, ns in sections.items():
+                totals[label] = totals.get(label, 0) + ns
+        n = len(self.frames)
+        return {label: ns / n / 1e6 for label, ns in sorted(totals.items(), key=lambda item: -item[1])}
+
+    def export(self, path: str) -> int:
+        """Writes the recorded events as a Chrome trace; returns how many were written."""
+        origin = self.origin
+        pid = os.getpid()
+        trace = [
+            {'name': label, 'cat': label.split('.')[0], 'ph': 'X', 'ts': (start - origin) / 1000, 'dur': duration / 1000, 'pid': pid, 'tid': 1}
+            for label, start, duration in self.events
+        ]
+        trace.extend(
+            {'name': name, 'ph': 'C', 'ts': (at - origin) / 1000, 'pid': pid, 'tid': 1, 'args': {name: value}}
+            for name, at, value in self.counter_events
+        )
+        with open(path, 'w') as file:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, file)
+        return len(trace)
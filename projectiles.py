@@ -0,0 +1,210 @@
+"""Every live bullet, player's and enemies', in one set of parallel arrays.
+
+A bullet is a slot: its cell index (``i * c + j``), facing code, intensity
+and uid; ``player_uids`` says which bullet, if any, each player has in flight. Slots are packed, so removing one swaps
+the last slot into its place and costs O(1). ``step`` advances every bullet in
+one pass: where it goes (including mirror turns and tiles with health that
+stop it) is one lookup in the trajectory table, and a cell hash catches
+bullets that would end up in the same cell or swap cells head-on.
+"""
+from array import array
+from itertools import count
+from typing import Literal
+
+from point import Point
+from trajectory import Trajectories, EXIT, UNKNOWN
+
+FACING_NAMES: list[Literal['N', 'E', 'S', 'W']] = ['N', 'E', 'S', 'W']
+FACING_INDEX = {facing: code for code, facing in enumerate(FACING_NAMES)}
+
+_uids = count(1)
+
+
+class Bullet:
+    """Handle on one live projectile; attributes read through to the arrays."""
+
+    __slots__ = ('_projectiles', 'uid')
+
+    def __init__(self, projectiles: 'Projectiles', uid: int):
+        self._projectiles = projectiles
+        self.uid = uid
+
+    @property
+    def alive(self) -> bool:
+        return self.uid in self._projectiles.slot_of
+
+    @property
+    def pos(self) -> Point:
+        projectiles = self._projectiles
+        return Point(*divmod(projectiles.cell[projectiles.slot_of[self.uid]], projectiles.grid.c))
+
+    @property
+    def facing(self) -> Literal['N', 'E', 'S', 'W']:
+        projectiles = self._projectiles
+        return FACING_NAMES[projectiles.facing[projectiles.slot_of[self.uid]]]
+
+    @property
+    def intensity(self) -> int:
+        projectiles = self._projectiles
+        return projectiles.intensity[projectiles.slot_of[self.uid]]
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Bullet) and other.uid == self.uid
+
+    def __hash__(self) -> int:
+        return hash(self.uid)
+
+    def __repr__(self) -> str:
+        if not self.alive:
+            return f'Bullet {self.uid} (gone)'
+        return f'Bullet {self.uid} at {self.pos}, facing {self.facing}, intensity {self.intensity}'
+
+
+class Projectiles:
+
+    def __init__(self, grid, players: int = 1):
+        self.grid = grid
+        grid.bullets = self
+        self.trajectories = Trajectories(grid)
+
+        self.cell = array('l')
+        self.facing = bytearray()
+        self.intensity = bytearray()
+        self.uid = array('q')
+        self.slot_of: dict[int, int] = {}
+        self.player_uids: list[int] = [0] * players
+        self.collisions: int = 0  # bullets meeting bullets, ever; for telemetry
+
+    def __len__(self) -> int:
+        return len(self.uid)
+
+    def __iter__(self):
+        return iter([Bullet(self, uid) for uid in self.uid])
+
+    def __contains__(self, bullet: Bullet) -> bool:
+        return isinstance(bullet, Bullet) and bullet.uid in self.slot_of
+
+    def get(self, uid: int) -> Bullet | None:
+        return Bullet(self, uid) if uid in self.slot_of else None
+
+    @property
+    def player_uid(self) -> int:
+        """The first player's bullet, 0 if none."""
+        return self.player_uids[0]
+
+    def player_bullet(self, player: int = 0) -> Bullet | None:
+        uid = self.player_uids[player]
+        return Bullet(self, uid) if uid else None
+
+    def fire(self, i: int, j: int, facing: int, intensity: int = 1, player: int | None = None) -> int:
+        """Spawns a bullet at (i, j), fired by player number ``player`` if given; returns its uid, or 0 if it hit one already there."""
+        grid = self.grid
+        k = i * grid.c + j
+        if other := grid.projectile[k]:
+            self.remove(other)
+            self.collisions += 1
+            return 0
+
+        uid = next(_uids)
+        self.slot_of[uid] = len(self.uid)
+        self.cell.append(k)
+        self.facing.append(facing)
+        self.intensity.append(intensity)
+        self.uid.append(uid)
+        grid.projectile[k] = uid
+        if player is not None:
+            self.player_uids[player] = uid
+        return uid
+
+    def remove(self, uid: int) -> None:
+        self._drop(self.slot_of[uid])
+
+    def _drop(self, slot: int) -> None:
+        # swap the last slot into the hole
+        uid = self.uid[slot]
+        k = self.cell[slot]
+        if self.grid.projectile[k] == uid:
+            self.grid.projectile[k] = 0
+        if uid in self.player_uids:
+            self.player_uids[self.player_uids.index(uid)] = 0
+        del self.slot_of[uid]
+
+        last = len(self.uid) - 1
+        if slot != last:
+            self.cell[slot] = self.cell[last]
+            self.facing[slot] = self.facing[last]
+            self.intensity[slot] = self.intensity[last]
+            self.uid[slot] = moved = self.uid[last]
+            self.slot_of[moved] = slot
+        self.cell.pop()
+        self.facing.pop()
+        self.intensity.pop()
+        self.uid.pop()
+
+    def clear(self) -> None:
+        for k in self.cell:
+            self.grid.projectile[k] = 0
+        del self.cell[:], self.facing[:], self.intensity[:], self.uid[:]
+        self.slot_of.clear()
+        self.player_uids = [0] * len(self.player_uids)
+
+    def step(self) -> bool:
+        """Moves every bullet one cell; returns True if one of them hit home."""
+        grid = self.grid
+        c = grid.c
+        occupancy = grid.projectile
+        trajectories = self.trajectories
+        trajectories.sync()
+        trans = trajectories.trans
+        cell, facing, uids = self.cell, self.facing, self.uid
+        n = len(uids)
+
+        home_hit = False
+        nxt = array('l', [-1]) * n
+        dead = bytearray(n)
+        landing: dict[int, int] = {}
+
+        for s in range(n):
+            k = cell[s]
+            state = k << 2 | facing[s]
+            if (t := trans[state]) == UNKNOWN:
+                t = trajectories.resolve(state)
+
+            if t >= 0:
+                nk = nxt[s] = t >> 2
+                facing[s] = t & 3
+                if (other := landing.get(nk)) is not None:
+                    dead[s] = dead[other] = 1
+                    self.collisions += 1
+                else:
+                    landing[nk] = s
+            elif t == EXIT:
+                dead[s] = 1
+            else:
+                # stopped by a tile; it was broken from behind the bullet
+                f = facing[s] = -2 - t
+                home_hit |= grid.damage_tile(k // c, k % c, dir_broke=(f + 2) % 4 + 1)
+                dead[s] = 1
+
+        # head-on: two bullets trading cells never share one, so check each pair's origins
+        slot_of = self.slot_of
+        for nk, s in landing.items():
+            if (uid := occupancy[nk]) and (o := slot_of[uid]) != s and nxt[o] == cell[s]:
+                dead[s] = dead[o] = 1
+                # the pair is seen from both sides unless the other one lost its landing cell to a third bullet
+                if s < o or landing.get(cell[s]) != o:
+                    self.collisions += 1
+
+        for s in range(n):
+            occupancy[cell[s]] = 0
+        for s in range(n):
+            if not dead[s]:
+                cell[s] = nxt[s]
+                occupancy[nxt[s]] = uids[s]
+
+        # reverse order so a swap-remove only ever moves an already-checked slot
+        for s in range(n - 1, -1, -1):
+            if dead[s]:
+                self._drop(s)
+
+        return home_hit
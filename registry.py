@@ -0,0 +1,58 @@
+"""Indexed collections of game objects.
+
+A Registry holds objects with a ``uid`` (tanks, powerups), keyed by that uid,
+in the order they were added. Membership, lookup and removal are O(1), where
+a list costs a scan. Iteration follows insertion order, the way the enemy
+list always has, so the order enemies act in is unchanged. As with a dict,
+don't add or remove while iterating; iterate over ``list(registry)`` for that.
+"""
+from collections.abc import Iterator
+from typing import Generic, Protocol, TypeVar
+
+
+class HasUid(Protocol):
+    uid: int
+
+
+T = TypeVar('T', bound=HasUid)
+
+
+class Registry(Generic[T]):
+
+    __slots__ = ('_items',)
+
+    def __init__(self, items=()):
+        self._items: dict[int, T] = {item.uid: item for item in items}
+
+    def add(self, item: T) -> None:
+        self._items[item.uid] = item
+
+    def remove(self, item: T) -> None:
+        if self._items.get(item.uid) is not item:
+            raise ValueError(f'{item!r} is not registered')
+        del self._items[item.uid]
+
+    def discard(self, item: T) -> None:
+        if self._items.get(item.uid) is item:
+            del self._items[item.uid]
+
+    def get(self, uid: int) -> T | None:
+        return self._items.get(uid)
+
+    def clear(self) -> None:
+        self._items.clear()
+
+    def __contains__(self, item: object) -> bool:
+        return self._items.get(getattr(item, 'uid', None)) is item
+
+    def __iter__(self) -> Iterator[T]:
+        return iter(self._items.values())
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __bool__(self) -> bool:
+        return bool(self._items)
+
+    def __repr__(self) -> str:
+        return f'Registry({list(self._items.values())!r})'
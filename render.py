@@ -0,0 +1,346 @@
+"""Drawing the play field with pyxel.
+
+The screen is a window of ``rows`` x ``cols`` cells onto the map, and a
+Camera moves it to keep the player away from the edges. Static terrain is
+baked into offscreen images one CHUNK x CHUNK block of cells at a time, when
+the block first comes into view: ``bottom`` (floor, water, mirrors, home) is
+drawn under everything and ``top`` (forest, bricks, stone) over everything.
+Only the chunks near the view are kept, so a huge map costs no more image
+memory than a small one.
+
+After a full redraw (a new grid, or the camera moved), a frame only touches
+visible cells whose contents changed since the last frame: a tank or bullet
+moved, a powerup appeared or a brick lost health. Each of those cells is
+restored from its chunk and its sprites are drawn again. What is on screen is
+found by scanning the visible cells, never the whole map, so the cost of a
+frame follows the size of the window rather than the world.
+
+Sprites are drawn one pixel right of and below their cell, so a cell's
+"footprint" below is that 16x16 square rather than the cell rectangle.
+"""
+from collections import OrderedDict
+
+import pyxel as px
+
+from grid import (
+    Grid, TILE_FOREST, TILE_HOME, TILE_WATER, TILE_STONE, TILE_BRICK, TILE_MIRROR,
+    ROT_BACKSLASH, ROT_SLASH,
+)
+
+DIM = 16
+CHUNK = 16  # cells per side of a baked chunk
+MAX_CHUNKS = 16
+
+# (u, v) in image bank 0
+PLAYER_UV = {'N': (0, 0), 'W': (16, 0), 'E': (32, 0), 'S': (48, 0)}
+ENEMY_UV = {'N': (0, 112), 'W': (16, 112), 'E': (32, 112), 'S': (48, 112)}
+BULLET_UV = [(0, 16), (32, 16), (48, 16), (16, 16)]  # by facing code N E S W
+POWERUP_UV = {'shield': (0, 96), 'health': (16, 96), 'bullet': (32, 96)}
+
+BOTTOM_UV = {
+    (TILE_MIRROR, ROT_BACKSLASH): (16, 80),
+    (TILE_MIRROR, ROT_SLASH): (0, 80),
+    (TILE_WATER, 0): (32, 64),
+    (TILE_HOME, 0): (32, 80),
+}
+# keyed by (type, health, dir_broke code)
+TOP_UV = {
+    (TILE_FOREST, 0, 0): (48, 64),
+    (TILE_STONE, 1, 0): (16, 64),
+    (TILE_BRICK, 2, 0): (0, 64),
+    (TILE_BRICK, 1, 1): (32, 48),
+    (TILE_BRICK, 1, 2): (48, 48),
+    (TILE_BRICK, 1, 3): (16, 48),
+    (TILE_BRICK, 1, 4): (0, 48),
+}
+
+
+class Camera:
+    """A rows x cols window of cells that follows a point, scrolling when it gets within ``margin`` of an edge."""
+
+    def __init__(self, rows: int, cols: int, margin: int = 3):
+        self.rows = rows
+        self.cols = cols
+        self.margin = margin
+        self.top: int = 0
+        self.left: int = 0
+
+    def follow(self, grid: Grid, i: int, j: int) -> bool:
+        """Moves the window to keep cell (i, j) in view; returns True if it moved."""
+        top, left = self.top, self.left
+        margin_i = min(self.margin, (self.rows - 1) // 2)
+        margin_j = min(self.margin, (self.cols - 1) // 2)
+        top = min(top, i - margin_i)
+        top = max(top, i + margin_i + 1 - self.rows)
+        left = min(left, j - margin_j)
+        left = max(left, j + margin_j + 1 - self.cols)
+        top = max(0, min(top, grid.r - self.rows))
+        left = max(0, min(left, grid.c - self.cols))
+        moved = (top, left) != (self.top, self.left)
+        self.top, self.left = top, left
+        return moved
+
+    def bounds(self, grid: Grid) -> tuple[int, int, int, int]:
+        """Visible cells as (first row, end row, first column, end column)."""
+        return self.top, min(grid.r, self.top + self.rows), self.left, min(grid.c, self.left + self.cols)
+
+    @property
+    def x(self) -> int:
+        return self.left * DIM
+
+    @property
+    def y(self) -> int:
+        return self.top * DIM
+
+
+class StageRenderer:
+
+    def __init__(self, rows: int = 16, cols: int = 16, assets: str | None = None):
+        self.camera = Camera(rows, cols)
+        # resource file with the sprite sheet, loaded on the first draw; the title screen doesn't need it
+        self.assets = assets
+        # enough for everything in view plus a ring around it
+        self.max_chunks = max(MAX_CHUNKS, 2 * (rows // CHUNK + 2) * (cols // CHUNK + 2))
+        self.grid: Grid | None = None
+        # (chunk row, chunk column) -> (bottom, top) images, least recently used first
+        self.chunks: OrderedDict[tuple[int, int], tuple[px.Image, px.Image]] = OrderedDict()
+        self.drawn: dict[int, tuple] = {}
+        self.last_hud: list[int] = []
+        self.tiles_seen: int = 0
+        self.full_redraw: bool = True
+        self.covered: set[int] = set()
+        # tank uid -> cell before the last tick, for drawing with alpha < 1
+        self.before: dict[int, int] = {}
+
+    def invalidate(self) -> None:
+        self.full_redraw = True
+
+    def cover(self, x: int, y: int, w: int, h: int) -> None:
+        """Something was drawn over this screen rectangle; repaint the cells under it next frame."""
+        grid = self.grid
+        if grid is None:
+            return
+        x, y = x + self.camera.x, y + self.camera.y
+        for i in range(max(0, (y - 1) // DIM), min(grid.r, (y + h - 1) // DIM + 1)):
+            for j in range(max(0, (x - 1) // DIM), min(grid.c, (x + w - 1) // DIM + 1)):
+                self.covered.add(i * grid.c + j)
+
+    def attach(self, grid: Grid) -> None:
+        self.grid = grid
+        self.chunks.clear()
+        self.drawn = {}
+        self.tiles_seen = len(grid.changed_tiles)
+        self.full_redraw = True
+
+    def chunk(self, ci: int, cj: int) -> tuple[px.Image, px.Image]:
+        """Baked images of one chunk, baking it if it isn't cached."""
+        if images := self.chunks.get((ci, cj)):
+            self.chunks.move_to_end((ci, cj))
+            return images
+        size = CHUNK * DIM + 1
+        images = self.chunks[ci, cj] = (px.Image(size, size), px.Image(size, size))
+        grid = self.grid
+        for i in range(ci * CHUNK, min(grid.r, (ci + 1) * CHUNK)):
+            for j in range(cj * CHUNK, min(grid.c, (cj + 1) * CHUNK)):
+                self.bake_cell(i * grid.c + j, images)
+        while len(self.chunks) > self.max_chunks:
+            self.chunks.popitem(last=False)
+        return images
+
+    def bake_cell(self, k: int, images: tuple[px.Image, px.Image]) -> None:
+        grid = self.grid
+        bottom, top = images
+        i, j = divmod(k, grid.c)
+        x, y = j % CHUNK * DIM + 1, i % CHUNK * DIM + 1
+        type = grid.type[k]
+
+        bottom.rect(x, y, DIM, DIM, 0)
+        if uv := BOTTOM_UV.get((type, grid.rotation[k])):
+            bottom.blt(x, y, 0, *uv, DIM, DIM, 0)
+
+        top.rect(x, y, DIM, DIM, 0)
+        if uv := TOP_UV.get((type, grid.health[k], grid.dir_broke[k])):
+            top.blt(x, y, 0, *uv, DIM, DIM, 0)
+
+    def sprites(self, game) -> dict[int, tuple]:
+        """What each occupied visible cell shows: (tank sprite, bullet facing, powerup sprite)."""
+        grid = game.grid
+        c = grid.c
+        i0, i1, j0, j1 = self.camera.bounds(grid)
+        entities, projectiles, powerups = grid.entity, grid.projectile, grid.powerup
+        objects = grid.objects
+        bullets = game.projectiles
+        players = {player.uid for player in game.players}
+        cells: dict[int, tuple] = {}
+
+        for i in range(i0, i1):
+            row = i * c
+            for j in range(j0, j1):
+                k = row + j
+                tank = bullet = powerup = None
+                if uid := entities[k]:
+                    entity = objects[uid]
+                    tank = (PLAYER_UV if uid in players else ENEMY_UV)[entity.facing]
+                if uid := projectiles[k]:
+                    bullet = bullets.facing[bullets.slot_of[uid]]
+                if uid := powerups[k]:
+                    powerup = POWERUP_UV.get(objects[uid].type)
+                if tank or bullet is not None or powerup:
+                    cells[k] = (tank, bullet, powerup)
+        return cells
+
+    def hud_cells(self, game) -> list[int]:
+        # the ammo/health/shield text around the player spills into the neighbours
+        grid = game.grid
+        pi, pj = game.player.pos.x, game.player.pos.y
+        return [i * grid.c + j for i in (pi - 1, pi) for j in (pj - 1, pj, pj + 1) if grid.in_bounds(i, j)]
+
+    def remember(self, game) -> None:
+        """Notes which cell each tank in (or next to) the view is in, before a tick."""
+        grid = game.grid
+        c = grid.c
+        i0, i1, j0, j1 = self.camera.bounds(grid)
+        j0, j1 = max(0, j0 - 1), min(c, j1 + 1)
+        entities = grid.entity
+        self.before = {entities[k]: k for i in range(max(0, i0 - 1), min(grid.r, i1 + 1)) for k in range(i * c + j0, i * c + j1) if entities[k]}
+
+    def draw(self, game, alpha: float = 1.0) -> None:
+        """Draws the view; with alpha < 1, tanks that moved in the last tick are drawn that far from their cell before."""
+        if self.assets:
+            px.load(self.assets)
+            self.assets = None
+        grid = game.grid
+        if grid is not self.grid:
+            self.attach(grid)
+        camera = self.camera
+        if camera.follow(grid, game.player.pos.x, game.player.pos.y):
+            self.full_redraw = True
+
+        sprites = self.sprites(game)
+        hud = self.hud_cells(game)
+        i0, i1, j0, j1 = camera.bounds(grid)
+        c = grid.c
+
+        # chunks that scrolled out of view stay cached until evicted, and get patched like visible ones
+        changed = grid.changed_tiles[self.tiles_seen:]
+        self.tiles_seen = len(grid.changed_tiles)
+        for k in changed:
+            if images := self.chunks.get((k // c // CHUNK, k % c // CHUNK)):
+                self.bake_cell(k, images)
+
+        px.camera(camera.x, camera.y)
+        if self.full_redraw:
+            px.cls(0)
+            visible = [(ci, cj) for ci in range(i0 // CHUNK, (i1 - 1) // CHUNK + 1) for cj in range(j0 // CHUNK, (j1 - 1) // CHUNK + 1)]
+            for ci, cj in visible:
+                self.blt_chunk(ci, cj, 0)
+            for k, cell in sprites.items():
+                self.draw_sprites(k, cell)
+            for ci, cj in visible:
+                self.blt_chunk(ci, cj, 1)
+            self.full_redraw = False
+        else:
+            dirty = {k for k in sprites.keys() | self.drawn.keys() if sprites.get(k) != self.drawn.get(k)}
+            dirty.update(changed)
+            dirty.update(self.last_hud)
+            dirty.update(hud)
+            dirty.update(self.covered)
+
+            for k in dirty:
+                if i0 <= k // c < i1 and j0 <= k % c < j1:
+                    self.draw_cell(k, sprites.get(k))
+        self.covered.clear()
+        if alpha < 1 and self.before:
+            self.slide(sprites, alpha)
+
+        self.drawn = sprites
+        self.last_hud = hud
+        self.draw_hud(game)
+        px.camera()
+
+    def slide(self, sprites: dict[int, tuple], alpha: float) -> None:
+        grid = self.grid
+        c = grid.c
+        entities = grid.entity
+        back = 1 - alpha
+        for k, (tank, bullet, powerup) in sprites.items():
+            if not tank or (was := self.before.get(entities[k], k)) == k:
+                continue
+            i, j = divmod(k, c)
+            pi, pj = divmod(was, c)
+            if abs(i - pi) + abs(j - pj) != 1:
+                continue
+            self.draw_cell(k, (None, bullet, powerup) if bullet is not None or powerup else None)
+            px.blt(round((j - (j - pj) * back) * DIM) + 1, round((i - (i - pi) * back) * DIM) + 1, 0, *tank, DIM, DIM, 0)
+            for cell in (was, k):
+                i, j = divmod(cell, c)
+                px.blt(j * DIM + 1, i * DIM + 1, self.chunk(i // CHUNK, j // CHUNK)[1], j % CHUNK * DIM + 1, i % CHUNK * DIM + 1, DIM, DIM, 0)
+            # the sprite straddles two cells; both are repainted next frame
+            self.covered.update((was, k))
+
+    def blt_chunk(self, ci: int, cj: int, layer: int) -> None:
+        grid = self.grid
+        w = (min(grid.c, (cj + 1) * CHUNK) - cj * CHUNK) * DIM
+        h = (min(grid.r, (ci + 1) * CHUNK) - ci * CHUNK) * DIM
+        x, y = cj * CHUNK * DIM + 1, ci * CHUNK * DIM + 1
+        if layer:
+            px.blt(x, y, self.chunk(ci, cj)[1], 1, 1, w, h, 0)
+        else:
+            px.blt(x, y, self.chunk(ci, cj)[0], 1, 1, w, h)
+
+    def draw_cell(self, k: int, cell: tuple | None) -> None:
+        i, j = divmod(k, self.grid.c)
+        x, y = j * DIM + 1, i * DIM + 1
+        u, v = j % CHUNK * DIM + 1, i % CHUNK * DIM + 1
+        bottom, top = self.chunk(i // CHUNK, j // CHUNK)
+        px.blt(x, y, bottom, u, v, DIM, DIM)
+        if cell:
+            self.draw_sprites(k, cell)
+        px.blt(x, y, top, u, v, DIM, DIM, 0)
+
+    def draw_sprites(self, k: int, cell: tuple) -> None:
+        i, j = divmod(k, self.grid.c)
+        x, y = j * DIM + 1, i * DIM + 1
+        tank, bullet, powerup = cell
+        if tank:
+            px.blt(x, y, 0, *tank, DIM, DIM, 0)
+        if bullet is not None:
+            px.blt(x, y, 0, *BULLET_UV[bullet], DIM, DIM, 0)
+        if powerup:
+            px.blt(x, y, 0, *powerup, DIM, DIM, 0)
+
+    def draw_hud(self, game) -> None:
+        player = game.player
+        x, y = player.pos.y * DIM, player.pos.x * DIM
+        px.text(x, y, str(player.ammo), 7)
+        px.text(x + 16, y, str(player.health), 7)
+        if player.is_invulnerable_counter:
+            px.text(x + 8, y + 8, str(player.is_invulnerable_counter), 7)
+
+PROFILE_WIDTH = 128
+PROFILE_GRAPH = 24
+
+
+def draw_profile(profiler, fps: int, x: int = 2, y: int = 2) -> tuple[int, int, int, int]:
+    """Profiler overlay: frame times, the slowest sections and counters; returns the rectangle it covers."""
+    times = profiler.frame_times()
+    lines = []
+    if times:
+        lines.append(f'frame {sum(times) / len(times):5.2f}ms avg {max(times):5.2f} max')
+    lines.extend(f'{ms:5.2f} {label}' for label, ms in list(profiler.averages().items())[:6])
+    lines.append(' '.join(f'{name} {value}' for name, value in profiler.counts.items()))
+
+    w, h = PROFILE_WIDTH, 4 + 7 * len(lines) + PROFILE_GRAPH
+    px.rect(x, y, w, h, 0)
+    px.rectb(x, y, w, h, 5)
+    for n, line in enumerate(lines):
+        px.text(x + 2, y + 2 + 7 * n, line, 7)
+
+    # one bar per frame, newest on the right; the frame budget sits halfway up
+    budget = 1000 / fps
+    base = y + h - 2
+    for n, ms in enumerate(times[-(w - 4):]):
+        bar = min(PROFILE_GRAPH - 2, round(ms / budget * (PROFILE_GRAPH - 2) / 2))
+        px.line(x + 2 + n, base, x + 2 + n, base - bar, 8 if ms > budget else 11)
+    px.line(x + 2, base - (PROFILE_GRAPH - 2) // 2, x + w - 3, base - (PROFILE_GRAPH - 2) // 2, 5)
+    return x, y, w, h
@@ -0,0 +1,224 @@
+"""Recording a session's input and replaying it headless.
+
+A game is fully decided by its stages, seed, fps, AI settings and the buttons of
+every tick, so that is all a recording holds. Runs of identical input collapse
+into one record (most ticks nobody presses anything). A checkpoint with the
+simulation's ``state_hash`` is written every ``every`` ticks. On replay each
+checkpoint is checked, and the first mismatch shows where the run desynced.
+
+File layout (little-endian)::
+
+    header      b'BCRP', u16 version, u16 fps, u64 seed, u8 ai,
+                u8 AI move budget (0: none, 0xff: staggered, no limit),
+                u16 far radius (0xffff: none), u32 checkpoint interval,
+                8-byte stage digest
+    records     b'I' u16 buttons, u32 ticks      run of identical input
+                b'C' u32 frame, u64 state hash   state before that tick
+
+Records go to disk at every checkpoint, so a session killed mid-game still
+replays up to its last checkpoint. Run
+``python replay.py SESSION.bcr [--until FRAME] [--stages stage_data.json]``
+to replay one.
+"""
+import struct
+import sys
+import time
+from collections.abc import Sequence
+from hashlib import blake2b
+from typing import BinaryIO
+
+from engine import Simulation
+from scheduler import BudgetQueue
+from stages import Stage, compile_stage, load_stages
+
+MAGIC = b'BCRP'
+VERSION = 2
+HEADER = struct.Struct('<4sHHQBBHI8s')
+RUN = struct.Struct('<HI')
+CHECKPOINT = struct.Struct('<IQ')
+AI_CODES = {'random': 0, 'flow': 1}
+NO_RADIUS = 0xFFFF
+NO_BUDGET = 0
+NO_LIMIT = 0xFF
+
+
+class ReplayError(ValueError):
+    pass
+
+
+class DesyncError(ReplayError):
+
+    def __init__(self, frame: int, expected: int, actual: int):
+        super().__init__(f'desync at frame {frame}: expected state {expected:016x}, got {actual:016x}')
+        self.frame = frame
+        self.expected = expected
+        self.actual = actual
+
+
+def stage_digest(stages: Sequence[Stage] | list[list[list[int]]]) -> bytes:
+    h = blake2b(digest_size=8)
+    for stage in stages:
+        if not isinstance(stage, Stage):
+            stage = compile_stage(stage)
+        h.update(struct.pack('<HH', stage.r, stage.c))
+        h.update(stage.tiles)
+    return h.digest()
+
+
+class Recorder:
+    """Attach to a Simulation to log each tick's buttons as they are read."""
+
+    def __init__(self, sim: Simulation, file: BinaryIO, every: int = 600):
+        self.file = file
+        self.every = every
+        self.buffer = bytearray()
+        self.buttons: int = -1
+        self.length: int = 0
+
+        budget = sim.ai_budget
+        if budget is not None and (budget.seconds is not None or (budget.moves or 0) >= NO_LIMIT):
+            raise ReplayError('only AI budgets of fewer than 255 moves a tick can be replayed, not time budgets')
+        moves = NO_BUDGET if budget is None else NO_LIMIT if budget.moves is None else budget.moves
+        far_radius = NO_RADIUS if sim.far_radius is None else sim.far_radius
+        file.write(HEADER.pack(MAGIC, VERSION, sim.fps, sim.seed, AI_CODES[sim.ai], moves, far_radius, every, stage_digest(sim.stages)))
+        sim.recorder = self
+
+    @classmethod
+    def open(cls, sim: Simulation, path: str, every: int = 600) -> 'Recorder':
+        return cls(sim, open(path, 'wb'), every)
+
+    def record(self, sim: Simulation) -> None:
+        frame = sim.frame_count
+        if not frame % self.every:
+            self._end_run()
+            self.buffer += b'C' + CHECKPOINT.pack(frame, sim.state_hash())
+            self.flush()
+        if sim.buttons != self.buttons:
+            self._end_run()
+            self.buttons = sim.buttons
+        self.length += 1
+
+    def _end_run(self) -> None:
+        if self.length:
+            self.buffer += b'I' + RUN.pack(self.buttons, self.length)
+            self.length = 0
+
+    def flush(self) -> None:
+        self.file.write(self.buffer)
+        self.file.flush()
+        self.buffer.clear()
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        self._end_run()
+        self.flush()
+        self.file.close()
+
+
+class Recording:
+
+    def __init__(self, fps: int, seed: int, ai: str, far_radius: int | None, every: int, digest: bytes, runs: list[tuple[int, int]], checkpoints: dict[int, int],
+                 ai_moves: int = NO_BUDGET):
+        self.fps = fps
+        self.seed = seed
+        self.ai = ai
+        self.far_radius = far_radius
+        self.ai_moves = ai_moves
+        self.every = every
+        self.digest = digest
+        self.runs = runs
+        self.checkpoints = checkpoints
+
+    def __len__(self) -> int:
+        return sum(length for _, length in self.runs)
+
+    @classmethod
+    def load(cls, path: str) -> 'Recording':
+        with open(path, 'rb') as file:
+            data = file.read()
+        if len(data) < HEADER.size:
+            raise ReplayError(f'{path} is too short to be a recording')
+        magic, version, fps, seed, ai, ai_moves, far_radius, every, digest = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ReplayError(f'{path} is not a version {VERSION} recording')
+
+        runs: list[tuple[int, int]] = []
+        checkpoints: dict[int, int] = {}
+        offset = HEADER.size
+        # a session killed mid-write may end in a partial record; everything before it is good
+        while offset < len(data):
+            tag = data[offset:offset + 1]
+            if tag == b'I' and offset + 1 + RUN.size <= len(data):
+                runs.append(RUN.unpack_from(data, offset + 1))
+                offset += 1 + RUN.size
+            elif tag == b'C' and offset + 1 + CHECKPOINT.size <= len(data):
+                frame, state = CHECKPOINT.unpack_from(data, offset + 1)
+                checkpoints[frame] = state
+                offset += 1 + CHECKPOINT.size
+            else:
+                break
+        ais = {code: name for name, code in AI_CODES.items()}
+        return cls(fps, seed, ais[ai], None if far_radius == NO_RADIUS else far_radius, every, digest, runs, checkpoints, ai_moves)
+
+    def simulation(self, stages: Sequence[Stage] | list[list[list[int]]]) -> Simulation:
+        if stage_digest(stages) != self.digest:
+            raise ReplayError('the stages differ from the ones this session was recorded with')
+        budget = None if self.ai_moves == NO_BUDGET else BudgetQueue(None if self.ai_moves == NO_LIMIT else self.ai_moves)
+        return Simulation(stages, fps=self.fps, ai=self.ai, seed=self.seed, far_radius=self.far_radius, ai_budget=budget)
+
+    def replay(self, stages: Sequence[Stage] | list[list[list[int]]], until: int | None = None, verify: bool = True) -> Simulation:
+        """Re-runs the session with no rendering, up to frame ``until`` or the end.
+
+        Checkpoints are verified on the way unless ``verify`` is False; a
+        mismatch raises DesyncError. Returns the simulation where it stopped,
+        e.g. to look at or keep playing the frame a bug report is about.
+        """
+        sim = self.simulation(stages)
+        checkpoints = self.checkpoints if verify else {}
+        end = len(self) if until is None else min(until, len(self))
+        frame = sim.frame_count
+        for buttons, length in self.runs:
+            for _ in range(min(length, end - frame)):
+                if frame in checkpoints and (state := sim.state_hash()) != checkpoints[frame]:
+                    raise DesyncError(frame, checkpoints[frame], state)
+                sim.step(buttons)
+                frame += 1
+            if frame >= end:
+                break
+        if verify and frame in checkpoints and (state := sim.state_hash()) != checkpoints[frame]:
+            raise DesyncError(frame, checkpoints[frame], state)
+        return sim
+
+
+def main(argv: list[str]) -> int:
+    args: list[str] = []
+    options: dict[str, str] = {}
+    rest = iter(argv)
+    for arg in rest:
+        if arg.startswith('--'):
+            options[arg] = next(rest, '')
+        else:
+            args.append(arg)
+    if len(args) != 1:
+        print('usage: python replay.py SESSION.bcr [--until FRAME] [--stages STAGES]')
+        return 2
+    recording = Recording.load(args[0])
+    stages = load_stages(options.get('--stages', 'stage_data.json'))
+    until = int(options['--until']) if '--until' in options else None
+
+    start = time.perf_counter()
+    try:
+        sim = recording.replay(stages, until)
+    except DesyncError as error:
+        print(error)
+        return 1
+    elapsed = time.perf_counter() - start
+    checked = sum(frame <= sim.frame_count for frame in recording.checkpoints)
+    print(f'replayed {sim.frame_count} of {len(recording)} ticks in {elapsed:.2f}s '
+          f'({sim.frame_count / max(elapsed, 1e-9):.0f} ticks/s), {checked} checkpoints match')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,170 @@
+"""Tick scheduler for everything that happens every so often.
+
+A hashed timer wheel: a timer due on tick ``t`` sits in slot ``t % size``, so
+a tick only looks at the timers in its own slot instead of asking every
+system and every tank whether it is due. Timers due further out than one turn
+of the wheel just wait in their slot until their tick comes round.
+
+Repeating timers fire on multiples of their interval, the same ticks a
+``frame_count % interval`` check would pick. Each timer belongs to a phase
+and ``run`` fires one phase at a time, so a tick's work keeps a fixed order
+(spawns, then the world, then tanks once hits are settled).
+
+A repeating timer can be given an ``offset`` to fire on the ticks after those
+multiples instead, which spreads many timers of one interval over the ticks
+between them. ``BudgetQueue`` caps what runs per tick: jobs that came due wait
+in it, oldest first, and each tick runs as many as its budget (a job count or
+a time limit) allows. The rest carry over, and overruns are counted.
+"""
+from collections import deque
+from time import perf_counter
+from typing import Callable, Generic, TypeVar
+
+PHASE_SPAWN = 0
+PHASE_WORLD = 1
+PHASE_TANKS = 2
+
+
+class Timer:
+
+    __slots__ = ('due', 'interval', 'callback', 'phase', 'cancelled')
+
+    def __init__(self, due: int, interval: int, callback: Callable[[], object], phase: int):
+        self.due = due
+        self.interval = interval
+        self.callback = callback
+        self.phase = phase
+        self.cancelled: bool = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+    def __repr__(self) -> str:
+        return f'Timer due {self.due} every {self.interval} ({getattr(self.callback, "__name__", self.callback)})'
+
+
+class TimerWheel:
+
+    def __init__(self, size: int = 256):
+        self.size = size
+        self.slots: list[list[Timer]] = [[] for _ in range(size)]
+        # (tick, phase) of the last run, so timers added after their phase ran this tick start from the next one
+        self.last_run: tuple[int, int] | None = None
+
+    def __len__(self) -> int:
+        return sum(not timer.cancelled for slot in self.slots for timer in slot)
+
+    def _insert(self, timer: Timer) -> Timer:
+        self.slots[timer.due % self.size].append(timer)
+        return timer
+
+    def at(self, due: int, callback: Callable[[], object], phase: int = PHASE_WORLD) -> Timer:
+        """One-shot timer firing on tick ``due``."""
+        return self._insert(Timer(due, 0, callback, phase))
+
+    def every(self, interval: int, callback: Callable[[], object], now: int, phase: int = PHASE_WORLD, offset: int = 0) -> Timer:
+        """Repeating timer firing on every multiple of ``interval`` (plus ``offset``) from ``now`` on.
+
+        ``now`` is included unless ``phase`` has already run on it, e.g. a new game set up in the middle of a tick.
+        """
+        interval = max(1, interval)
+        if (last := self.last_run) is not None and last[0] == now and last[1] >= phase:
+            now += 1
+        return self._insert(Timer(now + (offset - now) % interval, interval, callback, phase))
+
+    def run(self, now: int, phase: int = PHASE_WORLD) -> int:
+        """Fires the timers of ``phase`` due on tick ``now``; returns how many fired."""
+        self.last_run = now, phase
+        index = now % self.size
+        slot = self.slots[index]
+        if not slot:
+            return 0
+
+        due, keep = [], []
+        for timer in slot:
+            if timer.cancelled:
+                continue
+            (due if timer.due == now and timer.phase == phase else keep).append(timer)
+        if not due:
+            return 0
+        self.slots[index] = keep
+
+        for timer in due:
+            # rearm first, so the callback can still cancel it
+            if timer.interval:
+                timer.due += timer.interval
+                self._insert(timer)
+            timer.callback()
+        return len(due)
+
+    def clear(self) -> None:
+        for slot in filter(None, self.slots):
+            for timer in slot:
+                timer.cancelled = True
+            slot.clear()
+
+
+T = TypeVar('T')
+
+
+class BudgetQueue(Generic[T]):
+    """Jobs waiting for their turn, run oldest first, at most ``moves`` or ``seconds`` worth per tick.
+
+    A time budget reads the clock, so what runs when depends on the machine:
+    fine for the front end, not for replays or lockstep play.
+    """
+
+    def __init__(self, moves: int | None = None, seconds: float | None = None, clock: Callable[[], float] = perf_counter):
+        if moves is not None and moves < 1:
+            # a budget of no moves would never run anything
+            raise ValueError(f'a move budget needs at least 1 move a tick, not {moves}')
+        self.moves = moves
+        self.seconds = seconds
+        self.clock = clock
+        self.queue: deque[tuple[int, T]] = deque()
+        self.queued: set[int] = set()
+        # totals: ticks run, ticks that left jobs over, jobs carried over (summed per tick), longest wait list
+        self.ticks: int = 0
+        self.overruns: int = 0
+        self.deferred: int = 0
+        self.longest: int = 0
+
+    def __len__(self) -> int:
+        return len(self.queue)
+
+    def push(self, key: int, item: T) -> None:
+        """Queues ``item`` unless one with the same key is already waiting."""
+        if key not in self.queued:
+            self.queued.add(key)
+            self.queue.append((key, item))
+
+    def run(self, act: Callable[[int, T], object]) -> int:
+        """Calls ``act(key, item)`` for as many waiting jobs as the budget allows; returns how many ran."""
+        self.ticks += 1
+        queue = self.queue
+        if not queue:
+            return 0
+        limit = len(queue) if self.moves is None else min(self.moves, len(queue))
+        deadline = None if self.seconds is None else self.clock() + self.seconds
+        done = 0
+        while done < limit:
+            key, item = queue.popleft()
+            self.queued.discard(key)
+            act(key, item)
+            done += 1
+            if deadline is not None and self.clock() >= deadline:
+                break
+        if queue:
+            self.overruns += 1
+            self.deferred += len(queue)
+            self.longest = max(self.longest, len(queue))
+        return done
+
+    def clear(self) -> None:
+        self.queue.clear()
+        self.queued.clear()
+
+    def report(self) -> str:
+        """The totals as a line of text, for the end of a session."""
+        return (f'{self.overruns} of {self.ticks} ticks over budget, {self.deferred} jobs carried over, '
+                f'at most {self.longest} waiting')
@@ -0,0 +1,445 @@
+"""Snapshots of a game in progress, for rewind, save states and lookahead search.
+
+``take_snapshot(sim)`` copies everything that decides what happens next into
+a few bytes objects: the tile arrays, and tanks, bullets, powerups, pending
+timers and counters packed with struct. ``restore_snapshot(sim, snap)`` puts
+it back. Both take microseconds on the shipped stages, so a search can try
+many futures per frame: snapshot, step, look, restore.
+
+Consecutive snapshots needn't copy the terrain again. Given a ``base`` (a full
+snapshot of the same stage), a snapshot keeps only the cells the grid's
+``changed_tiles`` journal lists since the base and shares the rest with it.
+Restoring goes by the journal too: only cells changed since the snapshot are
+written back, and they are journaled again, so the renderer, trajectories,
+flow field and observers catch up on their own.
+
+A snapshot holds on to the grid it was taken on, so restoring one from an
+earlier stage works. ``to_bytes``/``from_bytes`` give a self-contained save
+state, which restores onto a fresh copy of its stage.
+
+Timers are kept in wheel order, not just re-registered, since tanks due on the
+same tick act in the order they were queued. A recorder attached to the
+simulation logs whatever is stepped, lookahead included; set
+``sim.recorder = None`` while searching.
+"""
+import struct
+from array import array
+from collections import deque
+from functools import partial
+from itertools import chain
+
+from entities import Tank
+from grid import Grid
+from pathfinding import FlowField
+from projectiles import Projectiles, _uids as bullet_uids
+from stages import compile_stage, load_grid, Stage
+
+MAGIC = b'BCSS'
+VERSION = 3
+HEADER = struct.Struct('<4sHIII')
+# frame, scene, stage, score, home active, shots, kills, enemy/powerup spawn rate, fps,
+# then counts: players, tanks, bullets, powerups, timers, queued enemy moves
+SCALARS = struct.Struct('<IBHi?IIHHHBHHHHH')
+# uid, x, y, role, facing, health, alive, shield, ammo, attack, speed, kind
+TANK = struct.Struct('<qiiBBh?iihhB')
+# due, interval, phase, job
+TIMER = struct.Struct('<IIBH')
+
+ROLE_PLAYER = 0
+ROLE_ENEMY = 1
+ROLE_GHOST = 2  # on the grid but no longer in the enemy list (the clear-enemies debug key)
+
+KINDS = ['Normie', 'Health', 'Attack', 'Speed']
+KIND_CODES = {kind: code for code, kind in enumerate(KINDS)}
+
+# timer jobs 0-3 are these methods, 4 + n is tank n's move, UNKNOWN_JOB anything else
+JOBS = ('spawn_enemies', 'spawn_powerups', 'update_projectiles', 'update_shield')
+TANK_JOB = len(JOBS)
+UNKNOWN_JOB = 0xFFFF
+
+
+class SnapshotError(ValueError):
+    pass
+
+
+class Snapshot:
+
+    __slots__ = ('frame', 'grid', 'projectiles', 'flow', 'home', 'journal', 'base', 'tiles', 'cells', 'state', 'rng', 'callbacks')
+
+    def __init__(self, frame: int, grid: Grid | None, projectiles: Projectiles | None, flow: FlowField | None, home: int | None, journal: int,
+                 base: 'Snapshot | None', tiles: bytes, cells: dict[int, int], state: bytes, rng: tuple | None, callbacks: list):
+        self.frame = frame
+        self.grid = grid
+        self.projectiles = projectiles
+        self.flow = flow
+        self.home = home
+        self.journal = journal  # a point in grid.changed_tiles where the grid matched this snapshot
+        self.base = base  # the full snapshot a delta's tiles build on
+        # full: type, health, rotation, dir_broke back to back; delta: those four per cell in ``cells``
+        self.tiles = tiles
+        self.cells = cells  # delta only: cell -> its position in ``tiles``
+        self.state = state
+        self.rng = rng  # None leaves the simulation's own alone
+        self.callbacks = callbacks  # timer callbacks that aren't a known job, in order
+
+    @property
+    def is_delta(self) -> bool:
+        return self.base is not None
+
+    def __len__(self) -> int:
+        """Bytes this snapshot holds on its own (a delta shares its base's tiles)."""
+        return len(self.tiles) + len(self.state)
+
+    def __repr__(self) -> str:
+        kind = f'delta of {len(self.cells)} cells' if self.base is not None else 'full'
+        return f'Snapshot of frame {self.frame} ({kind}, {len(self)} bytes)'
+
+    def tile_bytes(self) -> bytes:
+        """The four tile arrays back to back, resolving a delta against its base."""
+        if self.base is None:
+            return self.tiles
+        tiles = bytearray(self.base.tiles)
+        n = len(tiles) // 4
+        for k, at in self.cells.items():
+            for layer in range(4):
+                tiles[layer * n + k] = self.tiles[4 * at + layer]
+        return bytes(tiles)
+
+    def to_bytes(self) -> bytes:
+        """A self-contained save state; see ``from_bytes``."""
+        if self.callbacks:
+            raise SnapshotError('timers with callbacks other than the simulation\'s own jobs can\'t be saved')
+        version, state, gauss = self.rng
+        tiles = self.tile_bytes()
+        header = HEADER.pack(MAGIC, VERSION, len(tiles), len(self.state), len(state))
+        return b''.join((header, tiles, self.state, array('I', state).tobytes(), struct.pack('<Bd', gauss is not None, gauss or 0.0)))
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'Snapshot':
+        if len(data) < HEADER.size:
+            raise SnapshotError('too short to be a snapshot')
+        magic, version, tiles, state, rng = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise SnapshotError(f'not a version {VERSION} snapshot')
+        offset = HEADER.size
+        if len(data) != offset + tiles + state + 4 * rng + 9:
+            raise SnapshotError('snapshot is truncated or has trailing bytes')
+        tile_data = data[offset:offset + tiles]
+        state_data = data[offset + tiles:offset + tiles + state]
+        offset += tiles + state
+        words = array('I')
+        words.frombytes(data[offset:offset + 4 * rng])
+        has_gauss, gauss = struct.unpack_from('<Bd', data, offset + 4 * rng)
+        frame = SCALARS.unpack_from(state_data)[0]
+        return cls(frame, None, None, None, None, 0, None, tile_data, {}, state_data, (3, tuple(words), gauss if has_gauss else None), [])
+
+
+def take_snapshot(sim, base: Snapshot | None = None, timers: bool = True) -> Snapshot:
+    """Captures ``sim``; with ``base``, a full snapshot of the current stage, only terrain changed since is copied.
+
+    Without ``timers`` the snapshot shows the game but can't carry on playing it
+    (nothing spawns or moves after restoring); that is all a mirror needs.
+    """
+    grid = sim.grid
+    journal = len(grid.changed_tiles)
+
+    if base is not None and base.grid is grid and base.base is None:
+        cells = {}
+        values = bytearray()
+        tile, health, rotation, dir_broke = grid.type, grid.health, grid.rotation, grid.dir_broke
+        for k in grid.changed_tiles[base.journal:]:
+            if k not in cells:
+                cells[k] = len(cells)
+                values += bytes((tile[k], health[k], rotation[k], dir_broke[k]))
+        tiles = bytes(values)
+    else:
+        base = None
+        cells = {}
+        tiles = b''.join((grid.type, grid.health, grid.rotation, grid.dir_broke))
+
+    state, callbacks = pack_state(sim, timers)
+    return Snapshot(sim.frame_count, grid, sim.projectiles, sim.flow, sim.home, journal, base, tiles, cells, state, sim.rng.getstate(), callbacks)
+
+
+def pack_state(sim, timers: bool = True) -> tuple[bytes, list]:
+    """Everything but the tiles and the RNG, as bytes, plus the timer callbacks that have no job code."""
+    grid = sim.grid
+    projectiles = sim.projectiles
+    players = sim.players
+    tanks = [*players, *sim.enemies]
+    roles = [ROLE_PLAYER] * len(players) + [ROLE_ENEMY] * len(sim.enemies)
+    if len(grid.objects) > len(tanks) + len(sim.powerups):
+        enemies = sim.enemies
+        for obj in grid.objects.values():
+            if isinstance(obj, Tank) and obj not in players and obj not in enemies:
+                tanks.append(obj)
+                roles.append(ROLE_GHOST)
+
+    # pending timers in wheel order, each as a job code
+    jobs = {getattr(sim, name): code for code, name in enumerate(JOBS)}
+    index = {id(tank): n for n, tank in enumerate(tanks)}
+    pending = []
+    callbacks = []
+    for timer in chain.from_iterable(sim.timers.slots if timers else ()):
+        if timer.cancelled:
+            continue
+        callback = timer.callback
+        job = jobs.get(callback)
+        if job is None:
+            if type(callback) is partial and callback.args and (n := index.get(id(callback.args[0]))) is not None:
+                job = TANK_JOB + n
+            else:
+                job = UNKNOWN_JOB
+                callbacks.append(callback)
+        pending.append(TIMER.pack(timer.due, timer.interval, timer.phase, job))
+    # enemy moves deferred by the AI budget, as tank numbers
+    queued = array('H', [index[id(tank)] for uid, tank in sim.ai_budget.queue if tank.uid == uid and id(tank) in index]
+                   if sim.ai_budget else ())
+
+    c = grid.c
+    powerups = array('i', [spot[0] * c + spot[1] for spot in sim.powerup_spawn_spots if grid.powerup[spot[0] * c + spot[1]]])
+    state = b''.join((
+        SCALARS.pack(sim.frame_count, sim.scene, sim.current_stage, sim.score, sim.is_home_active, sim.shots_fired, sim.kills,
+                     sim.enemy_spawn_rate, sim.powerup_spawn_rate, sim.fps,
+                     len(players), len(tanks), len(projectiles), len(powerups), len(pending), len(queued)),
+        array('q', projectiles.player_uids).tobytes(),
+        *[TANK.pack(t.uid, t.pos.x, t.pos.y, role, t.facing_code, t.health, t.alive, t.is_invulnerable_counter, t.ammo, t.attack_dmg, t.speed, KIND_CODES[t.type])
+          for t, role in zip(tanks, roles)],
+        array('i', projectiles.cell).tobytes(), projectiles.facing, projectiles.intensity, projectiles.uid.tobytes(),
+        powerups.tobytes(),
+        *pending,
+        queued.tobytes(),
+    ))
+    return state, callbacks
+
+
+def restore_snapshot(sim, snap: Snapshot) -> None:
+    """Puts ``sim`` back in the state ``snap`` was taken in."""
+    state = snap.state
+    (frame, scene, current_stage, score, home_active, shots, kills, enemy_rate, powerup_rate, fps,
+     player_count, tank_count, bullet_count, powerup_count, timer_count, queued_count) = SCALARS.unpack_from(state)
+    offset = SCALARS.size
+    player_bullets = array('q')
+    player_bullets.frombytes(state[offset:offset + 8 * player_count])
+    offset += 8 * player_count
+
+    fresh = snap.grid is None
+    if fresh:
+        grid, projectiles, flow, home = _load_stage(sim, current_stage, snap.tiles)
+    else:
+        grid, projectiles, flow, home = snap.grid, snap.projectiles, snap.flow, snap.home
+        _restore_tiles(grid, snap)
+
+    # take everything off the grid; what is still there in the snapshot goes back
+    live: dict[int, Tank] = {}
+    for obj in (*sim.grid.objects.values(), *sim.enemies):
+        if isinstance(obj, Tank):
+            live[obj.uid] = obj
+    if grid is sim.grid:
+        for tank in live.values():
+            grid.entity[tank.pos.x * grid.c + tank.pos.y] = 0
+    else:
+        # the tanks this grid last held may have been recycled and moved since
+        grid.entity[:] = array('q', bytes(len(grid.entity) * 8))
+    for i, j in grid.powerup_spawn_spots:
+        grid.powerup[i * grid.c + j] = 0
+    grid.objects.clear()
+    projectiles.clear()
+
+    sim.grid, sim.projectiles, sim.flow, sim.home = grid, projectiles, flow, home
+    sim.enemy_spawn_spots = grid.enemy_spawn_spots
+    sim.powerup_spawn_spots = grid.powerup_spawn_spots
+
+    c = grid.c
+    entity, objects = grid.entity, grid.objects
+    tanks: list[Tank] = []
+    players = sim.players
+    for player in players:
+        live.pop(player.uid, None)
+    sim.enemies.clear()
+    for _ in range(tank_count):
+        uid, x, y, role, facing, health, alive, shield, ammo, attack, speed, kind = TANK.unpack_from(state, offset)
+        offset += TANK.size
+        if role == ROLE_PLAYER and len(tanks) < len(players):
+            tank = players[len(tanks)]
+        elif fresh or (tank := live.pop(uid, None)) is None:
+            tank = sim.tanks.acquire(x, y)
+        if not fresh:
+            tank.uid = uid
+        pos = tank.pos
+        pos.x, pos.y = x, y
+        tank.facing_code = facing
+        tank.health = health
+        tank.alive = alive
+        tank.is_invulnerable_counter = shield
+        tank.ammo = ammo
+        tank.attack_dmg = attack
+        tank.speed = speed
+        tank.type = KINDS[kind]
+        entity[x * c + y] = tank.uid
+        objects[tank.uid] = tank
+        if role == ROLE_ENEMY:
+            sim.enemies.add(tank)
+        tanks.append(tank)
+    for tank in live.values():
+        sim.tanks.release(tank)
+    sim.players = tanks[:player_count]
+    sim.player = tanks[0]
+    sim.player_count = player_count
+
+    cells = array('i')
+    cells.frombytes(state[offset:offset + 4 * bullet_count])
+    offset += 4 * bullet_count
+    facings = state[offset:offset + bullet_count]
+    intensities = state[offset + bullet_count:offset + 2 * bullet_count]
+    offset += 2 * bullet_count
+    uids = array('q')
+    uids.frombytes(state[offset:offset + 8 * bullet_count])
+    offset += 8 * bullet_count
+    if fresh:
+        # uids from another process could clash with this one's
+        renamed = {uid: next(bullet_uids) for uid in uids}
+        player_bullets = [renamed.get(uid, 0) for uid in player_bullets]
+        uids = array('q', [renamed[uid] for uid in uids])
+    projectiles.cell.fromlist(cells.tolist())
+    projectiles.facing += facings
+    projectiles.intensity += intensities
+    projectiles.uid.extend(uids)
+    projectiles.slot_of.update((uid, slot) for slot, uid in enumerate(uids))
+    projectiles.player_uids = list(player_bullets)
+    occupancy = grid.projectile
+    for k, uid in zip(cells, uids):
+        occupancy[k] = uid
+
+    spots = array('i')
+    spots.frombytes(state[offset:offset + 4 * powerup_count])
+    offset += 4 * powerup_count
+    sim.powerups.clear()
+    for k in spots:
+        powerup = grid.powerup_spawn_spots[divmod(k, c)]
+        grid.powerup[k] = powerup.uid
+        objects[powerup.uid] = powerup
+        sim.powerups.add(powerup)
+
+    sim.clock.frame_count = frame
+    sim.scene = scene
+    sim.current_stage = current_stage
+    sim.score = score
+    sim.is_home_active = home_active
+    sim.shots_fired = shots
+    sim.kills = kills
+    sim.enemy_spawn_rate = enemy_rate
+    sim.powerup_spawn_rate = powerup_rate
+    sim.fps = fps
+    if snap.rng is not None:
+        sim.rng.setstate(snap.rng)
+
+    wheel = sim.timers
+    wheel.clear()
+    # the restored tick hasn't run yet, whatever tick the wheel was on
+    wheel.last_run = None
+    sim.enemy_timers = enemy_timers = {}
+    callbacks = iter(snap.callbacks)
+    for _ in range(timer_count):
+        due, interval, phase, job = TIMER.unpack_from(state, offset)
+        offset += TIMER.size
+        if job < TANK_JOB:
+            callback = getattr(sim, JOBS[job])
+        elif job == UNKNOWN_JOB:
+            callback = next(callbacks)
+        else:
+            tank = tanks[job - TANK_JOB]
+            callback = partial(sim.enemy_move, tank)
+        timer = wheel.at(due, callback, phase)
+        timer.interval = interval
+        if job >= TANK_JOB and job != UNKNOWN_JOB:
+            enemy_timers[tank.uid] = timer
+
+    queued = array('H')
+    queued.frombytes(state[offset:offset + 2 * queued_count])
+    if sim.ai_budget is not None:
+        sim.ai_budget.clear()
+        for n in queued:
+            sim.ai_budget.push(tanks[n].uid, tanks[n])
+
+
+def _restore_tiles(grid: Grid, snap: Snapshot) -> None:
+    # tiles now differ from the snapshot only in cells journaled since it was taken
+    changed = grid.changed_tiles
+    cells = set(changed[snap.journal:])
+    if not cells:
+        snap.journal = len(changed)
+        return
+    full = snap.base if snap.base is not None else snap
+    n = grid.r * grid.c
+    layers = (grid.type, grid.health, grid.rotation, grid.dir_broke)
+    if len(cells) > n // 16:
+        tiles = full.tiles
+        for layer, data in enumerate(layers):
+            data[:] = tiles[layer * n:(layer + 1) * n]
+        cells_changed = snap.cells.items() if snap.base is not None else ()
+        for k, at in cells_changed:
+            for layer, data in enumerate(layers):
+                data[k] = snap.tiles[4 * at + layer]
+    else:
+        delta = snap.cells if snap.base is not None else {}
+        for k in cells:
+            if (at := delta.get(k)) is not None:
+                for layer, data in enumerate(layers):
+                    data[k] = snap.tiles[4 * at + layer]
+            else:
+                for layer, data in enumerate(layers):
+                    data[k] = full.tiles[layer * n + k]
+    changed.extend(cells)
+    # the grid matches the snapshot again here, so restoring it next time only looks at what changes from now on
+    snap.journal = len(changed)
+
+
+def _load_stage(sim, current_stage: int, tiles: bytes) -> tuple[Grid, Projectiles, FlowField, int | None]:
+    stage = sim.stages[current_stage - 1]
+    if not isinstance(stage, Stage):
+        stage = compile_stage(stage)
+    grid = load_grid(stage)
+    n = grid.r * grid.c
+    if len(tiles) != 4 * n:
+        raise SnapshotError(f'snapshot is of a {len(tiles) // 4}-cell stage, stage {current_stage} has {n}')
+    for layer, data in enumerate((grid.type, grid.health, grid.rotation, grid.dir_broke)):
+        data[:] = tiles[layer * n:(layer + 1) * n]
+    # built after the tiles are in, so they start from them
+    return grid, Projectiles(grid), FlowField(grid), stage.home
+
+
+class History:
+    """The last ``size`` ticks of a game, for rewinding: a full snapshot every ``every`` ticks, deltas in between."""
+
+    def __init__(self, size: int = 600, every: int = 60):
+        self.snapshots: deque[Snapshot] = deque(maxlen=size)
+        self.every = every
+        self.base: Snapshot | None = None
+
+    def __len__(self) -> int:
+        return len(self.snapshots)
+
+    def record(self, sim) -> None:
+        """Call once per tick, before stepping."""
+        base = self.base
+        if base is None or base.grid is not sim.grid or sim.frame_count - base.frame >= self.every:
+            self.base = snap = take_snapshot(sim)
+        else:
+            snap = take_snapshot(sim, base)
+        self.snapshots.append(snap)
+
+    def rewind(self, sim, ticks: int = 1) -> int:
+        """Goes back ``ticks`` recorded ticks, or as far as the history reaches; returns how many."""
+        ticks = min(ticks, len(self.snapshots))
+        if not ticks:
+            return 0
+        for _ in range(ticks - 1):
+            self.snapshots.pop()
+        restore_snapshot(sim, self.snapshots.pop())
+        self.base = None
+        return ticks
+
+    def clear(self) -> None:
+        self.snapshots.clear()
+        self.base = None
@@ -0,0 +1,293 @@
+"""Procedural stage generator.
+
+``generate(seed, spec)`` lays out a stage in the same codes as
+``stage_data.json``: random terrain (bricks, stone, water, forest, mirrors),
+home at the bottom centre behind a brick wall, the player beside it, enemy
+spawners along the top and powerup spawners scattered in between. A
+``StageSpec`` holds the knobs; ``spec_for(difficulty)`` derives one from a
+single 0..1 number.
+
+Every stage is checked before it is kept, and rerolled until it passes:
+
+* every enemy spawner can reach home, and the player can reach every powerup
+  spawner. Bricks count as passable since they can be shot down. Reachability
+  is a flood fill over the whole map at once: the passable cells are bits of
+  one int (rows padded with a zero bit so shifts don't wrap), and each step
+  ORs in the four shifted copies of what is reached so far.
+* no bullet can be caught circling between mirrors forever. A bullet leaving
+  a mirror only matters at the next mirror or solid tile in its way, found by
+  bisecting per-row and per-column lists of those cells. Mirrors are
+  reversible, so no state has two predecessors: a walk from a state either
+  comes back to it (a loop) or ends, and each state is walked once.
+
+Stages are encoded as they are made and written as one pack::
+
+    python stagegen.py OUT.bin --count 10000 --seed 0 --difficulty 0.5 --size 11x11 --workers 8
+"""
+import multiprocessing
+import random
+import re
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+
+from grid import WALKABLE, TILE_BRICK
+from stages import (
+    Stage, StageError, CODE_EMPTY, CODE_PLAYER, CODE_HOME, ENEMY_SPAWNS, POWERUP_SPAWNS, TYPE_OF, HEALTH_OF, ROTATION_OF,
+    index_spawns, validate, compile_stage, encode_stage, write_records,
+)
+from trajectory import DELTAS, TURN
+
+CODE_FOREST = 11
+CODE_WATER = 13
+CODE_STONE = 14
+CODE_BRICK = 15
+CODE_MIRRORS = (16, 17)
+CODE_ENEMY_SPAWNERS = (2, 18, 19, 20)  # Normie, Health, Attack, Speed
+CODE_POWERUP_SPAWNERS = tuple(POWERUP_SPAWNS)
+
+# translate() tables, stage code -> b'1' / b'0': tanks can (eventually) get through; is an enemy spawner; ...
+PASSABLE = bytes(b'01'[WALKABLE[TYPE_OF[code]] or TYPE_OF[code] == TILE_BRICK] for code in range(256))
+ENEMY_SPAWNER = bytes(b'01'[code in ENEMY_SPAWNS] for code in range(256))
+POWERUP_SPAWNER = bytes(b'01'[code in POWERUP_SPAWNS] for code in range(256))
+
+# stage code -> what it does to a bullet: 0 nothing, 1 stops it, 2 + rotation code for a mirror
+BULLET_STOP = 1
+BULLET = bytes(BULLET_STOP if HEALTH_OF[code] else 2 + ROTATION_OF[code] if ROTATION_OF[code] else 0 for code in range(256))
+SOLID = re.compile(rb'[^\x00]')
+
+# make_stage terrain, as stage codes and their share of the map
+TERRAIN = [(0, 55), (15, 15), (11, 10), (13, 6), (14, 6), (16, 2), (17, 2)]
+
+
+@dataclass(slots=True)
+class StageSpec:
+    rows: int = 11
+    cols: int = 11
+    # share of cells per terrain type; the rest is floor
+    brick: float = 0.30
+    stone: float = 0.06
+    water: float = 0.05
+    forest: float = 0.08
+    mirror: float = 0.02
+    enemy_spawners: int = 2
+    special_enemies: float = 0.0  # chance a spawner makes Health/Attack/Speed tanks instead of Normies
+    powerup_spawners: int = 3
+    attempts: int = 100
+
+
+def spec_for(difficulty: float, rows: int = 11, cols: int = 11) -> StageSpec:
+    d = min(1.0, max(0.0, difficulty))
+    return StageSpec(
+        rows, cols,
+        brick=0.35 - 0.1 * d, stone=0.03 + 0.09 * d, water=0.03 + 0.07 * d, mirror=0.01 + 0.03 * d,
+        enemy_spawners=1 + round(3 * d), special_enemies=d, powerup_spawners=max(1, 4 - round(3 * d)),
+    )
+
+
+def bits(tiles: bytes, c: int, table: bytes) -> int:
+    """The cells ``table`` marks b'1', as bits of an int; cell (i, j) is bit i * (c + 1) + j."""
+    marks = tiles.translate(table)
+    return int(b'0'.join([marks[k:k + c] for k in range(0, len(marks), c)])[::-1], 2)
+
+
+def bit(k: int, c: int) -> int:
+    return 1 << (k // c * (c + 1) + k % c)
+
+
+def flood(seed: int, mask: int, c: int) -> int:
+    """All bits of ``mask`` connected to ``seed`` (which must be in it) through the four neighbours."""
+    w = c + 1
+    reach = seed
+    while (grown := (reach | reach << 1 | reach >> 1 | reach << w | reach >> w) & mask) != reach:
+        reach = grown
+    return reach
+
+
+def mirror_loop(tiles: bytes, r: int, c: int) -> int | None:
+    """A mirror cell a bullet could circle through forever, if there is one."""
+    kinds = tiles.translate(BULLET)
+    rows: dict[int, list[int]] = {}
+    cols: dict[int, list[int]] = {}
+    mirrors = []
+    for match in SOLID.finditer(kinds):
+        k = match.start()
+        i, j = divmod(k, c)
+        rows.setdefault(i, []).append(j)
+        cols.setdefault(j, []).append(i)
+        if kinds[k] != BULLET_STOP:
+            mirrors.append(k)
+    if len(mirrors) < 4:
+        # a loop needs a turn at each corner
+        return None
+
+    def after(state: int) -> int:
+        """The state a bullet leaving mirror k heading f reaches next, or -1 if it stops or leaves."""
+        k, f = state >> 2, state & 3
+        i, j = divmod(k, c)
+        di, dj = DELTAS[f]
+        if di:
+            line, at = cols[j], i
+        else:
+            line, at = rows[i], j
+        n = bisect_right(line, at) if di + dj > 0 else bisect_left(line, at) - 1
+        if not 0 <= n < len(line):
+            return -1
+        k = line[n] * c + j if di else i * c + line[n]
+        kind = kinds[k]
+        return -1 if kind == BULLET_STOP else k << 2 | TURN[kind - 2][f]
+
+    seen = set()
+    for start in (k << 2 | f for k in mirrors for f in range(4)):
+        if start in seen:
+            continue
+        state = start
+        while True:
+            seen.add(state)
+            state = after(state)
+            if state < 0 or state in seen:
+                break
+        if state == start:
+            return start >> 2
+    return None
+
+
+def playability(stage: Stage) -> list[str]:
+    """What keeps a stage from being played to the end: unreachable spawners, bullet loops."""
+    problems = []
+    tiles, r, c = stage.tiles, stage.r, stage.c
+    player, home = stage.player, stage.home
+    mask = bits(tiles, c, PASSABLE)
+    if home is not None:
+        spawners = bits(tiles, c, ENEMY_SPAWNER)
+        home_bit = bit(home, c)
+        if (stranded := spawners & ~flood(home_bit, mask | home_bit, c)):
+            problems.append(f'{stranded.bit_count()} enemy spawners can\'t reach home')
+    if player is not None:
+        powerups = bits(tiles, c, POWERUP_SPAWNER)
+        if (stranded := powerups & ~flood(bit(player, c), mask, c)):
+            problems.append(f'{stranded.bit_count()} powerup spawners can\'t be reached from the player start')
+    if (k := mirror_loop(tiles, r, c)) is not None:
+        problems.append(f'bullets can loop forever through the mirror at {divmod(k, c)}')
+    return problems
+
+
+def generate(seed: int, spec: StageSpec, level: int = 0) -> tuple[Stage, int]:
+    """A stage that passes ``validate`` and ``playability``, and how many layouts were tried for it."""
+    r, c = spec.rows, spec.cols
+    if r < 5 or c < 5:
+        raise StageError(f'stages need at least 5x5 cells, not {r}x{c}')
+    n = r * c
+    rng = random.Random(seed)
+    codes = (CODE_EMPTY, CODE_BRICK, CODE_STONE, CODE_WATER, CODE_FOREST, *CODE_MIRRORS)
+    weights = (max(0.0, 1 - spec.brick - spec.stone - spec.water - spec.forest - spec.mirror),
+               spec.brick, spec.stone, spec.water, spec.forest, spec.mirror / 2, spec.mirror / 2)
+    h = c // 2
+    home = (r - 1) * c + h
+    fort = (home - 1, home + 1, home - c - 1, home - c, home - c + 1)
+    player = home - 2
+    top = range(min(n // 2, max(c, n // 4)))
+
+    for attempt in range(1, spec.attempts + 1):
+        tiles = bytearray(rng.choices(codes, weights, k=n))
+        tiles[home] = CODE_HOME
+        for k in fort:
+            tiles[k] = CODE_BRICK
+        tiles[player] = CODE_PLAYER
+
+        for k in rng.sample(top, min(len(top), spec.enemy_spawners)):
+            special = rng.random() < spec.special_enemies
+            tiles[k] = rng.choice(CODE_ENEMY_SPAWNERS[1:]) if special else CODE_ENEMY_SPAWNERS[0]
+        free = [k for k in range(n) if tiles[k] == CODE_EMPTY]
+        for k in rng.sample(free, min(len(free), spec.powerup_spawners)):
+            tiles[k] = rng.choice(CODE_POWERUP_SPAWNERS)
+
+        tiles = bytes(tiles)
+        spawn_cells, spawn_codes = index_spawns(tiles)
+        stage = Stage(level, r, c, tiles, spawn_cells, spawn_codes, validate(tiles, spawn_codes))
+        if not stage.problems and not playability(stage):
+            return stage, attempt
+    raise StageError(f'no playable stage from seed {seed} in {spec.attempts} attempts')
+
+
+def make_stage(size: int, spawners: int, seed: int) -> Stage:
+    """A quick random size x size stage, unchecked: home bottom centre, the player above it, spawners anywhere.
+
+    For benchmarks and bots, where any big busy map will do; ``generate`` makes stages fit to play.
+    """
+    rng = random.Random(seed)
+    codes, weights = zip(*TERRAIN)
+    rows = [rng.choices(codes, weights, k=size) for _ in range(size)]
+    home_i, home_j = size - 1, size // 2
+    rows[home_i][home_j] = 12
+    rows[home_i - 2][home_j] = 1
+    rows[home_i - 1][home_j] = 0
+
+    free = [(i, j) for i in range(size) for j in range(size) if rows[i][j] == 0]
+    for n, (i, j) in enumerate(rng.sample(free, min(len(free), spawners + spawners // 4))):
+        # a fifth of them powerup spawners
+        rows[i][j] = (21, 22, 23)[n % 3] if n >= spawners else 2
+    return compile_stage(rows, level=size)
+
+
+_spec: StageSpec | None = None
+
+
+def _init_worker(spec: StageSpec) -> None:
+    global _spec
+    _spec = spec
+
+
+def _encode(job: tuple[int, int]) -> tuple[bytes, int]:
+    level, seed = job
+    stage, attempts = generate(seed, _spec, level)
+    return encode_stage(stage), attempts
+
+
+def generate_pack(path: str, seeds: range, spec: StageSpec, workers: int | None = 1) -> int:
+    """Generates a stage per seed (level n + 1 for the n-th) into one pack; returns the layouts tried."""
+    jobs = [(n + 1, seed) for n, seed in enumerate(seeds)]
+    if workers == 1:
+        _init_worker(spec)
+        results = list(map(_encode, jobs))
+    else:
+        with multiprocessing.Pool(workers, _init_worker, (spec,)) as pool:
+            results = pool.map(_encode, jobs, chunksize=max(1, min(256, len(jobs) // (4 * (workers or 8)))))
+    write_records([record for record, _ in results], path)
+    return sum(attempts for _, attempts in results)
+
+
+def main(argv: list[str]) -> int:
+    options: dict[str, str] = {}
+    args = []
+    rest = iter(argv)
+    for arg in rest:
+        if arg.startswith('--'):
+            options[arg] = next(rest, '')
+        else:
+            args.append(arg)
+    if len(args) != 1:
+        print('usage: python stagegen.py OUT.bin [--count N] [--seed FIRST] [--difficulty 0..1] [--size RxC] [--workers N]')
+        return 2
+
+    r, _, c = options.get('--size', '11x11').partition('x')
+    spec = spec_for(float(options.get('--difficulty', 0.5)), int(r), int(c or r))
+    first = int(options.get('--seed', 0))
+    seeds = range(first, first + int(options.get('--count', 1000)))
+    workers = int(options['--workers']) if '--workers' in options else None
+
+    start = time.perf_counter()
+    try:
+        attempts = generate_pack(args[0], seeds, spec, workers)
+    except StageError as error:
+        print(error)
+        return 1
+    elapsed = time.perf_counter() - start
+    print(f'wrote {len(seeds)} stages to {args[0]} in {elapsed:.2f}s ({len(seeds) / elapsed:.0f}/s), '
+          f'{attempts - len(seeds)} layouts rejected')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,317 @@
+"""Stage compiler and loader.
+
+``stage_data.json`` holds each stage as rows of integer codes. The compiler
+turns them into a packed binary file with one byte per cell plus an index of
+the cells that need more than a tile (player start, home, spawners), and
+checks each stage for unknown codes and a missing player or home. A compiled
+file is memory-mapped and each stage is decoded only when it is asked for, so
+packs with hundreds of large stages open instantly.
+
+File layout (little-endian)::
+
+    header   b'BCSP', u16 version, u16 0, u32 stage count
+    index    per stage: u32 offset, u32 length
+    stage    u16 level, u16 rows, u16 cols, u16 spawn count,
+             rows * cols tile codes (u8), spawn cells (u32 each), spawn codes (u8 each)
+
+Run ``python stages.py stage_data.json stage_data.bin`` to compile.
+"""
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Sequence
+from typing import Literal
+
+from entities import Powerup
+from grid import (
+    Grid, TILE_FOREST, TILE_HOME, TILE_WATER, TILE_STONE, TILE_BRICK, TILE_MIRROR, TILE_ENEMY_SPAWNER, TILE_POWERUP_SPAWNER,
+    ROT_BACKSLASH, ROT_SLASH,
+)
+
+MAGIC = b'BCSP'
+VERSION = 1
+HEADER = struct.Struct('<4sHHI')
+ENTRY = struct.Struct('<II')
+STAGE_HEADER = struct.Struct('<HHHH')
+
+CODE_EMPTY = 0
+CODE_PLAYER = 1
+CODE_HOME = 12
+
+# code -> (tile type, health, rotation)
+TILES: dict[int, tuple[int, int, int]] = {
+    0: (0, 0, 0),
+    1: (0, 0, 0),
+    2: (TILE_ENEMY_SPAWNER, 0, 0),
+    11: (TILE_FOREST, 0, 0),
+    12: (TILE_HOME, 1, 0),
+    13: (TILE_WATER, 0, 0),
+    14: (TILE_STONE, 1, 0),
+    15: (TILE_BRICK, 2, 0),
+    16: (TILE_MIRROR, 0, ROT_BACKSLASH),
+    17: (TILE_MIRROR, 0, ROT_SLASH),
+    18: (TILE_ENEMY_SPAWNER, 0, 0),
+    19: (TILE_ENEMY_SPAWNER, 0, 0),
+    20: (TILE_ENEMY_SPAWNER, 0, 0),
+    21: (TILE_POWERUP_SPAWNER, 0, 0),
+    22: (TILE_POWERUP_SPAWNER, 0, 0),
+    23: (TILE_POWERUP_SPAWNER, 0, 0),
+}
+ENEMY_SPAWNS: dict[int, Literal['Health', 'Attack', 'Speed', 'Normie']] = {2: 'Normie', 18: 'Health', 19: 'Attack', 20: 'Speed'}
+POWERUP_SPAWNS: dict[int, tuple[Literal['health', 'bullet', 'shield'], int]] = {21: ('bullet', 3), 22: ('shield', 7), 23: ('health', 1)}
+SPAWN_CODES = (CODE_PLAYER, CODE_HOME, *ENEMY_SPAWNS, *POWERUP_SPAWNS)
+
+# bytes.translate tables, stage code -> grid array value
+TYPE_OF = bytes(TILES.get(code, (0, 0, 0))[0] for code in range(256))
+HEALTH_OF = bytes(TILES.get(code, (0, 0, 0))[1] for code in range(256))
+ROTATION_OF = bytes(TILES.get(code, (0, 0, 0))[2] for code in range(256))
+SANITIZE = bytes(code if code in TILES else CODE_EMPTY for code in range(256))
+
+
+class StageError(ValueError):
+    pass
+
+
+class Stage:
+    """One decoded stage: packed tile codes plus the spawn index."""
+
+    __slots__ = ('level', 'r', 'c', 'tiles', 'spawn_cells', 'spawn_codes', 'problems')
+
+    def __init__(self, level: int, r: int, c: int, tiles: bytes, spawn_cells: array, spawn_codes: bytes, problems: list[str] | None = None):
+        self.level = level
+        self.r = r
+        self.c = c
+        self.tiles = tiles
+        self.spawn_cells = spawn_cells
+        self.spawn_codes = spawn_codes
+        self.problems: list[str] = problems or []
+
+    def spawns(self, code: int) -> list[int]:
+        return [k for k, spawn_code in zip(self.spawn_cells, self.spawn_codes) if spawn_code == code]
+
+    @property
+    def player(self) -> int | None:
+        return next(iter(self.spawns(CODE_PLAYER)), None)
+
+    @property
+    def home(self) -> int | None:
+        return next(iter(self.spawns(CODE_HOME)), None)
+
+    def __repr__(self) -> str:
+        return f'Stage {self.level} ({self.r}x{self.c}, {len(self.spawn_codes)} spawns)'
+
+
+def index_spawns(tiles: bytes) -> tuple[array, bytes]:
+    cells = array('I')
+    codes = bytearray()
+    for code in SPAWN_CODES:
+        needle = bytes((code,))
+        k = tiles.find(needle)
+        while k != -1:
+            cells.append(k)
+            codes.append(code)
+            k = tiles.find(needle, k + 1)
+    return cells, bytes(codes)
+
+
+def validate(tiles: bytes, spawn_codes: bytes) -> list[str]:
+    problems = []
+    if unknown := sorted(set(tiles) - TILES.keys()):
+        problems.append(f'unknown tile codes {unknown}')
+    players = spawn_codes.count(CODE_PLAYER)
+    if players == 0:
+        problems.append('no player start (code 1)')
+    elif players > 1:
+        problems.append(f'{players} player starts (code 1)')
+    if CODE_HOME not in spawn_codes:
+        problems.append('no home (code 12)')
+    return problems
+
+
+def compile_stage(rows: list[list[int]], level: int = 0) -> Stage:
+    """Packs JSON rows into a Stage. Unknown codes are recorded as problems and read as floor."""
+    if not rows or not rows[0]:
+        raise StageError(f'stage {level} is empty')
+    r, c = len(rows), len(rows[0])
+    if any(len(row) != c for row in rows):
+        raise StageError(f'stage {level} is not rectangular')
+    try:
+        raw = bytes(code for row in rows for code in row)
+    except (TypeError, ValueError):
+        raise StageError(f'stage {level} has codes that are not integers in 0..255')
+
+    _, spawn_codes = index_spawns(raw)
+    problems = validate(raw, spawn_codes)
+    tiles = raw.translate(SANITIZE)
+    spawn_cells, spawn_codes = index_spawns(tiles)
+    return Stage(level, r, c, tiles, spawn_cells, spawn_codes, problems)
+
+
+def encode_stage(stage: Stage) -> bytes:
+    return b''.join((
+        STAGE_HEADER.pack(stage.level, stage.r, stage.c, len(stage.spawn_codes)),
+        stage.tiles,
+        stage.spawn_cells.tobytes() if sys.byteorder == 'little' else _swapped(stage.spawn_cells).tobytes(),
+        stage.spawn_codes,
+    ))
+
+
+def _swapped(cells: array) -> array:
+    cells = array('I', cells)
+    cells.byteswap()
+    return cells
+
+
+def decode_stage(data: bytes) -> Stage:
+    level, r, c, spawn_count = STAGE_HEADER.unpack_from(data)
+    start = STAGE_HEADER.size
+    tiles = data[start:start + r * c]
+    start += r * c
+    spawn_cells = array('I')
+    spawn_cells.frombytes(data[start:start + 4 * spawn_count])
+    if sys.byteorder != 'little':
+        spawn_cells.byteswap()
+    start += 4 * spawn_count
+    spawn_codes = data[start:start + spawn_count]
+    return Stage(level, r, c, tiles, spawn_cells, spawn_codes, validate(tiles, spawn_codes))
+
+
+def write_pack(stages: list[Stage], path: str) -> None:
+    write_records([encode_stage(stage) for stage in stages], path)
+
+
+def write_records(records: Sequence[bytes], path: str) -> None:
+    """Writes stages already encoded with ``encode_stage`` as a pack.
+
+    The pack is written next to ``path`` and renamed over it, so a write cut
+    short never leaves a half-written pack where a loader would find it.
+    """
+    offset = HEADER.size + ENTRY.size * len(records)
+    index = []
+    for record in records:
+        index.append(ENTRY.pack(offset, len(record)))
+        offset += len(record)
+    partial = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(partial, 'wb') as file:
+            file.write(HEADER.pack(MAGIC, VERSION, 0, len(records)))
+            file.writelines(index)
+            file.writelines(records)
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+
+class StagePack(Sequence):
+    """A compiled stage file, memory-mapped; stages are decoded on access."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._map) < HEADER.size:
+            raise StageError(f'{path} is not a version {VERSION} stage pack')
+        magic, version, _, self._count = HEADER.unpack_from(self._map)
+        if magic != MAGIC or version != VERSION:
+            raise StageError(f'{path} is not a version {VERSION} stage pack')
+        end = HEADER.size + ENTRY.size * self._count
+        if self._count and end <= len(self._map):
+            end = sum(ENTRY.unpack_from(self._map, end - ENTRY.size))
+        if end > len(self._map):
+            raise StageError(f'{path} is cut short')
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> Stage:
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        offset, length = ENTRY.unpack_from(self._map, HEADER.size + ENTRY.size * index)
+        return decode_stage(self._map[offset:offset + length])
+
+    def close(self) -> None:
+        self._map.close()
+
+
+def read_json(path: str) -> list[Stage]:
+    # imported here: starts that map a compiled pack never need it
+    import json
+    with open(path, 'r') as file:
+        data = json.load(file)
+    return [compile_stage(stage['stage'], stage.get('level', n + 1)) for n, stage in enumerate(data['STAGE'])]
+
+
+def load_stages(path: str, cache: bool = False) -> Sequence[Stage]:
+    """Opens a stage file, preferring an up-to-date compiled ``.bin`` next to a ``.json``.
+
+    With ``cache``, a missing, stale or unreadable ``.bin`` is written from
+    the ``.json`` so later starts map it instead of parsing JSON. As with the
+    ``stages.py`` command, stages with problems are still returned but never
+    written.
+    """
+    root, ext = os.path.splitext(path)
+    if ext == '.json':
+        compiled = root + '.bin'
+        if os.path.exists(compiled) and os.path.getmtime(compiled) >= os.path.getmtime(path):
+            try:
+                return StagePack(compiled)
+            except (StageError, OSError, ValueError):
+                # e.g. an empty file; compiled again below
+                pass
+        stages = read_json(path)
+        if cache and not any(stage.problems for stage in stages):
+            try:
+                write_pack(stages, compiled)
+            except OSError:
+                # e.g. a read-only install; JSON it is
+                pass
+        return stages
+    return StagePack(path)
+
+
+def load_grid(stage: Stage) -> Grid:
+    """Builds a Grid from a stage with one translate per array instead of per-cell branching."""
+    grid = Grid(stage.r, stage.c)
+    grid.type[:] = stage.tiles.translate(TYPE_OF)
+    grid.health[:] = stage.tiles.translate(HEALTH_OF)
+    grid.rotation[:] = stage.tiles.translate(ROTATION_OF)
+
+    c = stage.c
+    for k, code in zip(stage.spawn_cells, stage.spawn_codes):
+        if code in ENEMY_SPAWNS:
+            grid.enemy_spawn_spots[divmod(k, c)] = ENEMY_SPAWNS[code]
+        elif code in POWERUP_SPAWNS:
+            grid.powerup_spawn_spots[divmod(k, c)] = Powerup(*POWERUP_SPAWNS[code])
+    return grid
+
+
+def main(argv: list[str]) -> int:
+    args = [arg for arg in argv if not arg.startswith('--')]
+    if len(args) != 2:
+        print('usage: python stages.py STAGES.json OUT.bin [--lenient]')
+        return 2
+    source, target = args
+    stages = read_json(source)
+
+    failed = False
+    for stage in stages:
+        for problem in stage.problems:
+            print(f'stage {stage.level}: {problem}')
+            failed = True
+    if failed and '--lenient' not in argv:
+        print('not written; pass --lenient to write it anyway (unknown codes become floor)')
+        return 1
+
+    write_pack(stages, target)
+    print(f'wrote {len(stages)} stages to {target}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,223 @@
+"""Gameplay telemetry: a stream of what happens in a session, written off the game loop.
+
+The simulation reports events (shots, bullets destroying each other, tile
+damage, powerup pickups, enemy spawns, hits and deaths, stage clears, game
+over) to the ``Telemetry`` attached as ``sim.telemetry``. Each one is a fixed
+size record packed into a preallocated ring buffer, so logging an event is a
+``pack_into`` and nothing else. A background thread takes whatever has
+collected every ``interval`` seconds and writes it compressed. The game
+never waits for it. When the ring is full, new events are dropped and
+counted per kind, and the counts go into the stream as ``dropped`` events
+once there is room.
+
+Tile damage and bullet collisions aren't reported from the bullet loop.
+Once per tick they are read from the grid's ``changed_tiles`` journal and
+``Projectiles.collisions``.
+
+Two formats, picked by file name. ``*.jsonl.gz`` is gzipped JSON lines, one
+object per event with named fields. Anything else is a gzipped binary log::
+
+    header   b'BCTL', u16 version, u16 record size
+    records  u32 frame, u8 kind, i32 a, i32 b, i32 c    (see FIELDS)
+
+JSON encoding runs on the writer thread but holds the GIL while it does, so
+the binary log is the one to use for big sessions. Summarize a log with
+``python telemetry.py SESSION.bctl``.
+"""
+import gzip
+import json
+import struct
+import sys
+import threading
+from collections import Counter
+from collections.abc import Iterator
+
+from snapshot import KINDS as TANK_KINDS
+
+MAGIC = b'BCTL'
+VERSION = 1
+HEADER = struct.Struct('<4sHH')
+EVENT = struct.Struct('<IBiii')
+
+EV_SHOT = 0
+EV_COLLISION = 1
+EV_TILE = 2
+EV_POWERUP = 3
+EV_SPAWN = 4
+EV_HIT = 5
+EV_DEATH = 6
+EV_CLEAR = 7
+EV_GAMEOVER = 8
+EV_DROPPED = 9
+
+# kind -> (name, names of fields a, b, c); a shooter or target of -1 is an enemy, else a player number
+FIELDS: list[tuple[str, tuple[str, str, str]]] = [
+    ('shot', ('shooter', 'cell', 'facing')),
+    ('collision', ('count', '', '')),
+    ('tile', ('cell', 'type', 'health')),
+    ('powerup', ('player', 'powerup', 'intensity')),
+    ('spawn', ('tank', 'cell', '')),
+    ('hit', ('target', 'cell', 'health')),
+    ('death', ('tank', 'cell', 'kills')),
+    ('clear', ('stage', 'score', 'kills')),
+    ('gameover', ('stage', 'score', 'kills')),
+    ('dropped', ('kind', 'events', '')),
+]
+POWERUPS = ['bullet', 'shield', 'health']
+POWERUP_CODES = {name: code for code, name in enumerate(POWERUPS)}
+ENEMY = -1
+
+
+class Telemetry:
+    """Ring buffer of events plus the thread that writes them out; attach with ``open``."""
+
+    def __init__(self, file, binary: bool = True, capacity: int = 1 << 16, interval: float = 0.25):
+        self.file = file
+        self.binary = binary
+        self.capacity = capacity
+        self.interval = interval
+        self.ring = bytearray(capacity * EVENT.size)
+        # events ever written (by the game) and taken (by the writer); only the owner moves each
+        self.head: int = 0
+        self.tail: int = 0
+        self.dropped: list[int] = [0] * len(FIELDS)
+        self.reported: list[int] = [0] * len(FIELDS)
+        # journal readers' positions, per grid and per Projectiles
+        self.grid = None
+        self.seen: int = 0
+        self.projectiles = None
+        self.collisions: int = 0
+
+        if binary:
+            file.write(HEADER.pack(MAGIC, VERSION, EVENT.size))
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._write_loop, name='telemetry', daemon=True)
+        self.thread.start()
+
+    @classmethod
+    def open(cls, sim, path: str, **options) -> 'Telemetry':
+        telemetry = cls(gzip.open(path, 'wb', compresslevel=6), binary=not path.endswith('.jsonl.gz'), **options)
+        sim.telemetry = telemetry
+        return telemetry
+
+    def emit(self, frame: int, kind: int, a: int = 0, b: int = 0, c: int = 0) -> None:
+        head = self.head
+        if head - self.tail >= self.capacity:
+            self.dropped[kind] += 1
+            return
+        EVENT.pack_into(self.ring, head % self.capacity * EVENT.size, frame, kind, a, b, c)
+        self.head = head + 1
+
+    def tick(self, sim) -> None:
+        """End of a tick: events read from the grid journal and the bullet collision count."""
+        frame = sim.frame_count
+        grid = sim.grid
+        changed = grid.changed_tiles
+        if grid is not self.grid:
+            self.grid = grid
+            self.seen = len(changed)
+        elif self.seen < len(changed):
+            for k in changed[self.seen:]:
+                self.emit(frame, EV_TILE, k, grid.type[k], grid.health[k])
+            self.seen = len(changed)
+
+        projectiles = sim.projectiles
+        if projectiles is not self.projectiles:
+            self.projectiles = projectiles
+            self.collisions = projectiles.collisions
+        elif projectiles.collisions != self.collisions:
+            self.emit(frame, EV_COLLISION, projectiles.collisions - self.collisions)
+            self.collisions = projectiles.collisions
+
+    def _write_loop(self) -> None:
+        while not self.stopping.wait(self.interval):
+            self._drain()
+
+    def _drain(self) -> None:
+        head, tail = self.head, self.tail
+        size = EVENT.size
+        start, end = tail % self.capacity * size, head % self.capacity * size
+        if head - tail == self.capacity or (head != tail and end <= start):
+            chunk = self.ring[start:] + self.ring[:end]
+        else:
+            chunk = self.ring[start:end]
+        self.tail = head
+
+        dropped = self.dropped
+        for kind, count in enumerate(dropped):
+            if count != self.reported[kind]:
+                chunk += EVENT.pack(0, EV_DROPPED, kind, count - self.reported[kind], 0)
+                self.reported[kind] = count
+        if not chunk:
+            return
+        if self.binary:
+            self.file.write(chunk)
+        else:
+            self.file.write(''.join(json.dumps(as_dict(*event)) + '\n' for event in EVENT.iter_unpack(chunk)).encode())
+
+    def close(self) -> None:
+        if self.file.closed:
+            return
+        self.stopping.set()
+        self.thread.join()
+        self._drain()
+        self.file.close()
+
+
+def as_dict(frame: int, kind: int, a: int, b: int, c: int) -> dict:
+    name, fields = FIELDS[kind]
+    event = {'frame': frame, 'event': name}
+    for field, value in zip(fields, (a, b, c)):
+        if field:
+            event[field] = value
+    if kind in (EV_SPAWN, EV_DEATH):
+        event['tank'] = TANK_KINDS[a]
+    elif kind == EV_POWERUP:
+        event['powerup'] = POWERUPS[b]
+    elif kind == EV_DROPPED:
+        event['kind'] = FIELDS[a][0]
+    return event
+
+
+def read_log(path: str) -> Iterator[dict]:
+    """The events in a log of either format, as dicts."""
+    with gzip.open(path, 'rb') as file:
+        if path.endswith('.jsonl.gz'):
+            for line in file:
+                yield json.loads(line)
+            return
+        magic, version, size = HEADER.unpack(file.read(HEADER.size))
+        if magic != MAGIC or version != VERSION or size != EVENT.size:
+            raise ValueError(f'{path} is not a version {VERSION} telemetry log')
+        data = file.read()
+    # a session killed mid-write may end in a partial record
+    for event in EVENT.iter_unpack(data[:len(data) - len(data) % size]):
+        yield as_dict(*event)
+
+
+def summarize(path: str) -> str:
+    counts: Counter = Counter()
+    dropped: Counter = Counter()
+    last = 0
+    for event in read_log(path):
+        counts[event['event']] += 1
+        last = max(last, event['frame'])
+        if event['event'] == 'dropped':
+            dropped[event['kind']] += event['events']
+    lines = [f'{sum(counts.values())} events over {last} ticks']
+    lines.extend(f'  {name:10} {counts[name]:9}' for name, _ in FIELDS if counts[name])
+    if dropped:
+        lines.append('  dropped: ' + ', '.join(f'{name} {n}' for name, n in dropped.items()))
+    return '\n'.join(lines)
+
+
+def main(argv: list[str]) -> int:
+    if len(argv) != 1:
+        print('usage: python telemetry.py SESSION.bctl|SESSION.jsonl.gz')
+        return 2
+    print(summarize(argv[0]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
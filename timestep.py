@@ -0,0 +1,70 @@
+"""Fixed-timestep pacing for the front end.
+
+Pyxel calls ``update`` and ``draw`` once per frame, and when a frame runs
+late the next one simply starts late. Stepping the simulation once per
+``update`` would then slow the whole game down. ``FixedStep`` keeps its own
+wall-clock accumulator instead. Each frame, ``begin`` says how many ticks of
+``1 / fps`` seconds are due, which can be several when behind or none when
+ahead. ``end`` says whether to draw: a frame whose ticks overran ``budget``
+isn't drawn, so the time goes to catching up, but never more than
+``max_skip`` frames in a row. At most ``max_ticks`` run per frame. Past that
+the backlog is dropped (``dropped`` counts it) and the game slows down
+rather than falling further behind each frame.
+
+``alpha`` is how far the clock is past the last tick, in ticks (0..1), for
+drawing moving things part way to where they're going.
+"""
+from time import perf_counter
+from typing import Callable
+
+
+class FixedStep:
+
+    def __init__(self, fps: int, max_ticks: int = 5, max_skip: int = 3, budget: float | None = None, clock: Callable[[], float] = perf_counter):
+        self.dt = 1 / fps
+        self.max_ticks = max_ticks
+        self.max_skip = max_skip
+        self.budget = self.dt if budget is None else budget  # seconds of ticking after which a frame isn't drawn
+        self.clock = clock
+        self.lag: float = 0.0
+        self.last: float | None = None
+        self.started: float = 0.0
+        self.behind: bool = False
+        self.skipped: int = 0  # frames in a row not drawn
+        self.draw_due: bool = True
+        # totals, for the profiler overlay and benchmarks
+        self.ticks: int = 0
+        self.frames_skipped: int = 0
+        self.dropped: int = 0
+
+    def begin(self) -> int:
+        """Starts a frame; returns how many ticks to run in it."""
+        now = self.started = self.clock()
+        self.lag += self.dt if self.last is None else now - self.last
+        self.last = now
+        ticks = int(self.lag / self.dt)
+        self.behind = ticks > self.max_ticks
+        if self.behind:
+            self.dropped += ticks - self.max_ticks
+            ticks = self.max_ticks
+            self.lag = self.lag % self.dt
+        else:
+            self.lag -= ticks * self.dt
+        self.ticks += ticks
+        return ticks
+
+    def end(self) -> bool:
+        """Ends the frame's ticks; returns whether to draw it."""
+        late = self.behind or self.clock() - self.started > self.budget
+        if late and self.skipped < self.max_skip:
+            self.skipped += 1
+            self.frames_skipped += 1
+            self.draw_due = False
+        else:
+            self.skipped = 0
+            self.draw_due = True
+        return self.draw_due
+
+    @property
+    def alpha(self) -> float:
+        return min(1.0, self.lag / self.dt)
@@ -0,0 +1,99 @@
+"""Precomputed bullet trajectories.
+
+A bullet's state is ``cell * 4 + facing``: the cell it is in and the way it
+was heading when it got there. Where it goes next only depends on that cell's
+mirror and tile health, so ``trans`` caches one transition per state:
+
+* ``>= 0``: the next state (the bullet moves on, maybe after a mirror turn)
+* ``EXIT``: the bullet leaves the map
+* ``-2 - facing``: a tile with health stops it; ``facing`` is its heading then
+
+Transitions are filled in lazily. ``path`` follows them to the end and caches
+the whole trajectory, so questions like "does this shot reach home" are one
+lookup. Both caches are invalidated per cell from the grid's ``changed_tiles``
+journal, e.g. when a brick is destroyed.
+"""
+from array import array
+
+# (di, dj) per facing code N E S W
+DELTAS: list[tuple[int, int]] = [(-1, 0), (0, 1), (1, 0), (0, -1)]
+
+# new facing after entering a cell, indexed by the grid's rotation code (none, '\\', '/')
+TURN: list[bytes] = [bytes((0, 1, 2, 3)), bytes((3, 2, 1, 0)), bytes((1, 0, 3, 2))]
+
+EXIT = -1
+LOOP = -6  # path() only: the bullet cycles through mirrors forever
+UNKNOWN = -7
+
+
+class Trajectories:
+
+    def __init__(self, grid):
+        self.grid = grid
+        self.trans = array('l', [UNKNOWN]) * (4 * grid.r * grid.c)
+        self.paths: dict[int, tuple[tuple[int, ...], int]] = {}
+        self.through: dict[int, set[int]] = {}
+        self.seen: int = len(grid.changed_tiles)
+
+    def sync(self) -> None:
+        """Drops everything that depended on a tile that changed since the last sync."""
+        changed = self.grid.changed_tiles
+        if self.seen < len(changed):
+            for k in changed[self.seen:]:
+                self.invalidate(k)
+            self.seen = len(changed)
+
+    def invalidate(self, k: int) -> None:
+        base = k * 4
+        for f in range(4):
+            self.trans[base + f] = UNKNOWN
+        for state in self.through.pop(k, ()):
+            self.paths.pop(state, None)
+
+    def resolve(self, state: int) -> int:
+        grid = self.grid
+        c = grid.c
+        k = state >> 2
+        f = TURN[grid.rotation[k]][state & 3]
+
+        if grid.health[k]:
+            t = -2 - f
+        else:
+            di, dj = DELTAS[f]
+            i, j = k // c + di, k % c + dj
+            t = (i * c + j) << 2 | f if 0 <= i < grid.r and 0 <= j < c else EXIT
+
+        self.trans[state] = t
+        return t
+
+    def next(self, state: int) -> int:
+        t = self.trans[state]
+        return self.resolve(state) if t == UNKNOWN else t
+
+    def path(self, k: int, facing: int) -> tuple[tuple[int, ...], int]:
+        """Cells a bullet in cell k heading ``facing`` passes through, and how it ends.
+
+        The end is EXIT, LOOP or a stop code (see module docstring); for a stop
+        the last cell of the path is the tile that stops it.
+        """
+        self.sync()
+        start = k << 2 | facing
+        if cached := self.paths.get(start):
+            return cached
+
+        cells = [k]
+        visited = {start}
+        state = start
+        while (t := self.next(state)) >= 0:
+            if t in visited:
+                t = LOOP
+                break
+            visited.add(t)
+            cells.append(t >> 2)
+            state = t
+
+        result = (tuple(cells), t)
+        self.paths[start] = result
+        for cell in result[0]:
+            self.through.setdefault(cell, set()).add(start)
+        return result
@@ -0,0 +1,176 @@
+"""Many games stepped together, Gym style, for training agents.
+
+``VecEnv(n)`` holds n independent headless games and ``step(actions)``
+advances all of them by one action each. Results come back in flat buffers
+that are reused from step to step:
+
+* ``obs``: uint8, shape (n, len(CHANNELS), rows, cols) in C order, where
+  rows/cols are the largest stage's size and smaller stages are zero-padded.
+  Channels are tile type, tile health, tank (1 player, 2 enemy), bullet
+  (facing code + 1) and powerup (1 bullet, 2 shield, 3 health).
+* ``rewards``: float32 per game; ``dones``: one byte per game.
+
+With NumPy around, ``np.frombuffer(env.obs, np.uint8).reshape(env.shape)``
+views the observations without copying.
+
+Observations are patched rather than rebuilt: terrain comes from the grid's
+``changed_tiles`` journal, and tanks, bullets and powerups clear only the
+cells they marked the step before. A finished game is reset right away
+(``infos`` carries its return and length), so the observation it returns is
+the first one of the next episode.
+"""
+from array import array
+from random import Random
+
+from engine import Simulation, SCENE_PLAY, SCENE_STAGE_CLEAR, SCENE_GAMEOVER, BTN_UP, BTN_DOWN, BTN_LEFT, BTN_RIGHT, BTN_SHOOT, BTN_CONFIRM
+from stages import Stage, StageError, load_stages
+
+STAGE_FILE = 'stage_data.json'
+
+ACTIONS = [0, BTN_UP, BTN_DOWN, BTN_LEFT, BTN_RIGHT, BTN_SHOOT]
+CHANNELS = ('tile', 'health', 'tank', 'bullet', 'powerup')
+TANK_PLAYER = 1
+TANK_ENEMY = 2
+POWERUP_CODES = {'bullet': 1, 'shield': 2, 'health': 3}
+
+REWARD_KILL = 1.0
+REWARD_CLEAR = 10.0
+REWARD_HIT = -1.0  # per point of health the player loses
+REWARD_HOME_LOST = -10.0
+
+
+class VecEnv:
+
+    def __init__(self, num_envs: int, stage_file: str = STAGE_FILE, seed: int = 0, frame_skip: int = 1, max_steps: int = 10_000, ai: str = 'random'):
+        # stages without a player start can't be played; the rest are, in file order
+        self.stages: list[Stage] = [stage for stage in load_stages(stage_file) if stage.player is not None]
+        if not self.stages:
+            raise StageError(f'no playable stages in {stage_file}')
+        self.num_envs = num_envs
+        self.frame_skip = frame_skip
+        self.max_steps = max_steps
+        self.ai = ai
+        self.rng = Random(seed)
+
+        self.rows = max(stage.r for stage in self.stages)
+        self.cols = max(stage.c for stage in self.stages)
+        self.plane = self.rows * self.cols
+        self.shape = (num_envs, len(CHANNELS), self.rows, self.cols)
+        self.obs = bytearray(num_envs * len(CHANNELS) * self.plane)
+        self.rewards = array('f', [0.0]) * num_envs
+        self.dones = bytearray(num_envs)
+
+        self.sims: list[Simulation] = [None] * num_envs
+        self.grids: list = [None] * num_envs
+        self.seen: list[int] = [0] * num_envs
+        self.marks: list[list[int]] = [[] for _ in range(num_envs)]
+        self.steps: list[int] = [0] * num_envs
+        self.returns: list[float] = [0.0] * num_envs
+        # (kills, player health, stages cleared) at the end of the last step, for rewards
+        self.last: list[tuple[int, int, int]] = [(0, 0, 0)] * num_envs
+
+    @property
+    def num_actions(self) -> int:
+        return len(ACTIONS)
+
+    def reset(self) -> bytearray:
+        for e in range(self.num_envs):
+            self.reset_env(e)
+        return self.obs
+
+    def reset_env(self, e: int) -> None:
+        sim = self.sims[e] = Simulation(self.stages, seed=self.rng.randrange(1 << 32), ai=self.ai)
+        sim.scene = SCENE_PLAY
+        self.steps[e] = 0
+        self.returns[e] = 0.0
+        self.last[e] = (0, sim.player.health, 0)
+        self.observe(e)
+
+    def step(self, actions) -> tuple[bytearray, array, bytearray, list[dict]]:
+        """Applies one action (an index into ACTIONS) per game; returns (obs, rewards, dones, infos)."""
+        infos: list[dict] = [{} for _ in range(self.num_envs)]
+        rewards, dones = self.rewards, self.dones
+        for e, sim in enumerate(self.sims):
+            buttons = ACTIONS[actions[e]]
+            done = False
+            try:
+                for _ in range(self.frame_skip):
+                    sim.step(buttons | BTN_CONFIRM if sim.scene == SCENE_STAGE_CLEAR else buttons)
+                    if done := self.finished(sim):
+                        break
+            except StageError:
+                # the next stage can't be played
+                done = True
+
+            kills, health, cleared = self.last[e]
+            now_cleared = sim.current_stage if sim.scene == SCENE_STAGE_CLEAR else sim.current_stage - 1
+            reward = (REWARD_KILL * (sim.kills - kills) + REWARD_CLEAR * max(0, now_cleared - cleared)
+                      + REWARD_HIT * max(0, health - sim.player.health) + (REWARD_HOME_LOST if not sim.is_home_active else 0.0))
+            self.last[e] = (sim.kills, sim.player.health, max(cleared, now_cleared))
+            self.steps[e] += 1
+            self.returns[e] += reward
+            rewards[e] = reward
+
+            if done or self.steps[e] >= self.max_steps:
+                infos[e] = {'episode_return': self.returns[e], 'episode_length': self.steps[e], 'truncated': not done}
+                dones[e] = 1
+                self.reset_env(e)
+            else:
+                dones[e] = 0
+                self.observe(e)
+        return self.obs, rewards, dones, infos
+
+    def finished(self, sim: Simulation) -> bool:
+        if sim.scene == SCENE_GAMEOVER or not sim.is_home_active or sim.player.health == 0:
+            return True
+        return sim.scene == SCENE_STAGE_CLEAR and sim.current_stage == len(self.stages)
+
+    def observe(self, e: int) -> None:
+        sim = self.sims[e]
+        grid = sim.grid
+        obs = self.obs
+        plane, cols, c = self.plane, self.cols, grid.c
+        base = e * len(CHANNELS) * plane
+        tiles, health = base, base + plane
+
+        if grid is not self.grids[e]:
+            self.grids[e] = grid
+            self.seen[e] = len(grid.changed_tiles)
+            obs[base:base + len(CHANNELS) * plane] = bytes(len(CHANNELS) * plane)
+            self.marks[e] = []
+            if c == cols:
+                obs[tiles:tiles + len(grid.type)] = grid.type
+                obs[health:health + len(grid.health)] = grid.health
+            else:
+                for i in range(grid.r):
+                    obs[tiles + i * cols:tiles + i * cols + c] = grid.type[i * c:(i + 1) * c]
+                    obs[health + i * cols:health + i * cols + c] = grid.health[i * c:(i + 1) * c]
+        else:
+            changed = grid.changed_tiles
+            for k in changed[self.seen[e]:]:
+                at = k if c == cols else k // c * cols + k % c
+                obs[tiles + at] = grid.type[k]
+                obs[health + at] = grid.health[k]
+            self.seen[e] = len(changed)
+
+        marks = self.marks[e]
+        for at in marks:
+            obs[at] = 0
+        marks.clear()
+
+        tanks, bullets, powerups = base + 2 * plane, base + 3 * plane, base + 4 * plane
+        player = sim.player
+        marks.append(at := tanks + player.pos.x * cols + player.pos.y)
+        obs[at] = TANK_PLAYER
+        for enemy in sim.enemies:
+            marks.append(at := tanks + enemy.pos.x * cols + enemy.pos.y)
+            obs[at] = TANK_ENEMY
+        projectiles = sim.projectiles
+        for k, facing in zip(projectiles.cell, projectiles.facing):
+            marks.append(at := bullets + (k if c == cols else k // c * cols + k % c))
+            obs[at] = facing + 1
+        layer, objects = grid.powerup, grid.objects
+        for i, j in sim.powerup_spawn_spots:
+            if uid := layer[i * c + j]:
+                marks.append(at := powerups + i * cols + j)
+                obs[at] = POWERUP_CODES.get(objects[uid].type, 0)